@@ -17,7 +17,7 @@ sched = BlockingScheduler()
 
 # schedule the prep_grid3d...
 
-@sched.scheduled_job('cron', minute="6,20,35,50")
+@sched.scheduled_job('cron', minute="0,15,30,45")
 def scheduled_job():
    print("\n  ----> Running prep_grid3d.py at %s <----- \n" % time.strftime("%Y:%m:%d %H:%M"))
    today = time.strftime("%Y%m%d")
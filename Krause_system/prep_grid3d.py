@@ -51,12 +51,22 @@ _ref_min_plot = 20.
 
 _plot_format  = 'png'
 
+# Queue the plots to the low priority plot worker (dart_tools.queue_plot) instead of
+# drawing them before the obs_seq file is written
+
+_plot_async   = True
+
+# Realtime trigger (--wait):  seconds between checks of the input directory
+
+_wait_poll    = 5.0
+
 ##########################################################################################
 # Parameter dict for reflectivity masking
 
 _grid_dict = {
               'zero_dbz_obtype' : True,
               'thin_grid'       : 1,
+              'superob'         : None,
               'thin_zeros'      : 3,
               'halo_footprint'  : 4,
               'max_height'      : 10000.,
@@ -105,17 +115,103 @@ def get_dir_files(dir, pattern, Quiet=False):
     return filenames
 
 #=========================================================================================
-def compute_window_mean(image, window_w, window_h):
-
-    w, h = image.shape
-    strided_image = np.lib.stride_tricks.as_strided(image, 
-                                                    shape=[w - window_w + 1, h - window_h + 1, window_w, window_h],
-                                                    strides=image.strides + image.strides)
-    # important: trying to reshape image will create complete 4-dimensional compy
-    means = strided_image.mean(axis=(2,3)) 
-    maximums = strided_image.max(axis=(2,3))
-    
-    return means, maximums
+# The last grid3d file within [-4,+5] min of the analysis time, or None
+
+def find_realtime_file(dir, pattern, a_time):
+
+    last_file = None
+
+    for file in get_dir_files(dir, pattern, Quiet=True):
+        f_time = DT.datetime.strptime(os.path.basename(file)[-18:-3], "%Y%m%d-%H%M%S")
+        if (f_time > a_time - DT.timedelta(minutes = 4)) and (f_time <= a_time + DT.timedelta(minutes = 5)):
+            last_file = file
+
+    return last_file
+
+#=========================================================================================
+# Realtime trigger:  poll the input directory until a grid3d file at or after the analysis
+# time (within +5 min) is there, and return the one closest to the analysis time.  Only at
+# the deadline (a datetime, UTC) fall back to the last file within [-4,+5] min, or None,
+# so the file of the previous cycle is not taken while the current one is still coming.
+
+def wait_for_file(dir, pattern, a_time, deadline, poll=_wait_poll):
+
+    while True:
+        try:
+            files = []
+            for file in get_dir_files(dir, pattern, Quiet=True):
+                f_time = DT.datetime.strptime(os.path.basename(file)[-18:-3], "%Y%m%d-%H%M%S")
+                if (f_time >= a_time) and (f_time <= a_time + DT.timedelta(minutes = 5)):
+                    files.append((f_time, file))
+        except (IndexError, ValueError):
+            files = []
+
+        if len(files) > 0:
+            return min(files)[1]
+
+        if DT.datetime.utcnow() >= deadline:
+            try:
+                return find_realtime_file(dir, pattern, a_time)
+            except (IndexError, ValueError):
+                return None
+
+        timeit.sleep(max(min(poll, (deadline - DT.datetime.utcnow()).total_seconds()), 0.))
+
+#=========================================================================================
+# Read a grid3d file:  the domain = (lat, lon, nx, ny) hyperslab (the whole grid when None)
+# is read in a single read of the reflectivity, the composite (column maximum, which sets
+# the zero dBZ mask) is taken over all the levels of that buffer, and only the selected
+# levels (indices of the Ht dimension, all levels when None) are kept.  The file indices
+# of the kept levels are returned in "levels".
+
+def read_grid3d_file(filename, levels=None, domain=None, time=None):
+
+    f       = ncdf.Dataset(filename, "r")
+    missing = f.MissingData
+    nlon    = len(f.dimensions['Lon'])
+    nlat    = len(f.dimensions['Lat'])
+    nlvl    = len(f.dimensions['Ht'])
+    lons    = f.variables['Lon'][...]
+    lats    = f.variables['Lat'][...]
+    msl     = f.variables['Height'][...]
+    height0 = f.Height
+
+    if levels == None:
+        levels = range(nlvl)
+    else:
+        selected = sorted(set(k for k in levels if k < nlvl))
+        if len(selected) < len(levels):
+            print("\n read_grid3d_file:  %s has %d levels, only keeping levels %s\n" % (filename, nlvl, selected))
+        levels = selected
+
+    if domain != None:
+        jc = np.abs(lats - domain[0]).argmin()
+        ic = np.abs(lons - domain[1]).argmin()
+        nx, ny = int(domain[2]), int(domain[3])
+        i0, i1 = max(ic-nx/2, 0), min(ic-nx/2+nx, nlon)
+        j0, j1 = max(jc-ny/2, 0), min(jc-ny/2+ny, nlat)
+    else:
+        i0, i1 = 0, nlon
+        j0, j1 = 0, nlat
+
+# Read all the levels in one hyperslab:  the variable is compressed in chunks holding
+# several levels, so reading the levels one by one (or with a list index, which netCDF4
+# does level by level) decodes the same chunks many times
+
+    buffer    = f.variables['ReflectivityQC'][:,j0:j1,i0:i1]
+
+    composite = ma.getdata(buffer).max(axis=0)
+
+    if len(levels) < buffer.shape[0]:
+        buffer = buffer[np.array(levels)]
+
+    ref       = ma.MaskedArray(buffer, mask = (buffer < missing+1.))
+
+    f.close()
+
+    return Gridded_Field(filename, data = ref, field = "REFLECTIVITY", zg = msl[levels], \
+                         lats = lats[j0:j1], lons = lons[i0:i1], radar_hgt = height0, time = time, \
+                         missingData = missing, composite = composite, levels = list(levels) )
 
 #=========================================================================================
 # DBZ Mask
@@ -138,7 +234,10 @@ def dbz_masking(ref, thin_zeros=2):
 
    print(" Number of zeros in the field after thining:  %d\n " % (np.sum(zero_dbz.mask==False)))
    
-   ref.composite = ref.data.data.max(axis=0)
+# The composite of all the file levels is set by read_grid3d_file, otherwise use the levels at hand
+
+   if getattr(ref, 'composite', None) is None:
+       ref.composite = ref.data.data.max(axis=0)
    
    zero_dbz.mask[ ref.composite > _grid_dict['min_dbz_zeros'] ] = True
 
@@ -395,10 +494,19 @@ def main(argv=None):
                            help = "Directory to place output files in")
                            
    parser.add_option("-p", "--plot",      dest="plot",      default=-1,  type="int",      \
-                     help = "Specify a number between 0 and 20 to plot reflectivity")
+                     help = "Specify a level of the file (0 to 20) to plot reflectivity")
                   
    parser.add_option(      "--thin",      dest="thin",      default=1,  type="int",      \
                      help = "Specify a number between 2 and 5 thin reflectivity")
+
+   parser.add_option(      "--wait",      dest="wait",      default=None,  type="int",      \
+                     help = "Realtime trigger:  process as soon as the file is there, waiting at most until WAIT sec after the analysis time")
+
+   parser.add_option(      "--domain",    dest="domain",    default=None, type="float", nargs=4, \
+                     help = "Only read the domain lat lon nx ny out of the grid3d files")
+
+   parser.add_option(      "--superob",   dest="superob",   default=None, type="choice", choices=["mean", "max"], \
+                     help = "With --thin, superob thin x thin blocks (mean or max) instead of subsampling")
                   
    (options, args) = parser.parse_args()
 
@@ -414,6 +522,9 @@ def main(argv=None):
 
    if options.thin > 1:
        _grid_dict['thin_grid'] = options.thin
+
+   if options.superob != None:
+       _grid_dict['superob'] = options.superob
       
    if options.plot < 0:
        plot_grid = False
@@ -436,14 +547,14 @@ def main(argv=None):
 
    if options.realtime != None:
 
-       in_filenames = get_dir_files(options.dir, options.grep, Quiet=True)
-
-       for n, file in enumerate(in_filenames):
-           f_time = DT.datetime.strptime(os.path.basename(file)[-18:-3], "%Y%m%d-%H%M%S")
-           if (f_time > a_time - DT.timedelta(minutes = 4)) and (f_time <= a_time + DT.timedelta(minutes = 5)):
-                last_file    = in_filenames[n]
+       if options.wait != None:
+           last_file = wait_for_file(options.dir, options.grep, a_time, a_time + DT.timedelta(seconds=options.wait))
+       else:
+           last_file = find_realtime_file(options.dir, options.grep, a_time)
 
        try:
+           if last_file == None:
+               raise ValueError(a_time)
            in_filenames = [last_file]
            print("\n prep_grid3d:  RealTime FLAG is true, only processing %s\n" % (in_filenames[:]))
            rlt_filename = "%s_%s" % ("obs_seq_RF", a_time.strftime("%Y%m%d%H%M"))
@@ -485,46 +596,44 @@ def main(argv=None):
           time         = DT.datetime.strptime(file[-18:-3], "%Y%m%d-%H%M%S")
           print(" Out filename:  %s\n" % out_filename)
    
-      f       = ncdf.Dataset(file, "r")
-      missing = f.MissingData
-      nlon    = len(f.dimensions['Lon'])
-      nlat    = len(f.dimensions['Lat'])
-      nlvl    = len(f.dimensions['Ht'])
-      ref     = ma.MaskedArray(f.variables['ReflectivityQC'][...], mask = (f.variables['ReflectivityQC'][...] < missing+1.))
-      lons    = f.variables['Lon'][...]
-      lats    = f.variables['Lat'][...]
-      msl     = f.variables['Height'][...]
-      height0 = f.Height
-      dtime   = (time - DT.datetime(1970, 1, 1, 0, 0)).total_seconds
-
-      f.close()
+      ref_obj = read_grid3d_file(file, levels=_grid_dict['levels'], domain=options.domain, time=time)
    
       print(" Time of file:  %s\n" % time.strftime('%Y-%m-%d %H:%M:%S') )
 
       if _grid_dict['thin_grid'] > 1: 
           thin      = _grid_dict['thin_grid']
-#         ref_thin  = 0.25*(ref[:,::thin,::thin]+ref[:,1::thin,::thin]+ref[:,::thin,1::thin]+ref[:,1::thin,1::thin])
-          ref_thin  = ref[:,::thin,::thin]
-          lats_thin = lats[::thin]
-          lons_thin = lons[::thin]
-          ref_obj = Gridded_Field(file, data = ref_thin, field = "REFLECTIVITY", zg = msl, \
-                                  lats = lats_thin, lons = lons_thin, radar_hgt = height0, time = time ) 
-      else:
-          ref_obj = Gridded_Field(file, data = ref,      field = "REFLECTIVITY", zg = msl, \
-                                  lats = lats, lons = lons, radar_hgt = height0, time = time ) 
+          if _grid_dict['superob'] != None:
+              ref_obj.data, counts = superob_grid(ref_obj.data, thin, method=_grid_dict['superob'])
+              ref_obj.composite    = superob_grid(np.ma.masked_less(ref_obj.composite, ref_obj.missingData+1.), thin, 
+                                                  method=_grid_dict['superob'])[0].filled(ref_obj.missingData)
+              ref_obj.lats = superob_coords(ref_obj.lats, thin)
+              ref_obj.lons = superob_coords(ref_obj.lons, thin)
+              print(" Superobs (%s of %dx%d blocks):  %d, mean number of points per superob:  %4.1f\n" % 
+                    (_grid_dict['superob'], thin, thin, np.sum(counts > 0), counts[counts > 0].mean()))
+          else:
+              ref_obj.data = ref_obj.data[:,::thin,::thin]
+              ref_obj.composite = ref_obj.composite[::thin,::thin]
+              ref_obj.lats = ref_obj.lats[::thin]
+              ref_obj.lons = ref_obj.lons[::thin]
 
       ref_obj = dbz_masking(ref_obj, thin_zeros=_grid_dict['thin_zeros'])
       
-      if plot_grid:
-          fsuffix = "MRMS_%s" % (time.strftime('%Y%m%d%H%M'))
-          plot_filename = os.path.join(options.out_dir, fsuffix)
-          grid_plot(ref_obj, sweep_num, plot_filename = plot_filename)
-
       if options.write == True:      
-          ret = write_DART_ascii(ref_obj, filename=out_filename, levels=_grid_dict['levels'],
+          ret = write_DART_ascii(ref_obj, filename=out_filename, levels=np.arange(ref_obj.data.shape[0]),
                                  obs_error=[_grid_dict['reflectivity'],_grid_dict['0reflectivity']], 
                                  QC_info=_grid_dict['QC_info'])
 
+# The plot level is a level of the file, find it among the levels kept (or the closest one)
+
+      if plot_grid:
+          plot_level = np.abs(np.array(ref_obj.levels) - sweep_num).argmin()
+          if ref_obj.levels[plot_level] != sweep_num:
+              print(" Level %d is not one of the levels kept, plotting level %d\n" % (sweep_num, ref_obj.levels[plot_level]))
+          fsuffix = "MRMS_%s" % (time.strftime('%Y%m%d%H%M'))
+          plot_filename = os.path.join(options.out_dir, fsuffix)
+          if not (_plot_async and queue_plot(grid_plot, ref_obj, plot_level, plot_filename = plot_filename)):
+              grid_plot(ref_obj, plot_level, plot_filename = plot_filename)
+
 
 #-------------------------------------------------------------------------------
 # Main program for testing...
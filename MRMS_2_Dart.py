@@ -34,6 +34,11 @@ _NEWSe_log_files         = [os.path.join(_NEWSe_top_dir, "log_grid_prep.txt")]
 
 debug = False
 
+# Realtime trigger:  prep_grid3d starts at the analysis time and processes the grid as soon
+# as it is written, waiting at most _NEWSe_wait sec after the analysis time
+
+_NEWSe_wait              = 420
+
 #-------------------------------------------------------------------------------
 # Utility to round the datetime object to nearest 15 min....
 
@@ -196,13 +201,18 @@ def run_Prep_Grid3d(today):
 
     str_time = dt.strftime("%Y%m%d%H%M")
 
-    cmd = "prep_grid3d.py -d %s -w -o %s --realtime %s -p 4" % (_MRMS_input_dir, obs_seq_out_dir, str_time)
+    cmd = "prep_grid3d.py -d %s -w -o %s --realtime %s -p 4 --wait %d" % (_MRMS_input_dir, obs_seq_out_dir, str_time, _NEWSe_wait)
 
     print("\n Prep_Grid3d running job: at %s" % (time.strftime("%Y-%m-%d %H:%M:%S")))
     print("\n %s" % cmd)
     print("\n %s" % gmt)
     print("\n %s" % str_time)
 
+    ret = os.system("%s >> %s" % (cmd, _NEWSe_log_files[0]))
+
+    if ret != 0:
+        return ret
+
 #-------------------------------------------------------------------------------
 def run_Prep_MRMS(obs_seq_out_dir, time):
     """
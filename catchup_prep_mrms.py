@@ -1,74 +1,173 @@
 #!/usr/bin/env python
+#
+# Backfill of the MRMS obs_seq_RF files for a range of analysis times.  The times are
+# processed by a pool of worker processes which import prep_mrms once, times whose
+# obs_seq_RF file already exists are skipped, and a summary of the times with missing
+# MRMS input is written to the output directory.
+#
+# Usage:  catchup_prep_mrms.py --start 201804032000 --end 201804032200 -n 4
 
-
-import time
-import logging
 import os, sys
 import datetime
+import multiprocessing
+from optparse import OptionParser
 
 _MRMS_feed       = "/work/LDM/MRMS"
 _MRMS_obs_seq    = "/work/wicker/REALTIME/"
 _NEWSe_grid_info = "/scratch/wof/realtime/radar_files"
 _prep_mrms       = "/work/wicker/realtime/pyroth/prep_mrms.py"
 
-year       = 2018
-mon        = 4
-day        = [3, 3]   # start and stop days
-hour       = [20, 22]    # start and stop hours
-min        = [0, 0]
+sys.path.insert(0, os.path.dirname(_prep_mrms))
+import prep_mrms
 
 plot_level = 3
+nprocs     = 4                       # number of worker processes
+dt_minutes = 15                      # minutes between analysis times
 
-start_time = datetime.datetime(year, mon, day[0], hour[0], min[0], 0)
-stop_time  = datetime.datetime(year, mon, day[1], hour[1], min[1], 05)
-dtime      = datetime.timedelta(minutes=15)
+#-------------------------------------------------------------------------------
+# Parse center lat and lon out of the c-shell radar file - HARDCODED!
 
-obs_seq_out_dir = os.path.join(_MRMS_obs_seq, start_time.strftime("%Y%m%d"))
+def read_radar_center(date):
 
-# create path for NEWSe radar file
+    radar_csh_file = os.path.join(_NEWSe_grid_info, ("radars.%s.csh" % date.strftime("%Y%m%d")))
 
-radar_csh_file = os.path.join(_NEWSe_grid_info, ("radars.%s.csh" % start_time.strftime("%Y%m%d")))
+    try:
+        fhandle = open(radar_csh_file)
+    except:
+        print("\n ============================================================================")
+        print("\n CANNOT OPEN radar CSH file, exiting MRMS processing:  %s" % radar_csh_file)
+        print("\n ============================================================================")
+        sys.exit(1)
 
-# Parse center lat and lon out of the c-shell radar file - HARDCODED!
-# If the file does not exist, then we exit out of this run
+    all_lines  = fhandle.readlines()
+    lat = float(all_lines[7].split(" ")[2])
+    lon = float(all_lines[8].split(" ")[2])
+    fhandle.close()
+
+    return lat, lon
+
+#-------------------------------------------------------------------------------
+# Worker:  process one analysis time, returns (time, status, message) where status is
+#          "done", "skipped" (output exists), "missing" (no MRMS input) or "failed"
+
+def process_time(args):
+
+    a_time, loc, out_dir, sweep_num = args
+
+    if os.path.exists(prep_mrms.output_filename(out_dir, a_time) + ".out"):
+        return a_time, "skipped", "obs_seq_RF file exists"
+
+    MRMS_dir = os.path.join(_MRMS_feed, a_time.strftime("%Y/%m/%d"))
+
+    print("\n >>>>=======BEGIN %s =================================================" % a_time.strftime("%Y%m%d%H%M"))
+    print("\n Reading from operational MRMS directory:  %s\n" % MRMS_dir)
+
+    try:
+        out = prep_mrms.run_prep_mrms(MRMS_dir, a_time, loc, out_dir, write=True, sweep_num=sweep_num)
+    except prep_mrms.MissingLevels as e:    # none of the MRMS levels are there
+        return a_time, "missing", "no MRMS levels in %s:  %s" % (MRMS_dir, e)
+    except Exception as e:
+        return a_time, "failed", "%s:  %s" % (type(e).__name__, e)
+
+    print("\n <<<<<=======END %s ==================================================" % a_time.strftime("%Y%m%d%H%M"))
+
+    if out == None:
+        return a_time, "missing", "no MRMS files in %s within [%d,%d] sec" % \
+               (MRMS_dir, prep_mrms._dt_window[0], prep_mrms._dt_window[1])
+
+    return a_time, "done", out[0] + ".out"
+
+#-------------------------------------------------------------------------------
+# Main function defined to return correct sys.exit() calls
+
+def main(argv=None):
+
+    parser = OptionParser()
+    parser.add_option(      "--start", dest="start",   default=None, type="string", help = "First analysis time YYYYMMDDHHMM")
+    parser.add_option(      "--end",   dest="end",     default=None, type="string", help = "Last analysis time YYYYMMDDHHMM")
+    parser.add_option(      "--dt",    dest="dt",      default=dt_minutes, type="int", help = "Minutes between analysis times")
+    parser.add_option("-n", "--nprocs",dest="nprocs",  default=nprocs, type="int", help = "Number of worker processes")
+    parser.add_option("-o", "--out",   dest="out_dir", default=None, type="string", help = "Output directory, default %s/YYYYMMDD" % _MRMS_obs_seq)
+    parser.add_option(      "--loc",   dest="loc",     default=None, type="float", nargs=2, help = "Lat/lon of the grid center, default from the NEWSe radars csh file")
+    parser.add_option("-p", "--plot",  dest="plot",    default=plot_level, type="int", help = "Level to plot, -1 for no plots")
+
+    (options, args) = parser.parse_args(argv)
+
+    if options.start == None or options.end == None:
+        print("\n\n ***** USER MUST SPECIFY --start AND --end TIMES *****\n")
+        parser.print_help()
+        return 1
+
+    start_time = datetime.datetime.strptime(options.start, "%Y%m%d%H%M")
+    stop_time  = datetime.datetime.strptime(options.end,   "%Y%m%d%H%M")
+    dtime      = datetime.timedelta(minutes=options.dt)
+
+    if options.out_dir == None:
+        obs_seq_out_dir = os.path.join(_MRMS_obs_seq, start_time.strftime("%Y%m%d"))
+    else:
+        obs_seq_out_dir = options.out_dir
+
+    if options.loc == None:
+        lat, lon = read_radar_center(start_time)
+    else:
+        lat, lon = options.loc
+
+    if options.plot < 0:
+        sweep_num = None
+    else:
+        sweep_num = options.plot
 
-try:
-    fhandle = open(radar_csh_file)
-except:
     print("\n ============================================================================")
-    print("\n CANNOT OPEN radar CSH file, exiting MRMS processing:  %s" % radar_csh_file)
+    print("\n Lat: %f  Lon: %f centers will be used for MRMS sub-domain" % (lat, lon))
     print("\n ============================================================================")
-    sys.exit(1)
 
-all_lines  = fhandle.readlines()
-lat = float(all_lines[7].split(" ")[2])
-lon = float(all_lines[8].split(" ")[2])
-fhandle.close()
+    times = []
+    while start_time <= stop_time:
+        times.append(start_time)
+        start_time = start_time + dtime
+
+    print("\n Catchup of %d analysis times with %d processes, writing to %s" % (len(times), options.nprocs, obs_seq_out_dir))
 
-print("\n ============================================================================")
-print("\n Lat: %f  Lon: %f centers will be used for MRMS sub-domain" % (lat, lon))
-print("\n ============================================================================")
+    prep_mrms.make_dir(obs_seq_out_dir)
 
 # Main catchup loop
 
-while start_time < stop_time:
+    pool = multiprocessing.Pool(options.nprocs)
 
-    MRMS_dir = os.path.join(_MRMS_feed, start_time.strftime("%Y/%m/%d"))
-    
-    print("\n Reading from operational MRMS directory:  %s\n" % MRMS_dir)
-    
-    print("\n >>>>=======BEGIN===============================================================")
-    cmd = "%s -d %s -w -o %s --realtime %s -p %d --loc %f %f"  %  \
-          (_prep_mrms, MRMS_dir, obs_seq_out_dir, start_time.strftime("%Y%m%d%H%M"), plot_level, lat, lon)
-
-    print("\n Prep_MRMS called at %s" % (time.strftime("%Y-%m-%d %H:%M:%S")))
-    print(" Cmd: %s" % (cmd))
-    ret = os.system("%s" % cmd)
-    if ret != 0:
-        print("\n ============================================================================")
-        print("\n Prep_MRMS cannot find a RF file between [-2,+1] min of %s" % start_time.strftime("%Y%m%d%H%M"))
-        print("\n ============================================================================")
-    print("\n <<<<<=======END================================================================")
+    try:
+        results = pool.map(process_time, [(t, (lat, lon), obs_seq_out_dir, sweep_num) for t in times], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+# Summary, and the list of the times with missing input
+
+    counts = dict( (status, 0) for status in ["done", "skipped", "missing", "failed"] )
+    for a_time, status, message in results:
+        counts[status] += 1
+
+    missing = [r for r in results if r[1] in ["missing", "failed"]]
+
+    if len(missing) > 0:
+        summary_file = os.path.join(obs_seq_out_dir, "catchup_missing_%s_%s.txt" %
+                                    (times[0].strftime("%Y%m%d%H%M"), times[-1].strftime("%Y%m%d%H%M")))
+        fd, tmp = prep_mrms.temp_output(summary_file)
+        with os.fdopen(fd, "w") as fo:
+            for a_time, status, message in missing:
+                fo.write("%s  %-8s %s\n" % (a_time.strftime("%Y%m%d%H%M"), status, message))
+        prep_mrms.commit_output(tmp, summary_file)
+
+    print("\n ============================================================================")
+    print("\n Catchup done:  %d written, %d skipped (exist), %d missing input, %d failed" %
+          (counts["done"], counts["skipped"], counts["missing"], counts["failed"]))
+    if len(missing) > 0:
+        print("\n Times without output are listed in:  %s" % summary_file)
+    print("\n ============================================================================")
+
+    return 0
 
-    start_time = start_time + dtime
+#-------------------------------------------------------------------------------
+# Main program
 
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,6 +13,11 @@ _NEWSe_prep_mrms = "/work/wicker/REALTIME/pyroth/prep_mrms.py"
 
 plot_level = 3
 
+# Realtime trigger:  the job starts at the analysis time, prep_mrms processes the volume as
+# soon as all its levels are there, and at the latest wait_seconds after the analysis time
+
+wait_seconds = 420
+
 #-----------------------------------------------------------------------------
 # Utility to round the datetime object to nearest 15 min....
 def quarter_datetime(dt):
@@ -60,7 +65,7 @@ sched = BlockingScheduler()
 
 # schedule the prep_grid3d...
 
-@sched.scheduled_job('cron', minute="5,20,35,50")
+@sched.scheduled_job('cron', minute="0,15,30,45")
 def scheduled_job():
 
     gmt = time.gmtime()  # for file names, here we need to use GMT time
@@ -74,8 +79,8 @@ def scheduled_job():
     print("\n Reading from operational MRMS directory:  %s\n" % MRMS_dir)
     
     print("\n >>>>=======BEGIN===============================================================")
-    cmd = "%s -d %s -w -o %s --realtime %s -p %d --loc %f %f"  %  \
-          (_NEWSe_prep_mrms, MRMS_dir, obs_seq_out_dir, dt.strftime("%Y%m%d%H%M"), plot_level, lat, lon)
+    cmd = "%s -d %s -w -o %s --realtime %s -p %d --loc %f %f --wait %d"  %  \
+          (_NEWSe_prep_mrms, MRMS_dir, obs_seq_out_dir, dt.strftime("%Y%m%d%H%M"), plot_level, lat, lon, wait_seconds)
 
     print("\n Prep_MRMS called at %s" % (dt.strftime("%Y-%m-%d %H:%M:%S")))
     print(" Cmd: %s" % (cmd))
@@ -83,7 +88,7 @@ def scheduled_job():
     ret = os.system("%s >> log_prep_MRMS" % cmd)
     if ret != 0:
         print("\n ============================================================================")
-        print("\n Prep_MRMS cannot find a RF file between [-2,+1] min of %s" % dt_time.strftime("%Y%m%d%H%M"))
+        print("\n Prep_MRMS cannot find a RF file within %d sec of %s" % (wait_seconds, dt.strftime("%Y%m%d%H%M")))
         print("\n ============================================================================")
 
     print("\n <<<<<=======END================================================================")
@@ -7,6 +7,13 @@
 import os
 import sys
 import glob
+import errno
+import fcntl
+import pickle
+import shutil
+import stat
+import tempfile
+import subprocess
 import time as timeit
 
 import numpy as np
@@ -22,6 +29,12 @@ _write_grid_indices = False
 
 _zero_dbz_obtype = True
 
+# Plot queue:  spool directory of the queued plot jobs (private to the user, the worker
+# runs the code the jobs name), and the nice increment of the worker
+
+_plot_spool = os.path.join(os.path.expanduser("~"), ".cache", "pyroth_plot_queue")
+_plot_nice  = 19
+
 #=========================================================================================
 # DART obs definitions (handy for writing out DART files)
 
@@ -163,6 +176,285 @@ def beam_elv(sfc_range, z):
    else:
        return -999.
 
+#########################################################################################
+#
+# Output files are written under private temporary names in their own directory and
+# renamed into place when complete, so concurrent runs (cron + catchup) never share
+# intermediate files, and readers never see a partially written file.
+#
+#########################################################################################
+
+def make_dir(path):
+   """Creates path (and its parents), it is not an error if another process made it first"""
+
+   try:
+       os.makedirs(path)
+   except OSError as e:
+       if e.errno != errno.EEXIST or not os.path.isdir(path):
+           raise
+
+   return path
+
+#=========================================================================================
+
+def private_dir(path):
+   """Creates path (mode 0700) if needed, and checks that it is a directory (not a link)
+      owned by this user that nobody else can write or read, so the files found in it
+      can be trusted.  Raises OSError otherwise"""
+
+   make_dir(os.path.dirname(os.path.abspath(path)))
+
+   try:
+       os.mkdir(path, 0o700)
+   except OSError as e:
+       if e.errno != errno.EEXIST:
+           raise
+
+   st = os.lstat(path)
+
+   if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or (st.st_mode & 0o077) != 0:
+       raise OSError(errno.EPERM, "not a private directory of this user (mode %o, uid %d)" % 
+                     (stat.S_IMODE(st.st_mode), st.st_uid), path)
+
+   return path
+
+#=========================================================================================
+
+def temp_output(filename):
+   """Returns an open file descriptor and the name of a private temporary file in the
+      directory of filename, to be moved into place with commit_output"""
+
+   dirname, basename = os.path.split(os.path.abspath(filename))
+
+   return tempfile.mkstemp(prefix=".%s." % basename, suffix=".tmp", dir=dirname)
+
+#=========================================================================================
+
+def commit_output(tmp_filename, filename):
+   """Atomically renames a finished temporary file to filename, with the permissions a
+      normally created file would have"""
+
+   umask = os.umask(0)
+   os.umask(umask)
+   os.chmod(tmp_filename, 0o666 & ~umask)
+
+   os.rename(tmp_filename, filename)
+
+   return filename
+
+#=========================================================================================
+
+def save_figure(filename, format="png"):
+   """plt.savefig through a temporary file, the format is taken from the extension of
+      filename, or appended to it (as savefig does) when there is none"""
+
+   import matplotlib.pyplot as plt
+
+   ext = os.path.splitext(filename)[1]
+
+   if ext == "":
+       filename = "%s.%s" % (filename, format)
+   else:
+       format = ext[1:]
+
+   fd, tmp_filename = temp_output(filename)
+   os.close(fd)
+
+   try:
+       plt.savefig(tmp_filename, format=format)
+       commit_output(tmp_filename, filename)
+   except:
+       os.remove(tmp_filename)
+       raise
+
+   return filename
+
+#########################################################################################
+#
+# Superobbing of gridded data over thin x thin blocks of the horizontal grid.  The last two
+# dimensions are padded with masked points up to a multiple of thin and reshaped to
+# (..., ny/thin, thin, nx/thin, thin), so the reduction is a couple of sums over the block
+# axes.  The output has the same size as the data[..., ::thin, ::thin] subsample.
+#
+#########################################################################################
+
+def superob_grid(data, thin, method="mean", min_count=1):
+   """Returns the masked block mean (or max) of the valid points of data, and the number of
+      valid points in each block.  Blocks with fewer than min_count valid points are masked."""
+
+   data  = np.ma.asarray(data)
+   shape = data.shape[:-2]
+   ny, nx = data.shape[-2:]
+   nyb, nxb = -(-ny // thin), -(-nx // thin)
+
+   valid  = np.zeros(shape + (nyb*thin, nxb*thin), dtype=bool)
+   values = np.zeros(shape + (nyb*thin, nxb*thin), dtype=np.float64)
+
+   valid[...,:ny,:nx]  = ~np.ma.getmaskarray(data)
+   values[...,:ny,:nx] = data.filled(0.0)
+
+   block  = shape + (nyb, thin, nxb, thin)
+   valid  = valid.reshape(block)
+   values = values.reshape(block)
+
+   counts = valid.sum(axis=-1).sum(axis=-2)
+
+   if method == "max":
+       superobs = np.where(valid, values, -np.inf).max(axis=-1).max(axis=-2)
+   elif method == "mean":
+       superobs = values.sum(axis=-1).sum(axis=-2) / np.maximum(counts, 1)
+   else:
+       raise ValueError("superob_grid:  method must be mean or max, not %s" % method)
+
+   mask = counts < max(min_count, 1)
+
+   superobs = np.ma.MaskedArray(np.where(mask, _missing, superobs).astype(data.dtype), mask=mask)
+
+   return superobs, counts
+
+#=========================================================================================
+
+def superob_coords(x, thin):
+   """Returns the mean coordinate of each block of a 1D coordinate array, the location of
+      the superobs from superob_grid (a partial block at the end uses its own points)"""
+
+   x = np.asarray(x)
+   n = x.size // thin
+
+   blocks = x[:n*thin].reshape(n, thin).mean(axis=1)
+
+   if n*thin < x.size:
+       blocks = np.append(blocks, x[n*thin:].mean())
+
+   return blocks.astype(x.dtype)
+
+#########################################################################################
+#
+# Plot queue:  the realtime programs queue their plots instead of drawing them, so a cycle
+# ends once its obs_seq file is written.  A job is a pickled (function, args, kwargs) file
+# (after a header naming it) in the spool directory, and a single low priority worker process (started on demand,
+# holding the spool lock) draws the queued plots in order and exits when the queue is empty.
+#
+#########################################################################################
+
+def queue_plot(function, *args, **kwargs):
+   """Queues function(*args, **kwargs), a plotting function defined at the top level of a
+      module, and makes sure a worker is running.  Returns False (nothing is queued) when
+      the spool directory cannot be written, so the caller can plot synchronously."""
+
+   module = sys.modules[function.__module__]
+   path, name = os.path.split(os.path.abspath(module.__file__))
+   name = os.path.splitext(name)[0]
+
+   job = {'path': path, 'module': name, 'function': function.__name__}
+
+   jobname = os.path.join(_plot_spool, "%017.6f_%d.job" % (timeit.time(), os.getpid()))
+
+   try:
+       private_dir(_plot_spool)
+       fd, tmp = temp_output(jobname)
+       with os.fdopen(fd, "wb") as fo:
+           pickle.dump(job, fo, pickle.HIGHEST_PROTOCOL)
+           pickle.dump((args, kwargs), fo, pickle.HIGHEST_PROTOCOL)
+       commit_output(tmp, jobname)
+   except (IOError, OSError, pickle.PicklingError) as e:
+       print("\n queue_plot:  cannot queue %s.%s, %s" % (name, function.__name__, e))
+       return False
+
+   start_plot_worker(_plot_spool)
+
+   return True
+
+#=========================================================================================
+
+def start_plot_worker(spool=_plot_spool):
+   """Starts a detached plot worker, unless a worker holds the lock (it lists the queue
+      again after releasing the lock, so it will find the jobs queued before this call)"""
+
+   with open(os.path.join(spool, "queue.lock"), "a") as lock:
+       try:
+           fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+       except IOError:
+           return
+       fcntl.flock(lock, fcntl.LOCK_UN)
+
+   dart_tools_path = os.path.dirname(os.path.abspath(__file__))
+
+   cmd = "import sys; sys.path.insert(0, %r); import dart_tools; dart_tools.run_plot_queue(%r)" % \
+         (dart_tools_path, spool)
+
+   with open(os.path.join(spool, "plot_queue.log"), "a") as log, open(os.devnull, "r") as null:
+       subprocess.Popen([sys.executable, "-c", cmd], stdin=null, stdout=log, stderr=subprocess.STDOUT,
+                        close_fds=True, preexec_fn=os.setsid)
+
+#=========================================================================================
+
+class _Job_Unpickler(pickle.Unpickler):
+   """Classes pickled by a program run as a script (module __main__) are found in its module"""
+
+   def __init__(self, file, module):
+       pickle.Unpickler.__init__(self, file)
+       self.module = module
+
+   def find_class(self, module, name):
+       if module == "__main__":
+           module = self.module
+       return pickle.Unpickler.find_class(self, module, name)
+
+#=========================================================================================
+
+def run_plot_queue(spool=_plot_spool):
+   """The plot worker:  draws the queued plots, oldest first, until the queue is empty.
+      Only the jobs of a private spool directory, written by this user, are run"""
+
+   try:
+       private_dir(spool)
+   except OSError as e:
+       print(" run_plot_queue:  not running the jobs in %s, %s" % (spool, e))
+       return
+
+   lock = open(os.path.join(spool, "queue.lock"), "a")
+
+   os.nice(_plot_nice)
+
+   while True:
+       try:
+           fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+       except IOError:
+           return                        # another worker is draining the queue
+
+       while True:
+           jobs = sorted(glob.glob(os.path.join(spool, "*.job")))
+           if len(jobs) == 0:
+               break
+
+           for jobname in jobs:
+               try:
+                   with open(jobname, "rb") as fi:
+                       if os.fstat(fi.fileno()).st_uid != os.getuid():
+                           raise IOError("not written by this user")
+                       job = pickle.load(fi)
+                       if job['path'] not in sys.path:
+                           sys.path.insert(0, job['path'])
+                       function = getattr(__import__(job['module']), job['function'])
+                       args, kwargs = _Job_Unpickler(fi, job['module']).load()
+                   t0 = timeit.time()
+                   function(*args, **kwargs)
+                   print(" run_plot_queue:  %s.%s done in %4.1f sec" % (job['module'], job['function'], timeit.time()-t0))
+               except Exception as e:
+                   print(" run_plot_queue:  job %s failed:  %s" % (os.path.basename(jobname), e))
+               finally:
+                   if 'matplotlib.pyplot' in sys.modules:
+                       sys.modules['matplotlib.pyplot'].close('all')
+                   os.remove(jobname)
+
+# A job queued after the last listing, while the lock was held, is picked up here
+
+       fcntl.flock(lock, fcntl.LOCK_UN)
+
+       if len(glob.glob(os.path.join(spool, "*.job"))) == 0:
+           return
+
 ####################################################################################### 
 #
 # write_DART_ascii is a program to dump radar data to DART ascii files.
@@ -215,8 +507,8 @@ def beam_elv(sfc_range, z):
 #
 #
 ########################################################################################  
-def write_DART_ascii(obs, filename=None, obs_error=None, zero_dbz_obtype=_zero_dbz_obtype,
-                     levels = None, QC_info=None, zero_levels=[]):
+def _write_DART_ascii(obs, temp_files, filename=None, obs_error=None, zero_dbz_obtype=_zero_dbz_obtype,
+                      levels = None, QC_info=None, zero_levels=[]):
 
    if filename == None:
        print("\n write_DART_ascii:  No output file name is given, writing to %s" % "obs_seq.txt")
@@ -230,9 +522,11 @@ def write_DART_ascii(obs, filename=None, obs_error=None, zero_dbz_obtype=_zero_d
        print "write_DART_ascii:  No obs error defined for observation, exiting"
        raise SystemExit
 
-# Open ASCII file for DART obs to be written into.  We will add header info afterward
+# Open a private ASCII file for DART obs to be written into.  We will add header info afterward
   
-   fi = open(filename, "w")
+   fd, body_filename = temp_output(filename)
+   temp_files.append(body_filename)
+   fi = os.fdopen(fd, "w")
   
    print("\n Writing %s to file...." % obs.field.upper())
    
@@ -266,7 +560,7 @@ def write_DART_ascii(obs, filename=None, obs_error=None, zero_dbz_obtype=_zero_d
    else:
        try:
            nz, ny, nx         = data.shape
-           if levels  == None:
+           if levels is None:
                nz2            = nz + len(zero_levels)
            else:
                nz2            = len(levels) + len(zero_levels)
@@ -422,13 +716,13 @@ def write_DART_ascii(obs, filename=None, obs_error=None, zero_dbz_obtype=_zero_d
       
    fi.close()
   
-# To write out header information AFTER we know how big the observation data set is, we have
-# to read back in the entire contents of the obs-seq file, store it, rewrite the file
-# with header information first, and then dump the contents of obs-seq back inp.  Yuck.
-
-   with file(filename, 'r') as f: f_obs_seq = f.read()
+# To write out header information AFTER we know how big the observation data set is, we
+# write the header to a second private file, copy the obs-seq contents after it, and then
+# rename it to the output file, so the file appears complete or not at all.
 
-   fi = open(filename, "w")
+   fd, tmp_filename = temp_output(filename)
+   temp_files.append(tmp_filename)
+   fi = os.fdopen(fd, "w")
   
    fi.write(" obs_sequence\n")
    fi.write("obs_kind_definitions\n")
@@ -457,9 +751,12 @@ def write_DART_ascii(obs, filename=None, obs_error=None, zero_dbz_obtype=_zero_d
 
  # Now write back in all the actual DART obs data
 
-   fi.write(f_obs_seq)
+   with open(body_filename, 'r') as f: shutil.copyfileobj(f, fi)
   
    fi.close()
+   os.remove(body_filename)
+
+   commit_output(tmp_filename, filename)
   
    print("\n write_DART_ascii:  Created ascii DART file, N = %d written" % nobs)
   
@@ -468,6 +765,24 @@ def write_DART_ascii(obs, filename=None, obs_error=None, zero_dbz_obtype=_zero_d
        print(" write_DART_ascii:  Number of non-zero reflectivity obs: %d" % (nobs - nobs_clearair))
 
    return
+
+#=========================================================================================
+
+def write_DART_ascii(obs, filename=None, obs_error=None, zero_dbz_obtype=_zero_dbz_obtype,
+                     levels = None, QC_info=None, zero_levels=[]):
+   """Writes the DART ascii file (see above) through _write_DART_ascii, and removes its
+      temporary files when the writing fails, so no partial files are left behind"""
+
+   temp_files = []
+
+   try:
+       return _write_DART_ascii(obs, temp_files, filename=filename, obs_error=obs_error, 
+                                zero_dbz_obtype=zero_dbz_obtype, levels=levels, QC_info=QC_info, 
+                                zero_levels=zero_levels)
+   except Exception:
+       for name in temp_files:
+           if os.path.exists(name):  os.remove(name)
+       raise
   
 #####################################################################################################
 def write_netcdf_radar_file(ref, vel, filename=None):
@@ -6,6 +6,7 @@ import sys, os
 start   = DT.datetime(2016,5,24,18,0,0)
 delta_t = DT.timedelta(seconds=150)
 finish  = DT.datetime(2016,5,25,3,1,0)
+dtime   = DT.timedelta(seconds=900)
 
 RunIt = True
 
@@ -17,31 +18,15 @@ pyDart_exe = "./pyDart.py"
 if not os.path.exists(outdir):
    os.mkdir(outdir)
 
-# copy the file to make sure we dont overwrite it
-
-cmd = "cp %s tmp.h5" % infile
-ret = os.system(cmd)
-
-if ret != 0:
-    print(" \n ERROR ERROR - temporary file could not be created - check name of input file, exiting\n")
-    sys.exit(-1)
-
-while start < finish:
-    begin = start - delta_t
-    end   = start + delta_t
-    cmd = "%s -f tmp.h5 --start %s  --end %s --search --hdf2ascii" % (pyDart_exe, 
-                                                                  begin.strftime("%Y,%m,%d,%H,%M,%S"), \
-                                                                  end.strftime("%Y,%m,%d,%H,%M,%S"))
-    print(cmd)
-    if RunIt:
-       os.system(cmd)
-
-    cmd = "mv tmp.tmp.out %s/%s_%s.out" % (outdir,prefix, start.strftime("%Y%m%d_%H%M%S"))
-
-    print(cmd)
-    if RunIt:
-       os.system(cmd)
-
-    start = start + DT.timedelta(seconds=900)
-
-
+# One pass through the table writes every window:  outdir/prefix_YYYYMMDD_HHMMSS.out
+
+cmd = "%s -f %s --windows %s %s %d %d -o %s" % (pyDart_exe, infile,
+                                                start.strftime("%Y,%m,%d,%H,%M,%S"), \
+                                                finish.strftime("%Y,%m,%d,%H,%M,%S"), \
+                                                dtime.seconds, delta_t.seconds, os.path.join(outdir, prefix))
+print(cmd)
+if RunIt:
+   ret = os.system(cmd)
+   if ret != 0:
+       print(" \n ERROR ERROR - pyDart could not create the windowed obs_seq files, exiting\n")
+       sys.exit(-1)
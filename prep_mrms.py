@@ -17,7 +17,13 @@
 import os
 import sys
 import glob
+import zlib
+import bisect
+import cPickle
+import tempfile
+import threading
 import time as timeit
+from multiprocessing.pool import ThreadPool
 
 # Need to set the backend BEFORE loading pyplot
 import matplotlib as mpl
@@ -54,10 +60,22 @@ _ref_ctable = cm.NWSRef
 _ref_min_plot = 20.
 _plot_format = 'png'
 
+# Queue the plots to the low priority plot worker (dart_tools.queue_plot) instead of
+# drawing them before the cycle returns
+
+_plot_async  = True
+
 # Radar information
 
 _dbz_name         = "MergedReflectivityQC_smoothed"
-_temp_netcdf_file = "/work/wicker/REALTIME/tmp.nc"
+
+# Number of threads decompressing and reading the MRMS levels
+
+_read_threads = 4
+
+# The netCDF4/HDF5 libraries are not thread safe, only the gunzip runs concurrently
+
+_netcdf_lock = threading.Lock()
 
 # Grid stuff
 
@@ -68,6 +86,22 @@ NY = 180
 
 _dt_window = [-300,120]
 
+# Realtime trigger (--wait):  seconds between checks of the MRMS directories while waiting
+# for all the levels of a volume
+
+_wait_poll = 5.0
+
+# Persistent index of the MRMS file times, one pickle file per MRMS day directory (in a
+# directory private to the user, since the pickles are loaded)
+
+_file_index_dir = os.path.join(os.path.expanduser("~"), ".cache", "mrms_file_index")
+
+# A directory modified this recently (sec) may still be receiving files, so it is rescanned
+
+_file_index_settle = 2.0
+
+_file_index = {}
+
 # Debug
 
 _debug = True
@@ -76,6 +110,8 @@ _debug = True
 # Parameter dict for reflectivity masking
 _grid_dict = {
               'zero_dbz_obtype' : True,
+              'thin_grid'       : 1,
+              'superob'         : None,
               'thin_zeros'      : 3,
               'halo_footprint'  : 4,
               'max_height'      : 10000.,
@@ -121,12 +157,110 @@ def get_loc(x, xc, radius):
     i0 = indices[0][0]
     return i0, i0+1
 
+#=========================================================================================
+# Parse the time out of an MRMS file name, e.g., 20180403-200012.netcdf.gz
+
+def mrms_file_time(fn):
+
+   return DT.datetime(int(fn[0:4]),int(fn[4:6]),int(fn[6:8]),int(fn[9:11]),int(fn[11:13]),int(fn[13:15]))
+
+#=========================================================================================
+# File-time index of the MRMS directories.  For each elevation directory the index keeps
+# the directory mtime, the names already seen, and the parsed times sorted together with
+# their file names.  A directory is only listed when its mtime has changed, and then only
+# the new names are parsed.  The index is kept in memory and in a pickle file per day
+# directory in _file_index_dir, so the realtime cycles and catchup runs share it.  Index
+# files are only read from that directory when it is private to the user (private_dir)
+# and they were written by the user.
+
+def file_index_filename(path):
+
+   return os.path.join(_file_index_dir, "%s.pkl" % os.path.abspath(path).strip(os.sep).replace(os.sep, "_"))
+
+def load_file_index(path):
+
+   path = os.path.abspath(path)
+
+   if path not in _file_index:
+       try:
+           private_dir(_file_index_dir)
+           with open(file_index_filename(path), "rb") as fi:
+               if os.fstat(fi.fileno()).st_uid != os.getuid():
+                   raise IOError("%s was not written by this user" % fi.name)
+               _file_index[path] = cPickle.load(fi)
+       except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+           _file_index[path] = {}
+
+   return _file_index[path]
+
+def save_file_index(path, index):
+
+   filename = file_index_filename(path)
+
+   try:
+       private_dir(_file_index_dir)
+       fd, tmp = temp_output(filename)
+       with os.fdopen(fd, "wb") as fo:
+           cPickle.dump(index, fo, cPickle.HIGHEST_PROTOCOL)
+       commit_output(tmp, filename)
+   except (IOError, OSError) as e:
+       print("\n PREP_MRMS.save_file_index:  cannot write file index %s:  %s" % (filename, e))
+
+def update_file_index(path, elev, index):
+   """
+      Brings the index entry of the elevation directory path/elev up to date, returns True if it changed
+   """
+
+   elev_dir = os.path.join(path, elev)
+
+   mtime = os.stat(elev_dir).st_mtime
+
+   entry = index.get(elev)
+
+   if entry != None and entry['mtime'] == mtime:
+       return False
+
+   if entry == None:
+       entry = {'mtime': None, 'names': set(), 'times': [], 'files': []}
+       index[elev] = entry
+
+   listing = set(os.listdir(elev_dir))
+
+   # drop the files that were removed (e.g., by the scouring of the LDM feed) since the last listing
+
+   gone = entry['names'] - listing
+
+   if len(gone) > 0:
+       keep = [n for n, fn in enumerate(entry['files']) if fn not in gone]
+       entry['times'] = [entry['times'][n] for n in keep]
+       entry['files'] = [entry['files'][n] for n in keep]
+       entry['names'] = entry['names'] - gone
+
+   for fn in listing - entry['names']:
+       entry['names'].add(fn)
+       try:
+           tempdate = mrms_file_time(fn)
+       except ValueError:
+           continue
+       n = bisect.bisect_right(entry['times'], tempdate)
+       entry['times'].insert(n, tempdate)
+       entry['files'].insert(n, fn)
+
+   # files can still arrive within the mtime resolution, do not trust a fresh mtime
+
+   if timeit.time() - mtime > _file_index_settle:
+       entry['mtime'] = mtime
+   else:
+       entry['mtime'] = None
+
+   return True
+
 #=========================================================================================
 # Routine to search the radar directories and find tilts that are within a time window
 # Thanks to Anthony Reinhart for the original version of this!
 # Modified by Lou Wicker April 2018
 
-def Get_Closest_Elevations(path, anal_time, sub_dir=None, window=_dt_window):
+def Get_Closest_Elevations(path, anal_time, sub_dir=None, window=_dt_window, verbose=True):
    """
       get_closest_elevations:
           path:       Path to the top level directory of radar
@@ -139,8 +273,13 @@ def Get_Closest_Elevations(path, anal_time, sub_dir=None, window=_dt_window):
                       len(window) == 2:  the window uses analysis_time + window[0] --> analysis_time + window[1]
                                          Note that window[0] should equal to or less than zero.
           
+          verbose:    print the number of files found
+          
           RETURNS:    either an empty list, or a list with full path names of the 
                       radar's tilts that are within the supplied window.
+
+          The file times come from the file-time index (see update_file_index), so only
+          new files are parsed each cycle.
    """
 
    ObsFileList = []
@@ -156,33 +295,39 @@ def Get_Closest_Elevations(path, anal_time, sub_dir=None, window=_dt_window):
        if window[0] > 0:  # this is when I am stupid...
            window[0] = -window[0]
        lwindow = window
+
+   # timediff = anal_time - file time must be in [lwindow[0], lwindow[1])
+
+   oldest = anal_time - DT.timedelta(0,lwindow[1])
+   newest = anal_time - DT.timedelta(0,lwindow[0])
+
+   index   = load_file_index(full_path)
+   changed = False
    
    for elev in os.listdir(full_path):
-   
-       tilt_time = {}
-           
-       for fn in os.listdir(os.path.join(full_path,elev)):
-       
-           tempdate = DT.datetime(int(fn[0:4]),int(fn[4:6]),int(fn[6:8]),int(fn[9:11]),int(fn[11:13]),int(fn[13:15]))
 
-           timediff = anal_time - tempdate
-           
-           # Change this if you want +something -window instead of 0-900. if statement is +2-15
-           # if timediff >= datetime.timedelta(0,-120) and timediff < datetime.timedelta(0,window):
+       elev_dir = os.path.join(full_path,elev)
+
+       if not os.path.isdir(elev_dir):
+           continue
+
+       changed = update_file_index(full_path, elev, index) or changed
+
+       entry = index[elev]
 
-           if timediff >= DT.timedelta(0,lwindow[0]) and timediff < DT.timedelta(0,lwindow[1]):
-               tilt_time["%s/%s" % (elev,fn)] = timediff
-           else:
-               continue
+       # This code finds the oldest file inside the window - using only a single tilt per volume.
 
-       # This code finds the latest file that exists in the list - using only a single tilt per volume.
-       if bool(tilt_time):
-            maxtime = max(tilt_time.items(),key=lambda d:(d[1]))
-            ObsFileList.append(os.path.join(full_path,maxtime[0]))
-       del(tilt_time)
+       n = bisect.bisect_right(entry['times'], oldest)
 
+       if n < len(entry['times']) and entry['times'][n] <= newest:
+           ObsFileList.append(os.path.join(elev_dir, entry['files'][n]))
+
+   if changed:
+       save_file_index(full_path, index)
        
-   if len(ObsFileList) > 0:
+   if not verbose:
+       pass
+   elif len(ObsFileList) > 0:
        print("\n ============================================================================\n")
        print("\n PREP_VOLUME.Get_Closest_Elevations:  found %i files in %s  \n" % (len(ObsFileList), path))
    else:
@@ -193,6 +338,57 @@ def Get_Closest_Elevations(path, anal_time, sub_dir=None, window=_dt_window):
 
    return ObsFileList
                  
+#=========================================================================================
+# The latest file of each of the _grid_dict levels, None for the levels without a file
+
+def level_files(filenames):
+
+   file_list = []
+
+   for l in _grid_dict['levels']:
+       files = [f for f in filenames if f.find(l) > -1]
+       if len(files) > 0:
+           file_list.append(max(files))
+       else:
+           file_list.append(None)
+
+   return file_list
+
+#=========================================================================================
+# Realtime trigger:  watch the MRMS directories (through the file-time index, so only the
+# directories that changed are listed) and return as soon as every level has a file for
+# the analysis time, or at the deadline (a datetime, UTC) with whatever files are there.
+
+def wait_for_volume(path, anal_time, deadline, poll=_wait_poll):
+
+   nlvls   = len(_grid_dict['levels'])
+   nfound  = -1
+   t0      = timeit.time()
+
+   while True:
+       try:
+           filenames = Get_Closest_Elevations(path, anal_time, verbose=False)
+       except OSError:                # the day directory is not there yet
+           filenames = []
+
+       found = len([f for f in level_files(filenames) if f != None])
+
+       if found != nfound:
+           print("\n PREP_MRMS.wait_for_volume:  %d of %d levels for %s after %d sec" % 
+                 (found, nlvls, anal_time.strftime("%Y%m%d%H%M"), timeit.time()-t0))
+           nfound = found
+
+       if found == nlvls or DT.datetime.utcnow() >= deadline:
+           break
+
+       timeit.sleep(max(min(poll, (deadline - DT.datetime.utcnow()).total_seconds()), 0.))
+
+   if 0 < found < nlvls:
+       print("\n PREP_MRMS.wait_for_volume:  deadline %s reached, missing %d levels" % 
+             (deadline.strftime("%Y%m%d%H%M%S"), nlvls-found))
+
+   return Get_Closest_Elevations(path, anal_time) if found > 0 else []
+
 #=========================================================================================
 # Get the filenames out of the directory
 
@@ -214,100 +410,212 @@ def get_dir_files(dir, pattern, debug=False):
     return filenames
 
 #=========================================================================================
-# Get the filenames out of the directory
+# Read an MRMS file into memory, gunzipping it when the name ends in "gz"
 
-def assemble_3D_grid(filenames, loc=None, debug=False):
+def read_mrms_file(filename):
+
+    with open(filename, "rb") as fi:
+        buffer = fi.read()
+
+    if filename[-2:] == "gz":
+        buffer = zlib.decompress(buffer, 16 + zlib.MAX_WBITS)
+
+    return buffer
+
+#=========================================================================================
+# Open the netCDF contents of an MRMS file held in memory.  When the netCDF library cannot
+# open memory, the contents go to a private temporary file which is removed once opened
+
+def open_mrms_file(filename, buffer):
+
+    try:
+        return ncdf.Dataset(os.path.basename(filename), "r", memory=buffer)
+    except (TypeError, ValueError, IOError, RuntimeError):
+        fd, tmp_file = tempfile.mkstemp(suffix=".nc")
+        try:
+            os.write(fd, buffer)
+            os.close(fd)
+            return ncdf.Dataset(tmp_file, "r")
+        finally:
+            os.remove(tmp_file)
+
+#=========================================================================================
+# Grid indices [j0:j1, i0:i1] of an nx by ny domain centered on loc=(lat,lon), or on the
+# middle of the MRMS grid when loc is None
+
+def domain_indices(f_lats, f_lons, loc, nx, ny, debug=False):
+
+    if loc != None:
+        ic     = get_loc(f_lons, loc[1], 0.5)[0]
+        jc     = get_loc(f_lats, loc[0], 0.5)[0]
+    else:
+        ic, jc = f_lons.size/2, f_lats.size/2
+
+    i0, i1 = ic-nx/2, ic-nx/2+nx
+    j0, j1 = jc-ny/2, jc-ny/2+ny
+
+# Fixing things when the NEWSe domain goes out of bounds
+
+    if i0 < 0:  
+        print("\n West edge of requested domain outside of MRMS grid:  %d " % (i0))
+        print("\n Adjusting indices")
+        i0       = 0
+
+    if j0 < 0:  
+        print("\n South edge of requested domain outside of MRMS grid:  %d " % (j0))
+        print("\n Adjusting indices")
+        j0       = 0
+
+    if debug:
+        print("\n %d  %d" % (i0, i1))
+        print("\n %d  %d" % (j0, j1))
+        print("\n SW Lon:  %f  NE_Lon:  %f" % (f_lons[i0], f_lons[min(i1, f_lons.size-1)]))
+        print("\n SW Lat:  %f  NE_Lat:  %f" % (f_lats[j0], f_lats[min(j1, f_lats.size-1)]))
+
+    return j0, j1, i0, i1
+
+#=========================================================================================
+# Raised by assemble_3D_grids when none of the MRMS level files exist, so callers can tell
+# missing input apart from the other errors of reading a volume
+
+class MissingLevels(ValueError):
+    pass
+
+#=========================================================================================
+# Read the MRMS levels into 3D grids for a list of domains [(loc, nx, ny), ...]:  the first
+# level sets up the grids, the rest are decompressed in memory and read by a small pool of
+# threads.  Each level is read once, as the hyperslab covering all the domains, and every
+# domain is sliced out of that buffer.
+
+def assemble_3D_grids(filenames, domains, debug=False):
 
     levels = _grid_dict['levels']
     nlvls  = len(levels)
 
-    file_list = []
+    file_list = level_files(filenames)
 
-    for l in levels:
-        file_list.append(max(f for f in filenames if f.find(l) > -1))
-    
-    for n, filename in enumerate(file_list):
+# A level without a file is left missing (its height is taken from the level name)
 
-        if debug:
-            print("\n Processing file:  %s" % (filename))
-      
-        if filename[-2:] == "gz":
-            cmd = "gunzip -c %s > %s" % (filename, _temp_netcdf_file)
-        else:
-            cmd = "ln -fs %s  %s" % (filename, _temp_netcdf_file)
+    available = [n for n in range(nlvls) if file_list[n] != None]
 
-        if debug:
-            print("\n Running......%s" % (cmd))
+    if len(available) == 0:
+        raise MissingLevels("assemble_3D_grids:  no MRMS files for the levels %s" % levels)
 
-        os.system(cmd)
-         
-        f = ncdf.Dataset(_temp_netcdf_file, "r")
+    for n in range(nlvls):
+        if file_list[n] == None:
+            print("\n assemble_3D_grids:  no file for level %s, the level is left missing" % levels[n])
+    
+    if debug:
+        print("\n Processing file:  %s" % (file_list[available[0]]))
+
+    f = open_mrms_file(file_list[available[0]], read_mrms_file(file_list[available[0]]))
          
-        if n == 0:
-             
-            nlons  = len(f.dimensions['Lon'])
-            nlats  = len(f.dimensions['Lat'])
-
-            try:
-                f_lats = f.variables['Lat'][...]
-                f_lons = f.variables['Lon'][...]
-            except:
-                f_lats = np.float(f.Latitude)  - np.float(f.LatGridSpacing) * np.arange(nlats)
-                f_lons = np.float(f.Longitude) + np.float(f.LonGridSpacing) * np.arange(nlons)
-             
-            missingData = f.MissingData
+    nlons  = len(f.dimensions['Lon'])
+    nlats  = len(f.dimensions['Lat'])
 
-            try:
-                time   = DT.datetime.fromtimestamp(f.variables['time'][0])
-            except:
-                time   = DT.datetime.fromtimestamp(np.float(f.Time))
-             
-            if loc != None:
-                ic     = get_loc(f_lons, loc[1], 0.5)[0]
-                jc     = get_loc(f_lats, loc[0], 0.5)[0]
-            else:
-                ic, jc = nlats/2, nlons/2
+    try:
+        f_lats = f.variables['Lat'][...]
+        f_lons = f.variables['Lon'][...]
+    except:
+        f_lats = np.float(f.Latitude)  - np.float(f.LatGridSpacing) * np.arange(nlats)
+        f_lons = np.float(f.Longitude) + np.float(f.LonGridSpacing) * np.arange(nlons)
+     
+    missingData = f.MissingData
+
+    try:
+        time   = DT.datetime.fromtimestamp(f.variables['time'][0])
+    except:
+        time   = DT.datetime.fromtimestamp(np.float(f.Time))
 
-            i0, i1 = ic-NX/2, ic+NX/2
-            j0, j1 = jc-NY/2, jc+NY/2
+    slices = [domain_indices(f_lats, f_lons, loc, int(nx), int(ny), debug=debug) for loc, nx, ny in domains]
 
-# Fixing things when the NEWSe domain goes out of bounds
+# The hyperslab holding all the domains
+
+    J0 = min(d[0] for d in slices)
+    J1 = max(d[1] for d in slices)
+    I0 = min(d[2] for d in slices)
+    I1 = max(d[3] for d in slices)
 
-            if i0 < 0:  
-                print("\n West edge of requested domain outside of MRMS grid:  %d " % (i0))
-                print("\n Adjusting indices")
-                i0       = 0
-
-            if j0 < 0:  
-                print("\n South edge of requested domain outside of MRMS grid:  %d " % (i0))
-                print("\n Adjusting indices")
-                j0       = 0
-
-            if debug:
-                print("\n %d  %d" % (i0, i1))
-                print("\n %d  %d" % (j0, j1))
-                print("\n SW Lon:  %f  NE_Lon:  %f" % (f_lons[i0], f_lons[i1]))
-                print("\n SW Lat:  %f  NE_Lat:  %f" % (f_lats[j0], f_lats[j1]))
-                      
-            g_lats    = f_lats[j0:j1]
-            g_lons    = f_lons[i0:i1]
-            array     = missingData * np.ones((nlvls, g_lats.size, g_lons.size))
-            g_heights = np.zeros((nlvls,))
+    arrays = []
+    for j0, j1, i0, i1 in slices:
+        arrays.append(missingData * np.ones((nlvls, f_lats[j0:j1].size, f_lons[i0:i1].size)))
+
+    g_heights = 1000. * np.array([float(l) for l in levels])
+
+    def read_slab(n, f):
 
         g_heights[n] = f.Height    
 
         try:
-            array[n,...] = f.variables[_dbz_name][0,j0:j1,i0:i1]
+            slab = f.variables[_dbz_name][0,J0:J1,I0:I1]
         except:
-            array[n,...] = f.variables[_dbz_name][j0:j1,i0:i1]
-         
-        f.close()
-  
-    ref = ma.MaskedArray(array, mask = (array < missingData+1.))        
+            slab = f.variables[_dbz_name][J0:J1,I0:I1]
+
+        for array, (j0, j1, i0, i1) in zip(arrays, slices):
+            array[n,...] = slab[j0-J0:j1-J0,i0-I0:i1-I0]
+
+    read_slab(available[0], f)
+    f.close()
+
+# The other levels:  gunzip in parallel, then read the slab while holding the netCDF lock
+
+    def read_level(n):
+
+        if debug:
+            print("\n Processing file:  %s" % (file_list[n]))
+
+        buffer = read_mrms_file(file_list[n])
+
+        with _netcdf_lock:
+            f = open_mrms_file(file_list[n], buffer)
+            read_slab(n, f)
+            f.close()
+
+    if len(available) > 1:
+        pool = ThreadPool(min(_read_threads, len(available)-1))
+        try:
+            pool.map(read_level, available[1:])
+        finally:
+            pool.close()
+            pool.join()
+
+    grids = []
+
+    for array, (j0, j1, i0, i1) in zip(arrays, slices):
+        ref = ma.MaskedArray(array, mask = (array < missingData+1.))        
     
-    return Gridded_Field(filename, data = ref, field = "REFLECTIVITY", zg = g_heights, \
-                         lats = g_lats, lons = g_lons, radar_hgt = 0.0, local_time = time, \
-                         missingData = missingData ) 
+        grids.append(Gridded_Field(file_list[available[-1]], data = ref, field = "REFLECTIVITY", zg = g_heights.copy(), \
+                                   lats = f_lats[j0:j1], lons = f_lons[i0:i1], radar_hgt = 0.0, local_time = time, \
+                                   missingData = missingData ))
+
+    return grids
+
+#=========================================================================================
+# Read the MRMS levels into the NX by NY 3D grid centered on loc
+
+def assemble_3D_grid(filenames, loc=None, debug=False):
+
+    return assemble_3D_grids(filenames, [(loc, NX, NY)], debug=debug)[0]
+
+#=========================================================================================
+# Thin the grid by subsampling every thin'th point, or with superob = "mean" or "max", by
+# superobbing thin x thin blocks (see dart_tools.superob_grid)
+
+def thin_grid(ref, thin, superob=None):
+
+    if superob != None:
+        ref.data, counts = superob_grid(ref.data, thin, method=superob)
+        ref.lats = superob_coords(ref.lats, thin)
+        ref.lons = superob_coords(ref.lons, thin)
+        if counts.max() > 0:
+            print(" Superobs (%s of %dx%d blocks):  %d, mean number of points per superob:  %4.1f\n" % 
+                  (superob, thin, thin, np.sum(counts > 0), counts[counts > 0].mean()))
+    else:
+        ref.data = ref.data[:,::thin,::thin]
+        ref.lats = ref.lats[::thin]
+        ref.lons = ref.lons[::thin]
+
+    return ref
 
 #=========================================================================================
 # DBZ Mask
@@ -567,10 +875,101 @@ def plot_grid(ref, sweep, plot_filename=None, shapefiles=None, interactive=False
 
   plt.suptitle(title, fontsize=18)
 
-  plt.savefig(filename)
+  save_figure(filename, format=_plot_format)
 
   if interactive:  plt.show()
 #-------------------------------------------------------------------------------
+# Name of the DART obs_seq file written for an analysis time
+
+def output_filename(out_dir, a_time):
+
+   return os.path.join(out_dir, "%s_%s" % ("obs_seq_RF", a_time.strftime("%Y%m%d%H%M")))
+
+#-------------------------------------------------------------------------------
+# Output directory of each domain:  out_dir itself for a single domain, otherwise one
+# sub-directory per domain (out_dir/d01, out_dir/d02, ...)
+
+def domain_dirs(out_dir, ndomains):
+
+   if ndomains == 1:
+       return [out_dir]
+   else:
+       return [os.path.join(out_dir, "d%2.2d" % (n+1)) for n in range(ndomains)]
+
+#-------------------------------------------------------------------------------
+# Grid, mask, write and plot one MRMS volume for each domain [(loc, nx, ny), ...], the
+# plots go into the directory of each domain's obs_seq file
+
+def process_volume(in_filenames, a_time, out_filenames, domains, write=True, sweep_num=None):
+
+   ref_objs = assemble_3D_grids(in_filenames, domains, debug=_debug)
+
+   for ref_obj, out_filename in zip(ref_objs, out_filenames):
+
+       ref_obj.time = a_time
+
+       if _grid_dict['thin_grid'] > 1:
+           ref_obj = thin_grid(ref_obj, _grid_dict['thin_grid'], superob=_grid_dict['superob'])
+
+       ref_obj = dbz_masking(ref_obj, thin_zeros=_grid_dict['thin_zeros'])
+
+       if write == True:      
+           ret = write_DART_ascii(ref_obj, filename=out_filename, levels=np.arange(len(_grid_dict['levels'])),
+                                  obs_error=[_grid_dict['reflectivity'], _grid_dict['0reflectivity']], 
+                                  QC_info=_grid_dict['QC_info'], zero_levels=_grid_dict['zero_levels'])
+
+       if sweep_num != None:
+           fsuffix = "OpMRMS_%s" % (ref_obj.time.strftime('%Y%m%d%H%M'))
+           plot_filename = os.path.join(os.path.dirname(out_filename), fsuffix)
+           if not (_plot_async and queue_plot(plot_grid, ref_obj, sweep_num, plot_filename = plot_filename, debug=_debug)):
+               plot_grid(ref_obj, sweep_num, plot_filename = plot_filename, debug=_debug)
+
+   return ref_objs
+
+#-------------------------------------------------------------------------------
+# Realtime processing of one analysis time, for the command line and for drivers (e.g.,
+# catchup_prep_mrms.py) that import this module once and process many times.  The NX by NY
+# domain centered on loc is processed when no list of domains is given.  With wait (sec),
+# processing starts as soon as all the levels are there, or wait sec after a_time with the
+# levels found by then.  Returns the names of the obs_seq files (without ".out"), or None
+# when no MRMS files are found.
+
+def run_prep_mrms(mrms_dir, a_time, loc, out_dir, write=True, sweep_num=None, domains=None, wait=None):
+
+   if domains == None:
+       domains = [(loc, NX, NY)]
+
+   if wait != None:
+       in_filenames = wait_for_volume(mrms_dir, a_time, a_time + DT.timedelta(seconds=wait))
+   else:
+       try:
+           in_filenames = Get_Closest_Elevations(mrms_dir, a_time)
+       except OSError:
+           in_filenames = []
+
+   if len(in_filenames) == 0:
+       print("\n============================================================================")
+       print("\n Prep_MRMS cannot find a RF file between [%2.2d,%2.2d] min of %s, exiting" % 
+            (_dt_window[0], _dt_window[1], a_time.strftime("%Y%m%d%H%M")))
+       print("\n============================================================================")
+       return None
+
+   print("\n prep_mrms:  RealTime FLAG is true, only processing %s\n" % (in_filenames[:]))
+
+ # Make sure there is a directory to write files into....
+
+   out_filenames = []
+
+   for dir in domain_dirs(out_dir, len(domains)):
+       make_dir(dir)
+       out_filenames.append(output_filename(dir, a_time))
+       print(" Out filename:  %s\n" % out_filenames[-1])
+
+   process_volume(in_filenames, a_time, out_filenames, domains, write=write, sweep_num=sweep_num)
+
+   return out_filenames
+
+#-------------------------------------------------------------------------------
 # Main function defined to return correct sys.exit() calls
 
 def main(argv=None):
@@ -598,10 +997,19 @@ def main(argv=None):
  
    parser.add_option(     "--loc",      dest="loc",  type="float", default=None, nargs = 2,      \
                      help = "Specify location of NEWSe grid center (lat,lon)")
+
+   parser.add_option(     "--domain",   dest="domain", type="float", default=None, nargs = 4, action="append", \
+                     help = "Add a domain lat lon nx ny, repeat for more domains which are all written from one read of the MRMS files")
                   
                  
+   parser.add_option(      "--wait",      dest="wait",      default=None,  type="int",      \
+                     help = "Realtime trigger:  process as soon as all the levels are there, waiting at most until WAIT sec after the analysis time")
+
    parser.add_option(      "--thin",      dest="thin",      default=1,  type="int",      \
                      help = "Specify a number between 2 and 5 thin reflectivity")
+
+   parser.add_option(      "--superob",   dest="superob",   default=None, type="choice", choices=["mean", "max"], \
+                     help = "With --thin, superob thin x thin blocks (mean or max) instead of subsampling")
                   
    (options, args) = parser.parse_args()
 
@@ -615,8 +1023,17 @@ def main(argv=None):
       print
       sys.exit(1)
       
-   if options.loc == None:
-      print "\n\n ***** USER MUST SPECIFY LAT/LON CENTER POINT *****"
+   domains = []
+
+   if options.loc != None:
+      domains.append((options.loc, NX, NY))
+
+   if options.domain != None:
+      for lat, lon, nx, ny in options.domain:
+         domains.append(((lat, lon), int(nx), int(ny)))
+
+   if len(domains) == 0:
+      print "\n\n ***** USER MUST SPECIFY LAT/LON CENTER POINT OR DOMAINS *****"
       print "\n                         EXITING!\n\n"
       parser.print_help()
       print
@@ -624,9 +1041,13 @@ def main(argv=None):
 
    if options.thin > 1:
        _grid_dict['thin_grid'] = options.thin
+
+   if options.superob != None:
+       _grid_dict['superob'] = options.superob
       
    if options.plot < 0:
        plot_grid_flag = False
+       sweep_num = None
    else:
        sweep_num = options.plot
        plot_grid_flag = True
@@ -646,24 +1067,10 @@ def main(argv=None):
 
    if options.realtime != None:
 
-       in_filenames = Get_Closest_Elevations(options.dir, a_time)
+       out = run_prep_mrms(options.dir, a_time, options.loc, options.out_dir, write=options.write, sweep_num=sweep_num,
+                           domains=domains, wait=options.wait)
 
-#      in_filenames = get_dir_files(options.dir, options.grep, debug=_debug)
-#
-       for n, file in enumerate(in_filenames):
-           if os.path.basename(file)[-2:] == "gz":
-               f_time = DT.datetime.strptime(os.path.basename(file)[-25:-10], "%Y%m%d-%H%M%S")
-           else:
-               f_time = DT.datetime.strptime(os.path.basename(file)[-25:-7], "%Y%m%d-%H%M%S")
-           
-       try:
-           print("\n prep_mrms:  RealTime FLAG is true, only processing %s\n" % (in_filenames[:]))
-           rlt_filename = "%s_%s" % ("obs_seq_RF", a_time.strftime("%Y%m%d%H%M"))
-       except:
-           print("\n============================================================================")
-           print("\n Prep_MRMS cannot find a RF file between [%2.2d,%2.2d] min of %s, exiting" % 
-                (_dt_window[0], _dt_window[1], a_time.strftime("%Y%m%d%H%M")))
-           print("\n============================================================================")
+       if out == None:
            sys.exit(1)
 
    else:
@@ -675,41 +1082,24 @@ def main(argv=None):
    
  # Make sure there is a directory to write files into....
  
-   if not os.path.exists(options.out_dir):
-       try:
-           os.mkdir(options.out_dir)
-       except:
-           print("\n**********************   FATAL ERROR!!  ************************************")
-           print("\n PREP_GRID3D:  Cannot create output dir:  %s\n" % options.out_dir)
-           print("\n**********************   FATAL ERROR!!  ************************************")      
-#-------------------------------------------------------------------------------
-   if options.realtime != None:
-       out_filename = os.path.join(options.out_dir, rlt_filename)
-       time         = a_time
-       print(" Out filename:  %s\n" % out_filename)
-   else:
-       print options.realtime == None
        file = in_filenames[0]
        str_time     = "%s_%s" % (os.path.basename(file)[-27:-17], os.path.basename(file)[-16:-10])
        prefix       = "obs_seq_RF_%s" % str_time
-       out_filename = os.path.join(options.out_dir, prefix)
        time         = DT.datetime.strptime(file[-18:-3], "%Y%m%d-%H%M%S")
-       print(" Out filename:  %s\n" % out_filename)
-              
-   ref_obj = assemble_3D_grid(in_filenames, loc=options.loc, debug=_debug)
-   ref_obj.time = a_time
-
-   ref_obj = dbz_masking(ref_obj, thin_zeros=_grid_dict['thin_zeros'])
-
-   if options.write == True:      
-       ret = write_DART_ascii(ref_obj, filename=out_filename, levels=np.arange(len(_grid_dict['levels'])),
-                              obs_error=[_grid_dict['reflectivity'], _grid_dict['0reflectivity']], 
-                              QC_info=_grid_dict['QC_info'], zero_levels=_grid_dict['zero_levels'])
-
-   if plot_grid_flag:
-       fsuffix = "OpMRMS_%s" % (ref_obj.time.strftime('%Y%m%d%H%M'))
-       plot_filename = os.path.join(options.out_dir, fsuffix)
-       plot_grid(ref_obj, sweep_num, plot_filename = plot_filename, debug=_debug)
+
+       for dir in domain_dirs(options.out_dir, len(domains)):
+           if not os.path.exists(dir):
+               try:
+                   make_dir(dir)
+               except:
+                   print("\n**********************   FATAL ERROR!!  ************************************")
+                   print("\n PREP_GRID3D:  Cannot create output dir:  %s\n" % dir)
+                   print("\n**********************   FATAL ERROR!!  ************************************")      
+
+           out_filenames.append(os.path.join(dir, prefix))
+           print(" Out filename:  %s\n" % out_filenames[-1])
+
+       process_volume(in_filenames, time, out_filenames, domains, write=options.write, sweep_num=sweep_num)
     
 #-------------------------------------------------------------------------------
 # Main program for testing...
@@ -14,9 +14,12 @@ import netCDF4 as ncdf
 from pyproj import Proj
 from optparse import OptionParser
 from tables import *
+import numexpr
 from netcdftime import utime
 from datetime import datetime as py_datetime
+from datetime import timedelta as py_timedelta
 from scipy import interpolate
+from scipy.spatial import cKDTree
 from mpl_toolkits.basemap import Basemap
 from mpl_toolkits.axes_grid import AxesGrid
 from mpl_toolkits.axes_grid.inset_locator import inset_axes
@@ -24,7 +27,8 @@ from mpl_toolkits.axes_grid.inset_locator import inset_axes
 _debug               = True
 _verbose             = True
 _missing             = -999.
-version_string       = "pyDART_file_version_3.0"
+version_string       = "pyDART_file_version_4.0"
+supported_versions   = ["pyDART_file_version_3.0", "pyDART_file_version_4.0"]
 checked_file_version = False
 
 #=========================================================================================
@@ -44,6 +48,39 @@ lat_bound_box     = (33.0,37.0)     # max and min latitudes to output
 lon_bound_box     = (-100.,-96.0)   # max and min longitudes to output
 hgt_bound_box     = (0.0,10000.0)   # max and min heights to output
 
+#==========================================================================================
+# PARAMETERS FOR THE SPATIAL BUCKET INDEX (--addindex)
+
+bucket_resolution = 0.25            # size (deg) of the lat/lon tiles used for bucket codes
+bucket_max_ranges = 256             # max number of bucket code ranges looked up for a lat/lon box search
+bucket_max_frac   = 0.25            # if the buckets select more than this fraction of the table, scan it instead
+
+#==========================================================================================
+# PARAMETERS FOR TIME-PARTITIONED FILES (--partition)
+
+partition_seconds = 3600            # default length (sec) of the time bin held by each partition table
+
+#==========================================================================================
+# PARAMETERS FOR SUPEROBBING MERGED TABLES (--superob)
+
+superob_dt        = 300             # length (sec) of the time bins
+superob_reducer   = 'mean'          # how the values in a bin are combined:  mean, median, max or min
+
+#==========================================================================================
+# PARAMETERS FOR INNOVATION STATISTICS (--innov-stats)
+
+innov_seconds     = 3600            # length (sec) of the time bins
+innov_dz          = 1000.           # depth (m) of the height bands
+innov_dr          = 25000.          # width (m) of the bands of range from the platform (radar)
+innov_missing     = -888888.        # DART missing value written for failed forward operators
+innov_qc_failed   = [4, 8]          # DART QC of a failed prior forward operator (or vertical conversion)
+innov_qc          = [0, 1, 2, 3]    # DART QC of the observations in the statistics (assimilated or evaluated)
+
+#==========================================================================================
+# PARAMETERS FOR BULK WRITES (dict2hdf)
+
+bulk_chunk_bytes  = 512*1024        # HDF5 chunk size (bytes) of observation tables written in bulk
+
 #==========================================================================================
 # PARAMETERS FOR MAP PROJECTIONS
 
@@ -220,17 +257,31 @@ def beam_elv(sfc_range, z):
     eighthre=(8.*eradius/3.)
     fthsq=(frthrde*frthrde)
 
-    if sfc_range > 0.0:
-        hgtdb = frthrde + z
-        rngdb = sfc_range/frthrde
+    if N.ndim(sfc_range) == 0:
 
-        elvrad = N.arctan((hgtdb*N.cos(rngdb) - frthrde)/(hgtdb * N.sin(rngdb)))
+        if sfc_range > 0.0:
+            hgtdb = frthrde + z
+            rngdb = sfc_range/frthrde
 
-        return N.rad2deg(elvrad)
+            elvrad = N.arctan((hgtdb*N.cos(rngdb) - frthrde)/(hgtdb * N.sin(rngdb)))
 
-    else:
+            return N.rad2deg(elvrad)
+
+        else:
+
+            return -999.
+
+# Arrays of ranges:  -999. where the range is not positive
+
+    sfc_range = N.asarray(sfc_range)
+
+    hgtdb = frthrde + z
+    rngdb = sfc_range/frthrde
+
+    with N.errstate(divide='ignore', invalid='ignore'):
+        elvrad = N.arctan((hgtdb*N.cos(rngdb) - frthrde)/(hgtdb * N.sin(rngdb)))
 
-        return -999.
+    return N.where(sfc_range > 0.0, N.rad2deg(elvrad), -999.)
 
 #===============================================================================
 def dxy_2_dll(x, y, lat1, lon1, degrees=True, proj = map_projection):
@@ -331,59 +382,74 @@ def dll_2_dxy(lat1, lat2, lon1, lon2, degrees=False, azimuth=False, proj = map_p
 
 #===================================================================================================
 def cressman(x, y, obs, x0, y0, roi, missing=_missing):
-  """ Returns a data value for the point
+  """ Returns the Cressman analysis of the obs at the point(s) x0, y0
       Arguments: x/y/obs:  1D arrays of location
-                 x0, y0:   point to analyze to
+                 x0, y0:   point(s) to analyze to - scalars, or arrays of any (matching) shape
                  roi:      radius of influence
-                 missing:  value to assign if no data, default = 0.0
-      This routine can also be implemented in FORTRAN much quicker...
+                 missing:  value to assign if no data, default = _missing
+      A kd-tree of the obs is built once, and the obs within roi of every analysis point
+      are found with one query, so a whole grid is analyzed in one call.  Returns a scalar
+      for a scalar point, otherwise an array with the shape of x0.
   """
-# Create distance array
 
-  dis = N.sqrt( (x-x0)**2 + (y-y0)**2 )
+  x   = N.asarray(x,   dtype=N.float64).ravel()
+  y   = N.asarray(y,   dtype=N.float64).ravel()
+  obs = N.asarray(obs, dtype=N.float64).ravel()
 
-# Cut the size o n by choosing a smart threshold (2 km)
+  scalar = N.ndim(x0) == 0
+  shape  = N.shape(x0)
 
-  indices = N.where(dis <= roi)
+  xg = N.asarray(x0, dtype=N.float64).ravel()
+  yg = N.asarray(y0, dtype=N.float64).ravel()
 
-# Check to see if there are any data ponts that are within search radius
+  anal = N.empty(xg.size)
+  anal.fill(missing)
 
-  size = N.size(indices)
+  if obs.size > 0:
 
-  if size != 0:
-    R2    = roi**2.0
-    w_sum = 0.0
-    top   = 0.0
-    print "CRESSMAN param:  ", size, x, y, obs, x0, y0
+# Find the obs within the radius of influence of each analysis point
 
-# go thru values w/in radius: calculate weight, mult by value and sum also sum weights
+    tree      = cKDTree(N.column_stack((x, y)))
+    neighbors = tree.query_ball_point(N.column_stack((xg, yg)), roi)
 
-    for n, value in enumerate(dis[indices]):
-      rk2 = value**2.0
-      wk = (R2-rk2) / (R2+rk2)
-      top = top + wk*obs[n]
-      w_sum = w_sum + wk
-#       print n, value, data[n], R2, w_sum, top
+    count  = N.array([len(n) for n in neighbors], dtype=N.int64)
 
-    if w_sum < 0.01:
-      return missing
-    else:
-      return top/w_sum
+    if count.sum() > 0:
+      point = N.repeat(N.arange(xg.size), count)
+      ob    = N.concatenate([n for n in neighbors if len(n) > 0]).astype(N.int64)
+
+# Calculate weights, sum the weighted obs and the weights for each point
+
+      R2  = roi**2.0
+      rk2 = (x[ob] - xg[point])**2 + (y[ob] - yg[point])**2
+      wk  = (R2-rk2) / (R2+rk2)
 
+      top   = N.bincount(point, weights=wk*obs[ob], minlength=xg.size)
+      w_sum = N.bincount(point, weights=wk,         minlength=xg.size)
+
+      good       = w_sum >= 0.01
+      anal[good] = top[good] / w_sum[good]
+
+  if scalar:
+    return anal[0]
   else:
-    return missing
+    return anal.reshape(shape)
 
 #===============================================================================
 def chk_pyDart_version(h5file, verbose = True):
-    """Checks the H5 pyDart file to see whether the file format is compatible"""
+    """Checks the H5 pyDart file to see whether the file format is compatible, and
+       returns the file version so that the caller can pick the table description.
+       Version 3 files can still be read, but new files are always written as
+       version 4 - use "pyDart.py -f old.h5 --migrate -o new.h5" to convert.
+    """
     
     global checked_file_version
     
-    if checked_file_version and h5file.title != version_string:
+    if h5file.title not in supported_versions:
         print
         print "\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/"
         print " !!! pyDART file is wrong version !!!"
-        print "pyDart sofware expects version:  ", version_string
+        print "pyDart sofware expects versions: ", supported_versions
         print "pyDart file contains version:    ", h5file.title
         print "pyDart software is exiting"
         print "/\/\/\/\/\/\/\/\\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/"
@@ -393,226 +459,1321 @@ def chk_pyDart_version(h5file, verbose = True):
         if not checked_file_version and verbose == True:
             print
             print "pyDART file is version:  ",h5file.title
+            if h5file.title != version_string:
+                print "pyDART file can be converted to %s using --migrate" % version_string
             print "/\/\/\/\/\/\/\/\\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/"
             print
-            return
+            checked_file_version = True
+    
+    return h5file.title
 
 #===============================================================================
-def open_pyDart_file(filename, return_root=False, verbose = None, append=False):
+def obs_description(version=version_string):
+    """Returns the observation table description used by a pyDart file version"""
     
-    """Open_pyDart_file opens the pyTables pyDart file, checks a few things and
-       returns a the file handle and pyDart table object for use.
+    if version == version_string:
+        return DART_obs
+    else:
+        return DART_obs_v3
+
+#===============================================================================
+def ensemble_description(nens):
+    """Returns the description of the optional /obs/ensemble side table, which holds
+       the ensemble copies of version 4 files for the observation table rows in "row"
     """
+    
+    return { "row":      Int64Col(pos=0),
+             "Hxbm":     Float32Col(shape=(nens,), dflt=_missing, pos=1),
+             "Hxam":     Float32Col(shape=(nens,), dflt=_missing, pos=2),
+             "Yb_prime": Float32Col(shape=(nens,), dflt=_missing, pos=3) }
 
-# Open DART PyTables file
+#===============================================================================
+def utime2date(utime):
+    """Converts utime (seconds since 1970) into the date string(s) that version 3
+       files stored in the "date" column, e.g., 2016-05-24_18:00:00
+    """
     
-    if append:
-        h5file = open_file(filename, mode = "a")
-    else:
-        h5file = open_file(filename, mode = "r")
+    return N.char.replace(N.asarray(utime, dtype=N.int64).astype('M8[s]').astype('S19'), 'T', '_')
+
+#===============================================================================
+def read_rows(table, coords):
+    """Reads the rows in coords from a pyDart table as one block.  A run of consecutive
+       rows (the usual result of a time search) is read as a slice instead of a point
+       selection, which is much faster for compressed tables.
+    """
     
-    chk_pyDart_version(h5file,verbose)
+    coords = N.asarray(coords)
     
-    root   = h5file.root
+    if len(coords) > 0 and coords[-1] - coords[0] + 1 == len(coords) and N.all(N.diff(coords) == 1):
+        return table.read(start=coords[0], stop=coords[-1]+1)
+    else:
+        return table.read_coordinates(coords)
 
-# observations are a table in obs.observations
+#===============================================================================
+def read_columns(table, coords, columns):
+    """Reads the rows in coords from a pyDart table as one block, and returns a
+       dictionary holding only the requested columns.  Each column is read on its own
+       (field=), so the other columns of the rows are never read or decompressed.
+    """
     
-    if return_root:
-        return h5file, root, table
+    coords = N.asarray(coords)
+    
+    if len(coords) > 0 and coords[-1] - coords[0] + 1 == len(coords) and N.all(N.diff(coords) == 1):
+        return dict( (name, table.read(start=coords[0], stop=coords[-1]+1, field=name)) for name in columns )
     else:
-        return h5file, root.obs.observations
-
-
-#===================================================================================================
-def ObType_LookUp(name,DART_name=False,Print_Table=False):
-      """ObType_LookUp returns the DART kind number for an input variable type.  There seems
-         to be several ways observations names are written in the observation inputs
-         and output files, e.g., in the DART ascii files and in the ***.obs.nc files,
-         so this function is designed to handle the variety of cases and return the
-         integer corresponding to the DART definition.
-      
-         Exampled:   REFLECTIVITY is sometimes stored as REFL
-                     T_2M         is sometimes stored as TEMP2m
-                     TD_2M        is sometimes stored as DEWPT2m
-      
-         If you come across a variable that is not defined, you can add it to the lookup
-         table (dictionary) below - just make sure you know the official DART definition
-         
-         You can add any unique variable name or reference on the left column, and then use
-         the pyDART INTERNAL definition on the right - so that you can refer to more than
-         one type of data in different ways internally in this code
-      
-         Usage:  variable_kind = ObType_Lookup(variable_name)   where type(variable_name)=str
-      
-         If you need the return the actual DART_name as well, set the input flag to be True"""
-
-# Create local dictionary for observation kind definition - these can include user abbreviations
-
-#                      user's observation type            kind   DART official name
-
-      Look_Up_Table={ "DOPPLER_VELOCITY":                 [11,   "DOPPLER_RADIAL_VELOCITY"] ,
-                      "DOPPLER_RADIAL_VELOCITY":          [11,   "DOPPLER_RADIAL_VELOCITY"] ,
-                      "REFLECTIVITY":                     [12,   "RADAR_REFLECTIVITY"],
-                      "RADAR_REFLECTIVITY":               [12,   "RADAR_REFLECTIVITY"],
-                      "RADAR_CLEARAIR_REFLECTIVITY":      [13,   "RADAR_CLEARAIR_REFLECTIVITY"],  
-                      "CLEARAIR_REFLECTIVITY":            [13,   "RADAR_CLEARAIR_REFLECTIVITY"],
-                      "DIFFERENTIAL_REFLECTIVITY":        [300,  "DIFFERENTIAL_REFLECTIVITY"],
-                      "SPECIFIC_DIFFERENTIAL_PHASE":      [301,  "SPECIFIC_DIFFERENTIAL_PHASE"],
-                      "METAR_U_10_METER_WIND":            [1,    "METAR_U_10_METER_WIND"],
-                      "METAR_V_10_METER_WIND":            [2,    "METAR_V_10_METER_WIND"],
-                      "METAR_TEMPERATURE_2_METER":        [4,    "METAR_TEMPERATURE_2_METER"],
-                      "METAR_DEWPOINT_2_METER":           [9,    "METAR_DEWPOINT_2_METER"],
-                      "METAR_SPECIFIC_HUMIDITY_2_METER":  [5,    "METAR_SPECIFIC_HUMIDITY_2_METER"],
-                      "VR":                               [11,   "DOPPLER_RADIAL_VELOCITY"],
-                      "DBZ":                              [12,   "RADAR_REFLECTIVITY"],
-                      "0DBZ":                             [13,   "RADAR_CLEARAIR_REFLECTIVITY"],
-                      "ZDR":                              [300,  "DIFFERENTIAL_REFLECTIVITY"],
-                      "KDP":                              [301,  "SPECIFIC_DIFFERENTIAL_PHASE"],
-                      "U10M":                             [1,    "METAR_U_10_METER_WIND"],
-                      "V10M":                             [2,    "METAR_V_10_METER_WIND"],
-                      "T2M":                              [4,    "METAR_TEMPERATURE_2_METER"],
-                      "TD2M":                             [9,    "METAR_DEWPOINT_2_METER"],
-                      "H2M":                              [5,    "METAR_SPECIFIC_HUMIDITY_2_METER"],
-                      "U_10M":                            [1,    "METAR_U_10_METER_WIND"],
-                      "V_10M":                            [2,    "METAR_V_10_METER_WIND"],
-                      "T_2M":                             [4,    "METAR_TEMPERATURE_2_METER"],
-                      "TD_2M":                            [9,    "DEW_POINT_2_METER"],
-                      "H_2M":                             [5,    "METAR_SPECIFIC_HUMIDITY_2_METER"],
-                      "TEMP2M":                           [4,    "METAR_TEMPERATURE_2_METER"],
-                      "DEWPT2M":                          [9,    "DEW_POINT_2_METER"],
-                      "REFL":                             [12,   "RADAR_REFLECTIVITY"],
-                      "FLASH_RATE_2D":                    [2014, "FLASH_RATE_2D"],
-                      "METAR_ALTIMETER":                  [71,   "METAR_ALTIMETER"],
-                      "LAND_SFC_ALTIMETER":               [70,   "LAND_SFC_ALTIMETER"],
-                      "LAND_SFC_DEWPOINT":                [58,   "LAND_SFC_DEWPOINT"],
-                      "LAND_SFC_TEMPERATURE":             [25,   "LAND_SFC_TEMPERATURE"],
-                      "LAND_SFC_U_WIND_COMPONENT":        [23,   "LAND_SFC_U_WIND_COMPONENT"],
-                      "LAND_SFC_V_WIND_COMPONENT":        [24,   "LAND_SFC_V_WIND_COMPONENT"],
-                      "GOES_CWP_PATH":                    [80,   "GOES_CWP_PATH"],
-                      "GOES_LWP_PATH":                    [119,   "GOES_LWP_PATH"],
-                      "GOES_IWP_PATH":                    [120,   "GOES_IWP_PATH"],
-                      "GOES_CWP_ZERO":                    [121,   "GOES_IWP_ZERO"]
-                    }
-      
-      if Print_Table:
-            print
-            print "VALID INPUT VARIABLE NAME              KIND  DART NAME"
-            print "=========================================================================="
-            for key in Look_Up_Table.keys():
-                  print "%35s    %3d    %s" % (key, Look_Up_Table[key][0], Look_Up_Table[key][1])
-            return
-      
-      name2 = name.upper().strip()
-      if Look_Up_Table.has_key(name2):
-            if DART_name == True:
-                  return Look_Up_Table[name2][0], Look_Up_Table[name2][1]
-            else:
-                 return Look_Up_Table[name2][0]
-      else:
-            print "ObType_LookUp cannot find variable:  ", name, name2
-            raise SystemExit
+        return dict( (name, table.read_coordinates(coords, field=name)) for name in columns )
 
 #===============================================================================
-def mergeTables(table_new, tables, addindex=True):
-
-    print "mergeTable called:  New table:  ",table_new
-
-    if len(tables) == 2 and tables[0] == "D":
-        tables = glob.glob("%s/*.h5" % tables[1])
-
-    print "mergeTable called:  Reading from:  ",tables, len(list(tables))
-
-    if len(tables) == 1 or type(tables) == type('str'):
-        print "Only one table for merging supplied, simply doing a copy..."
-        h5file1, table1 = open_pyDart_file(tables)
-        h5file1.copy_file(table_new, overwrite=True)
-        h5file1.close()
-        print "Finished copying %s into %s" % (tables, table_new)
+def iter_columns(table, index, columns, chunk=100000, kind=None):
+    """Generator that reads the rows in index "chunk" at a time and yields a dictionary
+       of the requested columns for each block, plus "row" holding the table row numbers.
+       When kind is given, only the observations of that DART kind are returned.
+    """
+    
+    columns = list(columns)
+    if kind != None and "kind" not in columns:
+        read = columns + ["kind"]
     else:
-        h5file1, table1 = open_pyDart_file(tables[0])
-        print "Creating new table to copy into...."
-        h5file1.copy_file(table_new, overwrite=True)
-        print("Finished copying %s into %s, has a length: %i" % (tables[0], table1, table1.nrows))
-
-        h5file1.close()   
-        h5file1, table1 = open_pyDart_file(table_new, append=True)
-
-        for file in tables[1:]: 
-            print "Now copying from table:  ", file
-            h5file2, table2 = open_pyDart_file(file)
-
-            rows = table2.read()
-            table1.append(rows)
-            table1.flush()
-
-            h5file2.close()
-            print("Finished copying %s into %s\n New table has a length: %i\n" % (tables[0], table1, table1.nrows))
-
-        print "Finished appending all table rows...."
-        print "New table:    ", table1
+        read = columns
+    
+    for n0 in range(0, len(index), chunk):
         
-        indexrows = table1.cols.utime.create_csindex()
+        coords = N.asarray(index[n0:n0+chunk])
+        block  = read_columns(table, coords, read)
         
-        group_header = h5file1.root.header
-        group_header.attributes.cols.last[0]        = table1.nrows
-        group_header.attributes.cols.max_num_obs[0] = table1.nrows
-        group_header.attributes.cols.num_obs[0]     = table1.nrows
+        block["row"] = coords
         
-        h5file1.close()
+        if kind != None:
+            keep  = block["kind"] == kind
+            block = dict( (name, block[name][keep]) for name in block.keys() )
+        
+        yield block
 
-        return
+#===============================================================================
+def merge_moments(n, mean, m2, values):
+    """Merges the count, mean and sum of squared differences (n, mean, m2) of the values
+       seen so far with a new block of values (Chan et al. parallel form of Welford's
+       single pass algorithm), so a variance never needs all the values at once.
+    """
+    
+    nb = values.size
+    
+    if nb == 0:
+        return n, mean, m2
+    
+    mean_b = values.mean(dtype=N.float64)
+    m2_b   = ((values - mean_b)**2).sum(dtype=N.float64)
+    
+    delta = mean_b - mean
+    ntot  = n + nb
+    
+    return ntot, mean + delta * nb / ntot, m2 + m2_b + delta**2 * n * nb / ntot
 
 #===============================================================================
-#
-def sortTable(filename, overwrite=True):
+def morton_code(ix, iy):
+    """Interleaves the bits of the tile numbers ix and iy (each < 2**16) into a Morton
+       (Z-order) code, so tiles that are close together usually have close codes
+    """
+    
+    ix   = N.asarray(ix, dtype=N.int64)
+    iy   = N.asarray(iy, dtype=N.int64)
+    code = N.zeros(ix.shape, dtype=N.int64)
+    
+    for b in range(16):
+        code |= ((ix >> b) & 1) << (2*b)
+        code |= ((iy >> b) & 1) << (2*b+1)
+    
+    return code
 
-    if overwrite:
-       cmd = ("cp %s %s_unsorted.h5" % (filename, filename[:-3]))
-       print("\n sortTable is running command:  %s" % cmd)
-       os.system(cmd)
-       
-    cmd = ("ptrepack -o --overwrite-nodes --keep-source-filters %s:/ sorted.h5:/" % filename)
-    print("\n sortTable is running command:  %s" % cmd)
-    os.system(cmd)
+#===============================================================================
+def bucket_tiles(lat, lon, resolution=bucket_resolution):
+    """Returns the lat/lon tile numbers (ix, iy) of the spatial bucket index for lat/lon in degrees"""
     
-    cmd = ("ptrepack --sortby utime --overwrite-nodes --keep-source-filters %s:/obs/observations sorted.h5:/obs/observations" % \
-           filename)
-    print("\n sortTable is running command:  %s" % cmd)
-    os.system(cmd)
+    ix = N.floor(((N.asarray(lon, dtype=N.float64) + 180.) % 360.) / resolution)
+    iy = N.floor((N.clip(N.asarray(lat, dtype=N.float64), -90., 90.) + 90.) / resolution)
     
-    if overwrite:
-         cmd = ("mv sorted.h5 %s" % filename)
-         print("\n sortTable is running command:  %s" % cmd)
-         os.system(cmd)
-                   
-    return
+    return ix.astype(N.int64), iy.astype(N.int64)
 
 #===============================================================================
-class pyDART():
+def bucket_code(lat, lon, resolution=bucket_resolution):
+    """Returns the spatial bucket (Morton code of the lat/lon tile) for lat/lon in degrees"""
+    
+    ix, iy = bucket_tiles(lat, lon, resolution)
+    
+    return morton_code(ix, iy)
 
-    def __init__(self, verbose=True, debug=True):
-        self.hdf5    = None
-        self.ascii   = None
-        self.index   = None
-        self.verbose = verbose
-        self.debug   = debug
+#===============================================================================
+def bucket_ranges(lat_box=None, lon_box=None, resolution=bucket_resolution, max_ranges=bucket_max_ranges):
+    """Plans a lat/lon box search as a list of (first, last) bucket code ranges that cover
+       every tile touching the box.  When there are more than max_ranges runs of codes,
+       the smallest gaps are filled in - the exact filter after the lookup removes the extras.
+    """
+    
+    nx = int(N.ceil(360. / resolution))
+    ny = int(N.floor(180. / resolution)) + 1
+    
+    if lon_box == None or lon_box[1] - lon_box[0] >= 360. - resolution:
+        ix = N.arange(nx)
+    else:
+        ix0, iy0 = bucket_tiles(0., lon_box[0], resolution)
+        ix1, iy1 = bucket_tiles(0., lon_box[1], resolution)
+        if ix1 >= ix0:
+            ix = N.arange(ix0, ix1+1)
+        else:
+            ix = N.concatenate((N.arange(ix0, nx), N.arange(0, ix1+1)))
+    
+    if lat_box == None:
+        iy = N.arange(ny)
+    else:
+        ix0, iy0 = bucket_tiles(lat_box[0], 0., resolution)
+        ix1, iy1 = bucket_tiles(lat_box[1], 0., resolution)
+        iy = N.arange(iy0, iy1+1)
+    
+    IX, IY = N.meshgrid(ix, iy)
+    codes  = N.unique(morton_code(IX.ravel(), IY.ravel()))
 
-#-------------------------------------------------------------------------------
-# File:  creates a standard set of filenames for pyDART ascii and hdf5 files
-#-------------------------------------------------------------------------------
+# Runs of consecutive codes, then merge across the smallest gaps until there are few enough
     
-    def file(self,filename=None):
-        
-        if filename != None:
-            
-            if filename[-4:] == ".out":
-                self.hdf5  = filename[:-4] + ".h5"
-                self.ascii = filename
-                return
-            
-            if filename[-3:] == ".h5":
-                self.hdf5  = filename
-                self.ascii = filename[:-3] + ".out"
+    breaks = N.nonzero(N.diff(codes) > 1)[0]
+    
+    if breaks.size >= max_ranges:
+        gaps   = codes[breaks+1] - codes[breaks]
+        breaks = N.sort(breaks[N.argsort(gaps, kind='mergesort')[-(max_ranges-1):]])
+    
+    first = N.concatenate(([codes[0]], codes[breaks+1]))
+    last  = N.concatenate((codes[breaks], [codes[-1]]))
+    
+    return zip(first.tolist(), last.tolist())
+
+#===============================================================================
+def where_rows(table, coords, condition, chunk=100000):
+    """Applies an in-kernel style condition string to the rows in coords, reading only
+       the columns that the condition uses, and returns the rows that pass
+    """
+    
+    names   = set(re.findall(r"[A-Za-z_]\w*", condition))
+    columns = [name for name in table.colnames if name in names]
+    
+    keep = []
+    
+    for block in iter_columns(table, coords, columns, chunk=chunk):
+        mask = numexpr.evaluate(condition, local_dict=block)
+        keep.append(block["row"][mask])
+    
+    if len(keep) == 0:
+        return N.zeros((0,), dtype=N.int64)
+    
+    return N.concatenate(keep)
+
+#===============================================================================
+def default_rows(table, nrows):
+    """Returns a structured array of nrows rows for table, filled with the column
+       defaults, so that blocks of observations can be filled column by column and
+       appended with a single call
+    """
+    
+    rows = N.empty(nrows, dtype=table.dtype)
+    
+    for name in table.colnames:
+        rows[name] = table.coldflts[name]
+    
+    return rows
+
+#===============================================================================
+def obs_seq_copies(data_storage, num_copies):
+    """Returns, for each copy and qc description in the header of a DART ascii file, the
+       pyDart column it is stored in and the ensemble member number (None unless the
+       column is Hxbm or Hxam).  Copies pyDart does not keep (e.g., inflation) map to None.
+       Of the qc copies, the DART quality control is kept, or the first one if there is none.
+    """
+    
+    copies = []
+    
+    qc_copies = [d.lower() for d in data_storage[num_copies:]]
+    dart_qc   = [d for d in qc_copies if d.find("dart quality control") != -1]
+    
+    for n, description in enumerate(data_storage):
+        
+        d      = " ".join(description.lower().split())
+        column = None
+        member = None
+        
+        if n >= num_copies:
+            if (len(dart_qc) > 0 and d.find("dart quality control") != -1) or (len(dart_qc) == 0 and n == num_copies):
+                column = "qc"
+        elif d.find("prior ensemble mean") != -1:
+            column = "Hxb_bar"
+        elif d.find("posterior ensemble mean") != -1:
+            column = "Hxa_bar"
+        elif d.find("prior ensemble spread") != -1:
+            column = "sdHxb"
+        elif d.find("posterior ensemble spread") != -1:
+            column = "sdHxa"
+        elif d.find("prior ensemble member") != -1:
+            column = "Hxbm"
+            member = int(d.split()[-1]) - 1
+        elif d.find("posterior ensemble member") != -1:
+            column = "Hxam"
+            member = int(d.split()[-1]) - 1
+        elif d.find("obs") != -1:
+            column = "value"
+        elif d.find("tru") != -1:
+            column = "truth"
+        
+        copies.append( (column, member) )
+    
+    return copies
+
+#===============================================================================
+def is_obs_seq_final(data_storage, num_copies):
+    """True when the copies of a DART ascii file include the ensemble statistics or members
+       of an obs_seq.final (which are read by pyDART.read_obs_seq_final)
+    """
+    
+    columns = [column for column, member in obs_seq_copies(data_storage, num_copies)]
+    
+    return len(set(columns) & set(["Hxb_bar", "Hxa_bar", "sdHxb", "sdHxa", "Hxbm", "Hxam"])) > 0
+
+#===============================================================================
+def stored_copies(data_storage, num_copies, num_qc):
+    """Returns the (num_copies, num_qc, number of ensemble members) a pyDart file holds for
+       a DART ascii file with these copies:  an obs_seq.final keeps only the observation (and
+       truth) copies and one qc copy, with the members in the /obs/ensemble side table
+    """
+    
+    if not is_obs_seq_final(data_storage, num_copies):
+        return num_copies, num_qc, 0
+    
+    copies  = obs_seq_copies(data_storage, num_copies)
+    columns = [column for column, member in copies]
+    nens    = max([member+1 for column, member in copies if member != None] + [0])
+    
+    return 1 + ("truth" in columns), 1, nens
+
+#===============================================================================
+def ascii_fields(lines, field=0, dtype=N.float64):
+    """Returns field number "field" of each of the DART ascii lines (split on blanks and
+       commas, Fortran D exponents allowed) as an array of dtype
+    """
+    
+    return N.array([line.replace(",", " ").split()[field].replace("D", "e") for line in lines]).astype(dtype)
+
+#===============================================================================
+def parse_obs_seq_records(lines, table, copies, obtype_dict, radar_loc=None, ens_dtype=None):
+    """Parses a block of complete observation records of a DART ascii file (lines from one
+       "OBS" line up to the next one) all at once.  The position of every field is found
+       from the record starts and the lengths of the location and obs_def parts, and each
+       field is then converted for all the records in one call.  Returns a structured array
+       of the table rows (with the index column unset), and, when ens_dtype is
+       given, the ensemble members of those rows (with the row column unset).
+    """
+    
+    lines = [line for line in lines if line.strip() != ""]
+    L     = N.array(lines, dtype=object)
+    
+    start = N.array([i for i, line in enumerate(lines) if line.lstrip().startswith("OBS")], dtype=N.int64)
+    nobs  = start.size
+    
+    rows = default_rows(table, nobs)
+    
+    if nobs == 0:
+        return rows, None
+    
+    rows['number'] = ascii_fields(L[start], 1, N.int64)
+
+# Data copies, the ensemble members go to their own array
+    
+    ncopy = len(copies)
+    
+    if ens_dtype != None:
+        ens = N.empty(nobs, dtype=ens_dtype)
+        for name in ens.dtype.names:
+            ens[name] = _missing
+    else:
+        ens = None
+    
+    values = ascii_fields(L[(start[:,N.newaxis] + 1 + N.arange(ncopy)).ravel()]).reshape(nobs, ncopy)
+    
+    for n, (column, member) in enumerate(copies):
+        if column in ["Hxbm", "Hxam"]:
+            if ens is not None:  ens[column][:,member] = values[:,n]
+        elif column != None:
+            rows[column] = values[:,n]
+    
+    links = start + ncopy + 1
+    
+    rows["previous"]  = ascii_fields(L[links], 0, N.int64)
+    rows["next"]      = ascii_fields(L[links], 1, N.int64)
+    rows["cov_group"] = ascii_fields(L[links], 2, N.int64)
+
+# Location, the vertical coordinate is either on the location line or the next one
+    
+    loc    = links + 3
+    inline = N.array([len(line.split()) >= 4 for line in L[loc]], dtype=bool)
+    
+    rows["lon"]    = N.rad2deg(ascii_fields(L[loc], 0))
+    rows["lat"]    = N.rad2deg(ascii_fields(L[loc], 1))
+    rows["height"] = ascii_fields(L[loc], 2)
+    
+    rows["lon"] = N.where(rows["lon"] > 180.0, rows["lon"] - 360., rows["lon"])
+    
+    rows["vert_coord"][inline]  = ascii_fields(L[loc[inline]], 3, N.int64)
+    rows["vert_coord"][~inline] = ascii_fields(L[loc[~inline]+1], 0, N.int64)
+    
+    kind_line = loc + 2 + (~inline)
+    dart_kind = ascii_fields(L[kind_line], 0, N.int64)
+    time_line = kind_line + 1
+
+# GOES cloud path observations carry two extra lines with the satellite position
+    
+    goes = N.in1d(dart_kind, [ObType_LookUp("GOES_CWP_PATH"), ObType_LookUp("GOES_IWP_PATH"), 
+                              ObType_LookUp("GOES_LWP_PATH"), ObType_LookUp("GOES_CWP_ZERO")])
+    
+    for n in N.nonzero(goes)[0]:
+        stuff = L[kind_line[n]+1]
+        if stuff.find("2*") > 0:
+            rows["satellite"][n,0] = stuff.split(" 2*")[1]
+            rows["satellite"][n,1] = stuff.split(" 2*")[1]
+        else:
+            stuff = stuff.split(",")
+            rows["satellite"][n,0] = N.rad2deg(read_double_precision_string(stuff[0]))
+            rows["satellite"][n,1] = N.rad2deg(read_double_precision_string(stuff[1]))
+        rows["satellite"][n,2] = N.float(L[kind_line[n]+2].split()[0])
+    
+    time_line[goes] = time_line[goes] + 2
+
+# Reset the DART kind integers to the pyDart "standard" IDs
+    
+    rows["kind"] = dart_kind
+    
+    for k in N.unique(dart_kind):
+        try:
+            rows["kind"][dart_kind == k] = ObType_LookUp(obtype_dict[k])
+        except:
+            pass
+
+# Radial velocity:  platform location, direction, nyquist and key
+    
+    vr = N.nonzero(rows["kind"] == ObType_LookUp("VR"))[0]
+    
+    if vr.size > 0:
+        
+        ploc    = kind_line[vr] + 3
+        pinline = N.array([len(line.split()) >= 4 for line in L[ploc]], dtype=bool)
+        
+        rows['platform_lon'][vr]    = N.rad2deg(ascii_fields(L[ploc], 0))
+        rows['platform_lat'][vr]    = N.rad2deg(ascii_fields(L[ploc], 1))
+        rows['platform_height'][vr] = ascii_fields(L[ploc], 2)
+        
+        rows['platform_lon'][vr] = N.where(rows['platform_lon'][vr] > 180.0, rows['platform_lon'][vr] - 360., 
+                                           rows['platform_lon'][vr])
+        
+        rows['platform_vert_coord'][vr[pinline]]  = ascii_fields(L[ploc[pinline]], 3, N.int64)
+        rows['platform_vert_coord'][vr[~pinline]] = ascii_fields(L[ploc[~pinline]+1], 0, N.int64)
+        
+        pdir = ploc + 2 + (~pinline)
+        
+        rows['platform_dir1'][vr]    = ascii_fields(L[pdir], 0)
+        rows['platform_dir2'][vr]    = ascii_fields(L[pdir], 1)
+        rows['platform_dir3'][vr]    = ascii_fields(L[pdir], 2)
+        rows['platform_nyquist'][vr] = ascii_fields(L[pdir+1], 0)
+        rows['platform_key'][vr]     = ascii_fields(L[pdir+2], 0, N.int64)
+        
+        time_line[vr] = pdir + 3
+        
+        rows['z'][vr] = rows['height'][vr] - rows['platform_height'][vr]
+        
+        platforms = set(zip(rows['platform_lat'][vr].tolist(), rows['platform_lon'][vr].tolist()))
+        
+        for radar_lat, radar_lon in platforms:
+            p = vr[(rows['platform_lat'][vr] == radar_lat) & (rows['platform_lon'][vr] == radar_lon)]
+            rows['x'][p], rows['y'][p], rows['azimuth'][p] = dll_2_dxy(radar_lat, rows['lat'][p], radar_lon, rows['lon'][p], 
+                                                                       azimuth=True, degrees=True)
+        
+        rows['elevation'][vr] = N.rad2deg(N.arcsin(rows['platform_dir3'][vr]))
+        
+        up = vr[rows['elevation'][vr] > 89.9]           # radar pointing straight up?
+        rows['azimuth'][up] = 0.0
+
+# Reflectivity:  compute the elevation and azimuth from the radar location, if supplied
+    
+    dbz = N.nonzero(rows["kind"] == ObType_LookUp("DBZ"))[0]
+    
+    if dbz.size > 0 and radar_loc != None:
+        
+        radar_lat = radar_loc[0]
+        radar_lon = radar_loc[1]
+        radar_hgt = radar_loc[2]
+        
+        rows['z'][dbz] = rows['height'][dbz] - radar_hgt
+        rows['x'][dbz], rows['y'][dbz], rows['azimuth'][dbz] = dll_2_dxy(radar_lat, rows['lat'][dbz], radar_lon, 
+                                                                         rows['lon'][dbz], azimuth=True, degrees=True)
+        
+        x = rows['x'][dbz].astype(N.float64)
+        y = rows['y'][dbz].astype(N.float64)
+        
+        R = N.sqrt(x**2 + y**2)
+        elevation_angle = beam_elv(R, rows['z'][dbz].astype(N.float64))
+        
+        with N.errstate(divide='ignore', invalid='ignore'):
+            rows['platform_dir1'][dbz] = (x / R) * N.deg2rad(elevation_angle)
+            rows['platform_dir2'][dbz] = (y / R) * N.deg2rad(elevation_angle)
+        rows['platform_dir3'][dbz]    = N.sin(N.deg2rad(elevation_angle))
+        rows['elevation'][dbz]        = elevation_angle
+        
+        up = dbz[elevation_angle > 89.9]                # radar pointing straight up?
+        rows['azimuth'][up] = 0.0
+
+# Time and error variance, the UTIME is computed from the DART days and seconds
+    
+    rows['seconds'] = ascii_fields(L[time_line], 0, N.int64)
+    rows['days']    = ascii_fields(L[time_line], 1, N.int64)
+    
+    utime0 = round(sec_utime.date2num(day_utime.num2date(0.0)))
+    
+    rows['utime']     = rows['days'].astype(N.int64) * 86400 + rows['seconds'] + long(utime0)
+    rows['error_var'] = ascii_fields(L[time_line+1], 0)
+
+# Departure from the prior mean, and the prior ensemble perturbations.  Both stay _missing
+# unless the prior mean and every prior member are there (DART writes innov_missing for them
+# when a forward operator fails) and the DART QC does not flag a failed prior forward operator
+    
+    def valid(values):
+        return (values != _missing) & (values != innov_missing)
+    
+    prior = valid(rows['Hxb_bar']) & ~N.in1d(rows['qc'], innov_qc_failed)
+    
+    if ens is not None:
+        prior = prior & N.all(valid(ens['Hxbm']), axis=1)
+    
+    ok = prior & valid(rows['value'])
+    rows['dep'][ok] = rows['value'][ok] - rows['Hxb_bar'][ok]
+    
+    if ens is not None:
+        ens['Yb_prime'][prior] = ens['Hxbm'][prior] - rows['Hxb_bar'][prior,N.newaxis].astype(ens['Hxbm'].dtype)
+
+# Skip the bad values, as read_obs_seq_body does
+    
+    good = ~(N.isnan(rows['platform_dir1']) | N.isnan(rows['platform_dir2']))
+    
+    if not N.all(good):
+        print("parse_obs_seq_records:  Found %d bad values, skipping\n" % (nobs - good.sum()))
+        rows = rows[good]
+        if ens is not None:  ens = ens[good]
+    
+    return rows, ens
+
+#===============================================================================
+def iter_where(table, condition=None, coords=None, chunk=100000):
+    """Generator that scans a table (or the active partitions of a PartitionedTable) a
+       slab of chunk rows at a time, and yields the row numbers in each slab that satisfy
+       the in-kernel condition (all of them when condition is None).  When coords is
+       given, only those candidate rows are tested.
+    """
+    
+    if coords is not None:
+        for n0 in range(0, len(coords), chunk):
+            block = N.asarray(coords[n0:n0+chunk], dtype=N.int64)
+            if condition != None:
+                block = where_rows(table, block, condition, chunk=chunk)
+            yield block
+        return
+    
+    if isinstance(table, PartitionedTable):
+        parts = [(table.tables[p], table.offsets[p]) for p in table.active]
+    else:
+        parts = [(table, 0)]
+    
+    for t, offset in parts:
+        for n0 in range(0, t.nrows, chunk):
+            n1 = min(n0+chunk, t.nrows)
+            if condition == None:
+                yield N.arange(n0, n1, dtype=N.int64) + offset
+            else:
+                yield t.get_where_list(condition, start=n0, stop=n1) + offset
+
+#===============================================================================
+class PartitionedTable():
+    """Observations of a time-partitioned pyDart file:  one table per time bin in the
+       /obs/partitions group, listed in the /obs/catalog table.  The rows are numbered
+       through the partitions in time order, and the object answers the table calls the
+       pyDART readers use (read, read_coordinates, get_where_list, append, ...), so it
+       can stand in for /obs/observations.  /obs/observations is kept as an empty table
+       that only carries the column descriptions.  window() returns a view that only
+       searches the partitions overlapping a time range.
+    """
+
+    def __init__(self, h5file):
+        
+        self.h5file   = h5file
+        self.template = h5file.root.obs.observations
+        self.catalog  = h5file.root.obs.catalog
+        self.bin      = int(self.catalog.attrs.bin_seconds)
+        
+        self.load()
+
+    def __getattr__(self, name):
+        
+        if name == "template":
+            raise AttributeError(name)
+        
+        return getattr(self.template, name)
+
+    def load(self):
+        
+        cat   = self.catalog.read()
+        order = N.argsort(cat['utime_start'], kind='mergesort')
+        
+        self.names   = [cat['name'][i] for i in order]
+        self.tables  = [getattr(self.h5file.root.obs.partitions, name) for name in self.names]
+        self.start   = cat['utime_start'][order]
+        self.end     = cat['utime_end'][order]
+        self.offsets = N.concatenate(([0], N.cumsum([t.nrows for t in self.tables]))).astype(N.int64)
+        self.active  = range(len(self.tables))
+        
+        return
+
+    @property
+    def nrows(self):
+        return int(self.offsets[-1])
+
+    def window(self, utime_start=None, utime_end=None):
+        """Returns a view of the table whose searches only visit the partitions that
+           overlap [utime_start, utime_end), row numbers are still those of the whole file
+        """
+        
+        view = PartitionedTable(self.h5file)
+        
+        view.active = [p for p in view.active if (utime_start == None or view.end[p]   > utime_start)
+                                             and (utime_end   == None or view.start[p] < utime_end)]
+        
+        return view
+
+    def read(self, start=None, stop=None, step=None, field=None):
+        
+        if start == None:  start = 0
+        if stop  == None:  stop  = self.nrows
+        
+        parts = []
+        for p, t in enumerate(self.tables):
+            lo = max(start, self.offsets[p])   - self.offsets[p]
+            hi = min(stop,  self.offsets[p+1]) - self.offsets[p]
+            if hi > lo:
+                parts.append(t.read(start=lo, stop=hi, field=field))
+        
+        if len(parts) == 0:
+            return self.template.read(field=field)
+        
+        data = N.concatenate(parts)
+        
+        if step != None:
+            data = data[::step]
+        
+        return data
+
+    def col(self, name):
+        return self.read(field=name)
+
+    def read_coordinates(self, coords, field=None):
+        
+        coords = N.asarray(coords, dtype=N.int64)
+        part   = N.searchsorted(self.offsets, coords, side='right') - 1
+        
+        if field == None:
+            data = N.empty(coords.size, dtype=self.template.dtype)
+        else:
+            coltype = self.template.coldtypes[field]                # keeps the shape of array columns (satellite)
+            data    = N.empty((coords.size,) + coltype.shape, dtype=coltype.base)
+        
+        for p in N.unique(part):
+            keep       = N.nonzero(part == p)[0]
+            data[keep] = self.tables[p].read_coordinates(coords[keep] - self.offsets[p], field=field)
+        
+        return data
+
+    def itersequence(self, sequence, chunk=10000):
+        
+        for n0 in range(0, len(sequence), chunk):
+            for row in self.read_coordinates(sequence[n0:n0+chunk]):
+                yield row
+
+    def iterrows(self, chunk=10000):
+        
+        for n0 in range(0, self.nrows, chunk):
+            for row in self.read(start=n0, stop=min(n0+chunk, self.nrows)):
+                yield row
+
+    def get_where_list(self, condition, condvars=None, sort=False):
+        
+        index = [self.tables[p].get_where_list(condition, condvars=condvars, sort=sort) + self.offsets[p] 
+                 for p in self.active]
+        
+        if len(index) == 0:
+            return N.zeros((0,), dtype=N.int64)
+        
+        return N.concatenate(index)
+
+    def append_where(self, dstTable, condition, condvars=None):
+        
+        n = 0
+        for p in self.active:
+            n = n + self.tables[p].append_where(dstTable, condition, condvars=condvars)
+        
+        return n
+
+    def append(self, rows):
+        """Appends rows to the partitions of their time bins, creating the new ones"""
+        
+        rows = N.asarray(rows)
+        bins = (rows['utime'] // self.bin) * self.bin
+        
+        for b in N.unique(bins):
+            name = "obs_%s" % py_datetime.utcfromtimestamp(b).strftime("%Y%m%d_%H%M%S")
+            if name not in self.h5file.root.obs.partitions:
+                self.h5file.create_table(self.h5file.root.obs.partitions, name, self.template.description, 
+                                         'Observations from %s' % utime2date(b), expectedrows=1000000)
+                entry = N.zeros(1, dtype=self.catalog.dtype)
+                entry['name']        = name
+                entry['utime_start'] = b
+                entry['utime_end']   = b + self.bin
+                self.catalog.append(entry)
+            getattr(self.h5file.root.obs.partitions, name).append(rows[bins == b])
+        
+        self.flush()
+        
+        return
+
+    def flush(self):
+        
+        for t in self.tables:
+            t.flush()
+        self.catalog.flush()
+        
+        self.load()
+
+# Keep the row counts in the catalog current
+        
+        names = list(self.catalog.col('name'))
+        for name, t in zip(self.names, self.tables):
+            self.catalog.cols.nrows[names.index(name)] = t.nrows
+        self.catalog.flush()
+        
+        return
+
+#===============================================================================
+class RowBuffer():
+    """Stands in for table.row when observations are parsed one at a time into a table
+       that has no row object (a PartitionedTable):  fields are set on a record of the
+       column defaults, append() keeps it and starts a new one, and the kept records are
+       appended to the table as a block every "chunk" rows and on flush()
+    """
+
+    def __init__(self, table, chunk=10000):
+        
+        self.table   = table
+        self.chunk   = chunk
+        self.default = default_rows(table, 1)
+        self.record  = self.default.copy()
+        self.rows    = []
+
+    def __getitem__(self, name):
+        return self.record[name][0]
+
+    def __setitem__(self, name, value):
+        self.record[name] = value
+
+    def append(self):
+        
+        self.rows.append(self.record)
+        self.record = self.default.copy()
+        
+        if len(self.rows) >= self.chunk:
+            self.flush()
+
+    def flush(self):
+        
+        if len(self.rows) > 0:
+            self.table.append(N.concatenate(self.rows))
+            self.rows = []
+
+#===============================================================================
+def create_utime_index(table):
+    """Creates the CSI index on utime (on every partition of a partitioned table)"""
+    
+    if isinstance(table, PartitionedTable):
+        tables = table.tables
+    else:
+        tables = [table]
+    
+    for t in tables:
+        if not t.cols.utime.is_indexed:
+            t.cols.utime.create_csindex()
+    
+    return
+
+#===============================================================================
+def partition_pyDart_file(filename, new_filename, bin_seconds=partition_seconds, chunk=1000000):
+    """Copies the observations of a pyDart file into a time-partitioned file with one
+       table per bin_seconds of observation time.  When new_filename already is a
+       partitioned file, the observations are added to it (new bins become new partitions).
+    """
+    
+    h5file, table = open_pyDart_file(filename)
+    
+    if h5file.title != version_string:
+        print("\n partition_pyDart_file:  %s is %s, use --migrate to convert it to %s first" % 
+              (filename, h5file.title, version_string))
+        h5file.close()
+        sys.exit(-1)
+    
+    if os.path.exists(new_filename):
+        
+        h5new, table_new = open_pyDart_file(new_filename, append=True)
+        
+        if not isinstance(table_new, PartitionedTable):
+            print("\n partition_pyDart_file:  %s exists and is not a partitioned file, exiting...." % new_filename)
+            h5new.close()
+            h5file.close()
+            sys.exit(-1)
+        
+        kinds = list(h5new.root.obs.kinds.col('index'))
+        for r in h5file.root.obs.kinds.read():
+            if r['index'] not in kinds:
+                h5new.root.obs.kinds.append([r])
+        h5new.root.obs.kinds.flush()
+    
+    else:
+        
+        filter_spec = Filters(complevel=5, complib="zlib", shuffle=1, fletcher32=0)
+        h5new = open_file(new_filename, mode = "w", title = version_string, filters=filter_spec)
+        
+        group_obs = h5new.create_group("/", 'obs', 'Obs for DART file')
+        h5new.create_table(group_obs, 'kinds', DART_ob_kinds, 'Observation Descriptions').append(h5file.root.obs.kinds.read())
+        
+        group_header = h5new.create_group("/", 'header', 'Header Information for DART file')
+        h5new.create_table(group_header, 'attributes', DART_header, 'Attributes of the observational file').append(
+                           h5file.root.header.attributes.read())
+        
+        h5new.create_table(group_obs, 'observations', DART_obs, 'Column descriptions of the partitioned observations')
+        h5new.create_group(group_obs, 'partitions', 'Observations, one table per time bin')
+        catalog = h5new.create_table(group_obs, 'catalog', DART_partition, 'Time bins of the observation partitions')
+        catalog.attrs.bin_seconds = bin_seconds
+        
+        h5new.flush()
+        table_new = PartitionedTable(h5new)
+    
+    for n0 in range(0, table.nrows, chunk):
+        table_new.append(table.read(start=n0, stop=min(n0+chunk, table.nrows)))
+    
+    create_utime_index(table_new)
+    
+    attr = h5new.root.header.attributes
+    attr.cols.num_obs[0]     = table_new.nrows
+    attr.cols.max_num_obs[0] = table_new.nrows
+    attr.cols.last[0]        = table_new.nrows
+    attr.flush()
+    
+    print("\n partition_pyDart_file:  %s now has %d observations in %d partitions of %d sec" % 
+          (new_filename, table_new.nrows, len(table_new.tables), table_new.bin))
+    
+    h5new.close()
+    h5file.close()
+    
+    return
+
+#===============================================================================
+def bulk_chunkshape(description, nrows):
+    """Returns a chunkshape for a table written in bulk:  chunks of about bulk_chunk_bytes,
+       but never more rows than the table will hold
+    """
+    
+    rowsize = Description(description.columns)._v_dtype.itemsize
+    
+    return ( max(1, min(max(nrows,1), bulk_chunk_bytes // rowsize)), )
+
+#===============================================================================
+def open_pyDart_file(filename, return_root=False, verbose = None, append=False):
+    
+    """Open_pyDart_file opens the pyTables pyDart file, checks a few things and
+       returns a the file handle and pyDart table object for use.
+    """
+
+# Open DART PyTables file
+    
+    if append:
+        h5file = open_file(filename, mode = "a")
+    else:
+        h5file = open_file(filename, mode = "r")
+    
+    chk_pyDart_version(h5file,verbose)
+    
+    root   = h5file.root
+
+# observations are a table in obs.observations, or in partitions listed in obs.catalog
+    
+    if 'catalog' in root.obs:
+        table = PartitionedTable(h5file)
+    else:
+        table = root.obs.observations
+    
+    if return_root:
+        return h5file, root, table
+    else:
+        return h5file, table
+
+
+#===================================================================================================
+def ObType_LookUp(name,DART_name=False,Print_Table=False):
+      """ObType_LookUp returns the DART kind number for an input variable type.  There seems
+         to be several ways observations names are written in the observation inputs
+         and output files, e.g., in the DART ascii files and in the ***.obs.nc files,
+         so this function is designed to handle the variety of cases and return the
+         integer corresponding to the DART definition.
+      
+         Exampled:   REFLECTIVITY is sometimes stored as REFL
+                     T_2M         is sometimes stored as TEMP2m
+                     TD_2M        is sometimes stored as DEWPT2m
+      
+         If you come across a variable that is not defined, you can add it to the lookup
+         table (dictionary) below - just make sure you know the official DART definition
+         
+         You can add any unique variable name or reference on the left column, and then use
+         the pyDART INTERNAL definition on the right - so that you can refer to more than
+         one type of data in different ways internally in this code
+      
+         Usage:  variable_kind = ObType_Lookup(variable_name)   where type(variable_name)=str
+      
+         If you need the return the actual DART_name as well, set the input flag to be True"""
+
+# Create local dictionary for observation kind definition - these can include user abbreviations
+
+#                      user's observation type            kind   DART official name
+
+      Look_Up_Table={ "DOPPLER_VELOCITY":                 [11,   "DOPPLER_RADIAL_VELOCITY"] ,
+                      "DOPPLER_RADIAL_VELOCITY":          [11,   "DOPPLER_RADIAL_VELOCITY"] ,
+                      "REFLECTIVITY":                     [12,   "RADAR_REFLECTIVITY"],
+                      "RADAR_REFLECTIVITY":               [12,   "RADAR_REFLECTIVITY"],
+                      "RADAR_CLEARAIR_REFLECTIVITY":      [13,   "RADAR_CLEARAIR_REFLECTIVITY"],  
+                      "CLEARAIR_REFLECTIVITY":            [13,   "RADAR_CLEARAIR_REFLECTIVITY"],
+                      "DIFFERENTIAL_REFLECTIVITY":        [300,  "DIFFERENTIAL_REFLECTIVITY"],
+                      "SPECIFIC_DIFFERENTIAL_PHASE":      [301,  "SPECIFIC_DIFFERENTIAL_PHASE"],
+                      "METAR_U_10_METER_WIND":            [1,    "METAR_U_10_METER_WIND"],
+                      "METAR_V_10_METER_WIND":            [2,    "METAR_V_10_METER_WIND"],
+                      "METAR_TEMPERATURE_2_METER":        [4,    "METAR_TEMPERATURE_2_METER"],
+                      "METAR_DEWPOINT_2_METER":           [9,    "METAR_DEWPOINT_2_METER"],
+                      "METAR_SPECIFIC_HUMIDITY_2_METER":  [5,    "METAR_SPECIFIC_HUMIDITY_2_METER"],
+                      "VR":                               [11,   "DOPPLER_RADIAL_VELOCITY"],
+                      "DBZ":                              [12,   "RADAR_REFLECTIVITY"],
+                      "0DBZ":                             [13,   "RADAR_CLEARAIR_REFLECTIVITY"],
+                      "ZDR":                              [300,  "DIFFERENTIAL_REFLECTIVITY"],
+                      "KDP":                              [301,  "SPECIFIC_DIFFERENTIAL_PHASE"],
+                      "U10M":                             [1,    "METAR_U_10_METER_WIND"],
+                      "V10M":                             [2,    "METAR_V_10_METER_WIND"],
+                      "T2M":                              [4,    "METAR_TEMPERATURE_2_METER"],
+                      "TD2M":                             [9,    "METAR_DEWPOINT_2_METER"],
+                      "H2M":                              [5,    "METAR_SPECIFIC_HUMIDITY_2_METER"],
+                      "U_10M":                            [1,    "METAR_U_10_METER_WIND"],
+                      "V_10M":                            [2,    "METAR_V_10_METER_WIND"],
+                      "T_2M":                             [4,    "METAR_TEMPERATURE_2_METER"],
+                      "TD_2M":                            [9,    "DEW_POINT_2_METER"],
+                      "H_2M":                             [5,    "METAR_SPECIFIC_HUMIDITY_2_METER"],
+                      "TEMP2M":                           [4,    "METAR_TEMPERATURE_2_METER"],
+                      "DEWPT2M":                          [9,    "DEW_POINT_2_METER"],
+                      "REFL":                             [12,   "RADAR_REFLECTIVITY"],
+                      "FLASH_RATE_2D":                    [2014, "FLASH_RATE_2D"],
+                      "METAR_ALTIMETER":                  [71,   "METAR_ALTIMETER"],
+                      "LAND_SFC_ALTIMETER":               [70,   "LAND_SFC_ALTIMETER"],
+                      "LAND_SFC_DEWPOINT":                [58,   "LAND_SFC_DEWPOINT"],
+                      "LAND_SFC_TEMPERATURE":             [25,   "LAND_SFC_TEMPERATURE"],
+                      "LAND_SFC_U_WIND_COMPONENT":        [23,   "LAND_SFC_U_WIND_COMPONENT"],
+                      "LAND_SFC_V_WIND_COMPONENT":        [24,   "LAND_SFC_V_WIND_COMPONENT"],
+                      "GOES_CWP_PATH":                    [80,   "GOES_CWP_PATH"],
+                      "GOES_LWP_PATH":                    [119,   "GOES_LWP_PATH"],
+                      "GOES_IWP_PATH":                    [120,   "GOES_IWP_PATH"],
+                      "GOES_CWP_ZERO":                    [121,   "GOES_IWP_ZERO"]
+                    }
+      
+      if Print_Table:
+            print
+            print "VALID INPUT VARIABLE NAME              KIND  DART NAME"
+            print "=========================================================================="
+            for key in Look_Up_Table.keys():
+                  print "%35s    %3d    %s" % (key, Look_Up_Table[key][0], Look_Up_Table[key][1])
+            return
+      
+      name2 = name.upper().strip()
+      if Look_Up_Table.has_key(name2):
+            if DART_name == True:
+                  return Look_Up_Table[name2][0], Look_Up_Table[name2][1]
+            else:
+                 return Look_Up_Table[name2][0]
+      else:
+            print "ObType_LookUp cannot find variable:  ", name, name2
+            raise SystemExit
+
+#===============================================================================
+def mergeTables(table_new, tables, addindex=True):
+
+    print "mergeTable called:  New table:  ",table_new
+
+    if len(tables) == 2 and tables[0] == "D":
+        tables = glob.glob("%s/*.h5" % tables[1])
+
+    print "mergeTable called:  Reading from:  ",tables, len(list(tables))
+
+    if len(tables) == 1 or type(tables) == type('str'):
+        print "Only one table for merging supplied, simply doing a copy..."
+        h5file1, table1 = open_pyDart_file(tables)
+        h5file1.copy_file(table_new, overwrite=True)
+        h5file1.close()
+        print "Finished copying %s into %s" % (tables, table_new)
+    else:
+        h5file1, table1 = open_pyDart_file(tables[0])
+        print "Creating new table to copy into...."
+        h5file1.copy_file(table_new, overwrite=True)
+        print("Finished copying %s into %s, has a length: %i" % (tables[0], table1, table1.nrows))
+
+        h5file1.close()   
+        h5file1, table1 = open_pyDart_file(table_new, append=True)
+
+        for file in tables[1:]: 
+            print "Now copying from table:  ", file
+            h5file2, table2 = open_pyDart_file(file)
+            
+            if h5file2.title != h5file1.title:
+                print "mergeTable:  %s is %s, but the new table is %s" % (file, h5file2.title, h5file1.title)
+                print "mergeTable:  use --migrate to convert the files to the same version, exiting...."
+                h5file2.close()
+                h5file1.close()
+                sys.exit(-1)
+            
+            offset = table1.nrows
+
+            rows = table2.read()
+            table1.append(rows)
+            table1.flush()
+
+# Ensemble copies point at rows of the observation table, so shift them by the rows already there
+
+            if 'ensemble' in h5file2.root.obs and isinstance(table1, PartitionedTable):
+                print "mergeTable:  ensemble copies of %s are not carried into a partitioned file" % file
+            elif 'ensemble' in h5file2.root.obs:
+                ens = h5file2.root.obs.ensemble.read()
+                ens['row'] = ens['row'] + offset
+                if 'ensemble' not in h5file1.root.obs:
+                    h5file1.create_table(h5file1.root.obs, 'ensemble', h5file2.root.obs.ensemble.description, 
+                                         'Ensemble copies of observations')
+                h5file1.root.obs.ensemble.append(ens)
+                h5file1.root.obs.ensemble.flush()
+
+            h5file2.close()
+            print("Finished copying %s into %s\n New table has a length: %i\n" % (tables[0], table1, table1.nrows))
+
+        print "Finished appending all table rows...."
+        print "New table:    ", table1
+
+# The spatial buckets copied from the first file only cover its rows
+
+        if 'buckets' in h5file1.root.obs:
+            h5file1.remove_node(h5file1.root.obs, 'buckets')
+            print "mergeTable:  removed the spatial bucket index, rebuild it with --addindex"
+        
+        create_utime_index(table1)
+        
+        group_header = h5file1.root.header
+        group_header.attributes.cols.last[0]        = table1.nrows
+        group_header.attributes.cols.max_num_obs[0] = table1.nrows
+        group_header.attributes.cols.num_obs[0]     = table1.nrows
+        
+        h5file1.close()
+
+        return
+
+#===============================================================================
+def sort_obs_and_ensemble(filename, chunk=100000):
+    """Sorts /obs/observations by utime (a stable sort, in blocks of "chunk" rows) and
+       renumbers the row pointers of the /obs/ensemble side table to the sorted rows
+    """
+
+    h5file = open_file(filename, mode = "a")
+    table  = h5file.root.obs.observations
+    
+    perm   = N.argsort(table.col('utime'), kind='mergesort')
+    
+    table_sorted = h5file.create_table(h5file.root.obs, 'observations_sorted', table.description, table.title, 
+                                       filters=table.filters, expectedrows=table.nrows)
+    for n0 in range(0, table.nrows, chunk):
+        table_sorted.append(table.read_coordinates(perm[n0:n0+chunk]))
+    table_sorted.flush()
+    
+    indexed = table.cols.utime.is_indexed
+    h5file.remove_node(h5file.root.obs, 'observations')
+    h5file.rename_node(table_sorted, 'observations')
+    if indexed:
+        table_sorted.cols.utime.create_csindex()
+
+# new row of each old row
+
+    new_row       = N.empty_like(perm)
+    new_row[perm] = N.arange(perm.size)
+    
+    ensemble      = h5file.root.obs.ensemble
+    ens           = ensemble.read()
+    ens['row']    = new_row[ens['row']]
+    ens           = ens[N.argsort(ens['row'], kind='mergesort')]
+    ensemble.modify_rows(0, ens.size, 1, ens)
+    ensemble.flush()
+    
+    h5file.close()
+    
+    return
+
+#===============================================================================
+#
+def sortTable(filename, overwrite=True):
+
+    h5file, table = open_pyDart_file(filename)
+    if isinstance(table, PartitionedTable):
+        print "\n sortTable:  %s is partitioned by time, it is not sorted" % filename
+        h5file.close()
+        return
+    ensemble = 'ensemble' in h5file.root.obs
+    buckets = 'buckets' in h5file.root.obs
+    h5file.close()
+
+    if overwrite:
+       cmd = ("cp %s %s_unsorted.h5" % (filename, filename[:-3]))
+       print("\n sortTable is running command:  %s" % cmd)
+       os.system(cmd)
+       
+    cmd = ("ptrepack -o --overwrite-nodes --keep-source-filters %s:/ sorted.h5:/" % filename)
+    print("\n sortTable is running command:  %s" % cmd)
+    os.system(cmd)
+    
+# The ensemble side table points at observation rows, so with one the sort is done here,
+# where the permutation is known and the row pointers can be renumbered
+
+    if ensemble:
+        print("\n sortTable is sorting the observations by utime and renumbering the ensemble rows")
+        sort_obs_and_ensemble("sorted.h5")
+    else:
+        cmd = ("ptrepack --sortby utime --overwrite-nodes --keep-source-filters %s:/obs/observations sorted.h5:/obs/observations" % \
+               filename)
+        print("\n sortTable is running command:  %s" % cmd)
+        os.system(cmd)
+
+# The spatial buckets refer to the unsorted row numbers
+    
+    if buckets:
+        h5file = open_file("sorted.h5", mode = "a")
+        h5file.remove_node(h5file.root.obs, 'buckets')
+        h5file.close()
+        print("\n sortTable removed the spatial bucket index, rebuild it with --addindex")
+    
+    if overwrite:
+         cmd = ("mv sorted.h5 %s" % filename)
+         print("\n sortTable is running command:  %s" % cmd)
+         os.system(cmd)
+                   
+    return
+
+#===============================================================================
+def migrate_pyDart_file(filename, new_filename, chunk=100000):
+    """Converts a version 3 pyDart file to the current version.  The observation
+       columns are copied in blocks of "chunk" rows, the date column is dropped
+       (it is computed from utime when needed), and the ensemble copies are moved
+       into the /obs/ensemble side table for the rows that actually have them.
+    """
+
+    h5file, table = open_pyDart_file(filename)
+    
+    if h5file.title == version_string:
+        print("\n migrate_pyDart_file:  %s is already %s, nothing to do" % (filename, version_string))
+        h5file.close()
+        return
+
+    filter_spec = Filters(complevel=5, complib="zlib", shuffle=1, fletcher32=0)
+    h5new = open_file(new_filename, mode = "w", title = version_string, filters=filter_spec)
+    
+    group_obs = h5new.create_group("/", 'obs', 'Obs for DART file')
+    table_ob_kinds = h5new.create_table(group_obs, 'kinds', DART_ob_kinds, 'Observation Descriptions')
+    table_ob_kinds.append(h5file.root.obs.kinds.read())
+    table_ob_kinds.flush()
+    
+    group_header = h5new.create_group("/", 'header', 'Header Information for DART file')
+    table_header = h5new.create_table(group_header, 'attributes', DART_header, 'Attributes of the observational file')
+    table_header.append(h5file.root.header.attributes.read())
+    table_header.flush()
+    
+    table_obs = h5new.create_table(group_obs, 'observations', DART_obs, 'Observations from DART file', 
+                                   expectedrows=table.nrows)
+    
+    nens     = table.coldescrs['Hxbm'].shape[0]
+    table_ens = None
+    
+    for n0 in range(0, table.nrows, chunk):
+        
+        old = table.read(start=n0, stop=min(n0+chunk, table.nrows))
+        new = N.zeros(old.shape[0], dtype=table_obs.dtype)
+        for name in table_obs.colnames:
+            new[name] = old[name]
+        table_obs.append(new)
+        
+        has_ens = N.any(old['Hxbm'] != _missing, axis=1) | N.any(old['Hxam'] != _missing, axis=1) \
+                | N.any(old['Yb_prime'] != _missing, axis=1)
+        
+        if N.any(has_ens):
+            if table_ens == None:
+                table_ens = h5new.create_table(group_obs, 'ensemble', ensemble_description(nens), 
+                                               'Ensemble copies of observations')
+            rows = N.nonzero(has_ens)[0]
+            ens  = N.zeros(rows.shape[0], dtype=table_ens.dtype)
+            ens['row']      = rows + n0
+            ens['Hxbm']     = old['Hxbm'][rows]
+            ens['Hxam']     = old['Hxam'][rows]
+            ens['Yb_prime'] = old['Yb_prime'][rows]
+            table_ens.append(ens)
+    
+    table_obs.flush()
+    if table_ens != None:  table_ens.flush()
+    
+    if table.cols.utime.is_indexed:
+        table_obs.cols.utime.create_csindex()
+    
+    print("\n migrate_pyDart_file:  wrote %d observations from %s to %s" % (table_obs.nrows, filename, new_filename))
+    if table_ens != None:
+        print(" migrate_pyDart_file:  %d observations have ensemble copies" % table_ens.nrows)
+    
+    h5new.close()
+    h5file.close()
+    
+    return
+
+#===============================================================================
+class pyDART():
+
+    def __init__(self, filename=None, verbose=True, debug=True):
+        self.hdf5    = None
+        self.ascii   = None
+        self.index   = None
+        self.verbose = verbose
+        self.debug   = debug
+
+# Cached file handle and metadata - see open/release/close below
+
+        self.h5file     = None
+        self.table      = None
+        self.version    = None
+        self.header     = None
+        self.kinds      = None
+        self.persistent = False
+        self.nopen      = 0
+        
+        if filename != None:
+            self.file(filename=filename)
+
+#-------------------------------------------------------------------------------
+# Context manager:  "with pyDART(filename) as pd:" keeps the file open across calls
+#-------------------------------------------------------------------------------
+
+    def __enter__(self):
+        
+        self.open()
+        self.persistent = True
+        self.nopen      = 0
+        
+        return self
+
+    def __exit__(self, type, value, traceback):
+        
+        self.persistent = False
+        self.close()
+        
+        return False
+
+#-------------------------------------------------------------------------------
+# Open:  returns the file handle and observation table, only opening the file (and
+#        checking the version, reading the header and kinds) when it is not already open
+#-------------------------------------------------------------------------------
+
+    def open(self, append=False):
+        
+        if self.h5file != None:
+            if self.h5file.isopen and self.h5file.filename == self.hdf5 and (self.h5file.mode == "a" or not append):
+                self.nopen += 1
+                return self.h5file, self.table
+
+# Reopening (e.g., read-only --> append) would close a handle an outer call or a live
+# iter_search generator is still using
+
+            if self.h5file.isopen and self.nopen > 0:
+                raise IOError("pyDART.open:  %s is open read-only by another call, cannot reopen it to append"
+                              % self.h5file.filename)
+            self.close()
+        
+        self.h5file, self.table = open_pyDart_file(self.hdf5, verbose=self.verbose, append=append)
+        
+        self.version = self.h5file.title
+        
+        attr = self.h5file.root.header.attributes
+        
+        self.header = {}
+        if attr.nrows > 0:
+            for name in attr.colnames:
+                self.header[name] = attr.col(name)[0]
+        
+        self.kinds = []
+        for r in self.h5file.root.obs.kinds.iterrows():
+            self.kinds.append( (r['index'], r['name']) )
+        
+        self.nopen = 1
+        
+        return self.h5file, self.table
+
+#-------------------------------------------------------------------------------
+# Release:  called when a method is done with the table, closes the file unless the
+#           object is being used as a context manager or an outer call still needs it
+#-------------------------------------------------------------------------------
+
+    def release(self):
+        
+        self.nopen = max(self.nopen - 1, 0)
+        
+        if not self.persistent and self.nopen == 0:
+            self.close()
+        
+        return
+
+    def close(self):
+        
+        if self.h5file != None and self.h5file.isopen:
+            self.h5file.close()
+        
+        self.h5file  = None
+        self.table   = None
+        self.version = None
+        self.header  = None
+        self.kinds   = None
+        self.nopen   = 0
+        
+        return
+
+#-------------------------------------------------------------------------------
+# File:  creates a standard set of filenames for pyDART ascii and hdf5 files
+#-------------------------------------------------------------------------------
+    
+    def file(self,filename=None):
+        
+        if filename != None:
+            
+            if filename[-4:] == ".out":
+                self.hdf5  = filename[:-4] + ".h5"
+                self.ascii = filename
+                return
+            
+            if filename[-3:] == ".h5":
+                self.hdf5  = filename
+                self.ascii = filename[:-3] + ".out"
                 return
             
             if filename[-5:] == ".hdf5":
@@ -625,10 +1786,12 @@ class pyDART():
         
         return
 #-------------------------------------------------------------------------------
-# Search:
+# Search_conditions:  builds the list of in-kernel conditions for a search, and the
+#                     utime range (either may be None) they select
 #-------------------------------------------------------------------------------
-    
-    def search(self, variable=None, start=None, end=None, condition=None, loc=None, selfdata=False, tablereturn=None):
+
+    def search_conditions(self, variable=None, start=None, end=None, condition=None, loc=None,
+                          lat_box=None, lon_box=None):
 
 # Construct a variable to search table
 
@@ -651,7 +1814,9 @@ class pyDART():
 
 # Build a list of search conditions
 
-        cond = []
+        cond        = []
+        utime_start = None
+        utime_end   = None
         
         if variable != None:
             cond.append( "( kind == " + str(ObType_LookUp(variable)) + " )" )
@@ -670,71 +1835,408 @@ class pyDART():
         if loc != None:
             for item in loc:
                 cond.append(item)
+        
+        if lat_box != None:
+            lat_box = sorted(lat_box)
+            cond.append( "(" + str(lat_box[0]) + " <= lat)" )
+            cond.append( "(lat <= " + str(lat_box[1]) + ")" )
+        
+        if lon_box != None:
+            lon_box = sorted(lon_box)
+            cond.append( "(" + str(lon_box[0]) + " <= lon)" )
+            cond.append( "(lon <= " + str(lon_box[1]) + ")" )
+        
+        return cond, utime_start, utime_end
 
-# Open DART PyTables file
+#-------------------------------------------------------------------------------
+# Search:
+#-------------------------------------------------------------------------------
+    
+    def search(self, variable=None, start=None, end=None, condition=None, loc=None, selfdata=False, tablereturn=None,
+               lat_box=None, lon_box=None):
+
+        cond, utime_start, utime_end = self.search_conditions(variable, start, end, condition, loc, lat_box, lon_box)
+
+# Open DART PyTables file, for a partitioned file only search the partitions in the time range
+        
+        h5file, table = self.open()
+        try:
         
-        h5file, table = open_pyDart_file(self.hdf5, verbose=self.verbose)
+            if isinstance(table, PartitionedTable):
+                table = table.window(utime_start, utime_end)
+                if self.verbose:
+                    print "PyDART SEARCH PLAN:  %d of %d partitions overlap the time range" % (len(table.active), len(table.tables))
 
 # Determine when you want observations from
         
-        if self.verbose:
-            print "PyDART SEARCH START TIME  %s  /  UTIME_START: %s" % (self.start, utime_start)
-            print "PyDART SEARCH END   TIME  %s  /  UTIME_END:   %s" % (self.end, utime_end)
-            print "PyDART converted utimes: ", sec_utime.num2date(utime_start)
+            if self.verbose:
+                print "PyDART SEARCH START TIME  %s  /  UTIME_START: %s" % (self.start, utime_start)
+                print "PyDART SEARCH END   TIME  %s  /  UTIME_END:   %s" % (self.end, utime_end)
+                print "PyDART converted utimes: ", sec_utime.num2date(utime_start)
 
 # Create string for search
         
-        if len(cond) != 0:
+            if len(cond) != 0:
             
-            search_string = cond[0]
-            for x in cond[1:]:
-                search_string = search_string + " & " + x
+                search_string = cond[0]
+                for x in cond[1:]:
+                    search_string = search_string + " & " + x
             
-            if self.verbose:
-                print
-                print "PyDART SEARCH CONDITION IS:  ", search_string
-                print
+                if self.verbose:
+                    print
+                    print "PyDART SEARCH CONDITION IS:  ", search_string
+                    print
+            
+                rows = self.bucket_search(h5file, table, lat_box, lon_box)
             
-            self.index = table.get_where_list(search_string)    # Do the search
+                if rows is None:
+                    self.index = table.get_where_list(search_string)    # Do the search
+                else:
+                    self.index = where_rows(table, rows, search_string) # Exact filter of the bucket candidates
 
-            if len(self.index) == 0:  self.index = []
+                if len(self.index) == 0:  self.index = []
             
-            if tablereturn != None:
+                if tablereturn != None:
 
-                # make a blank table to put results of search in
-                filter_spec = Filters(complevel=5, complib="zlib", shuffle=1, fletcher32=0)
-                h5file_sub = open_file(tablereturn, mode = "w", title = version_string, filters=filter_spec)
-                group_ob_kinds = h5file_sub.create_group("/", 'obs', 'Obs for DART file')
+                    # make a blank table, of the same version as the searched file, to put results of search in
+                    filter_spec = Filters(complevel=5, complib="zlib", shuffle=1, fletcher32=0)
+                    h5file_sub = open_file(tablereturn, mode = "w", title = h5file.title, filters=filter_spec)
+                    group_ob_kinds = h5file_sub.create_group("/", 'obs', 'Obs for DART file')
         
-                table_ob_kinds = h5file_sub.create_table(group_ob_kinds, 'kinds', DART_ob_kinds, 'Observation Descriptions')
-                group_header = h5file_sub.create_group("/", 'header', 'Header Information for DART file')
-                table_header = h5file_sub.create_table(group_header, 'attributes', DART_header, 'Attributes of the observational file')
+                    table_ob_kinds = h5file_sub.create_table(group_ob_kinds, 'kinds', DART_ob_kinds, 'Observation Descriptions')
+                    table_ob_kinds.append(h5file.root.obs.kinds.read())
+                    group_header = h5file_sub.create_group("/", 'header', 'Header Information for DART file')
+                    table_header = h5file_sub.create_table(group_header, 'attributes', DART_header, 'Attributes of the observational file')
+                
+                    header = h5file.root.header.attributes.read()
+                    for name in ['num_obs', 'max_num_obs', 'last']:
+                        header[name] = len(self.index)
+                    table_header.append(header)
         
-                root         = h5file_sub.root
-                group_obs    = root.obs
-                group_header = root.header
+                    root         = h5file_sub.root
+                    group_obs    = root.obs
+                    group_header = root.header
         
-                table_obs = h5file_sub.create_table(group_obs, 'observations', DART_obs, 'Observations from DART file')
+                    table_obs = h5file_sub.create_table(group_obs, 'observations', obs_description(h5file.title), 'Observations from DART file')
                 
-                # do search and put results in table
-                table.append_where(table_obs, search_string)
+                    # do search and put results in table
+                    if rows is None:
+                        table.append_where(table_obs, search_string)
+                    elif len(self.index) > 0:
+                        table_obs.append(table.read_coordinates(self.index))
                 
-                table_obs.flush()
+                    table_obs.flush()
+
+                    # carry along any ensemble copies, renumbered to the rows of the new table
+                    if 'ensemble' in h5file.root.obs:
+                        ens  = h5file.root.obs.ensemble.read()
+                        ens  = ens[N.in1d(ens['row'], self.index)]
+                        ens['row'] = N.searchsorted(self.index, ens['row'])
+                        h5file_sub.create_table(group_obs, 'ensemble', h5file.root.obs.ensemble.description, 
+                                                'Ensemble copies of observations').append(ens)
                 
-                
-                h5file_sub.close()
+                    h5file_sub.close()
+        
+            else:
+                if self.verbose:
+                    print "pyDART.SEARCH:  NO SEARCH CONDITION CREATED....", cond
+        
+        finally:
+            self.release()
+        
+        return
+
+#-------------------------------------------------------------------------------
+# Iter_search:  generator form of search - yields the matching rows as structured
+#               arrays of about chunk rows holding only the requested columns
+#-------------------------------------------------------------------------------
+
+    def iter_search(self, variable=None, start=None, end=None, condition=None, loc=None,
+                    lat_box=None, lon_box=None, columns=None, chunk=100000):
+        """The table is scanned a slab of chunk rows at a time, and self.index is not set,
+           so any size of search runs in constant memory.  columns defaults to all the
+           table columns, and may include "row" for the row numbers in the file (to join
+           the /obs/ensemble copies).  The file stays open until the generator finishes.
         
+           for block in pyDART.iter_search(variable="RADIAL_VELOCITY", columns=["utime", "value"]):
+               ....
+        """
+        
+        cond, utime_start, utime_end = self.search_conditions(variable, start, end, condition, loc, lat_box, lon_box)
+        
+        if len(cond) != 0:
+            search_string = " & ".join(cond)
         else:
+            search_string = None
+        
+        if self.verbose:
+            print
+            print "PyDART ITER_SEARCH CONDITION IS:  ", search_string
+            print
+        
+        h5file, table = self.open()
+        
+        try:
+            if isinstance(table, PartitionedTable):
+                table = table.window(utime_start, utime_end)
+            
+            if columns == None:
+                columns = table.colnames
+            
+            dtype = []
+            for name in columns:
+                if name == "row":
+                    dtype.append((name, N.int64))
+                else:
+                    dtype.append((name, table.dtype[name]))
+            dtype = N.dtype(dtype)
+            
+            rows = self.bucket_search(h5file, table, lat_box, lon_box)
+            
+            blocks = []
+            nblock = 0
+            
+            for coords in iter_where(table, search_string, coords=rows, chunk=chunk):
+                
+                if len(coords) == 0:
+                    continue
+                
+                data  = read_rows(table, coords)
+                block = N.empty(len(coords), dtype=dtype)
+                
+                for name in dtype.names:
+                    if name == "row":
+                        block[name] = coords
+                    else:
+                        block[name] = data[name]
+                
+                blocks.append(block)
+                nblock = nblock + len(block)
+                
+                if nblock >= chunk:
+                    yield N.concatenate(blocks)
+                    blocks = []
+                    nblock = 0
+            
+            if nblock > 0:
+                yield N.concatenate(blocks)
+        
+        finally:
+            self.release()
+
+#-------------------------------------------------------------------------------
+# Bucket_search:  returns the candidate rows for a lat/lon box from the /obs/buckets
+#                 side table, or None when a full table scan should be done instead
+#-------------------------------------------------------------------------------
+
+    def bucket_search(self, h5file, table, lat_box=None, lon_box=None):
+        
+        if (lat_box == None and lon_box == None) or 'buckets' not in h5file.root.obs:
+            return None
+        
+        buckets = h5file.root.obs.buckets
+        
+        if lat_box != None:  lat_box = sorted(lat_box)
+        if lon_box != None:  lon_box = sorted(lon_box)
+        
+        if buckets.attrs.nrows != table.nrows:
+            print "pyDART.search:  spatial bucket index is out of date, rebuild it with --addindex"
+            return None
+        
+        ranges = bucket_ranges(lat_box, lon_box, resolution=buckets.attrs.resolution)
+        
+        coords = []
+        for lo, hi in ranges:
+            coords.append(buckets.get_where_list("(lo <= bucket) & (bucket <= hi)", condvars={'lo':lo, 'hi':hi}))
+        coords = N.concatenate(coords)
+        
+        if self.verbose:
+            print "PyDART SEARCH PLAN:  %d bucket ranges select %d of %d rows" % (len(ranges), coords.size, table.nrows)
+        
+        if coords.size > bucket_max_frac * table.nrows:
+            return None
+        
+        if coords.size == 0:
+            return N.zeros((0,), dtype=N.int64)
+        
+        return N.sort(buckets.read_coordinates(coords, field='row'))
+
+#-------------------------------------------------------------------------------
+# Addindex:  creates the CSI index on utime, and the /obs/buckets side table holding the
+#            spatial bucket of every row (with a CSI index) for lat/lon box searches
+#-------------------------------------------------------------------------------
+
+    def addindex(self, resolution=bucket_resolution, chunk=1000000):
+        
+        h5file, table = self.open(append=True)
+        try:
+        
+            create_utime_index(table)
+        
+            if isinstance(table, PartitionedTable):
+                print "pyDART.addindex:  %s is partitioned by time, only the utime indices are created" % self.hdf5
+                return
+        
+            if 'buckets' in h5file.root.obs:
+                h5file.remove_node(h5file.root.obs, 'buckets')
+        
+            buckets = h5file.create_table(h5file.root.obs, 'buckets', DART_bucket, 'Spatial bucket of each observation', 
+                                          expectedrows=max(table.nrows,1))
+        
+            for n0 in range(0, table.nrows, chunk):
+                n1   = min(n0+chunk, table.nrows)
+                rows = N.zeros(n1-n0, dtype=buckets.dtype)
+                rows['bucket'] = bucket_code(table.read(start=n0, stop=n1, field='lat'), 
+                                             table.read(start=n0, stop=n1, field='lon'), resolution)
+                rows['row']    = N.arange(n0, n1)
+                buckets.append(rows)
+        
+            buckets.flush()
+            buckets.attrs.resolution = resolution
+            buckets.attrs.nrows      = table.nrows
+            buckets.cols.bucket.create_csindex()
+        
             if self.verbose:
-                print "pyDART.SEARCH:  NO SEARCH CONDITION CREATED....", cond
+                print "pyDART.addindex:  created spatial bucket index (%g deg tiles) for %d rows" % (resolution, table.nrows)
         
-        h5file.close()
+        finally:
+            self.release()
         
         return
 
 #-------------------------------------------------------------------------------
-# A quick routine to grid pyDART data
-    
+# Superob:  thins a (merged, multi-radar) table by binning the observations on a common
+#           map projection in x, y (dx), height (dz) and time (dt).  Observations of the
+#           same kind in a bin are combined into one:  the value is the reducer
+#           (mean, median, max, min) of the bin, and every other column comes from the
+#           observation nearest the bin centroid.  Radial velocities are only combined
+#           with those of the same radar.  The thinned table is written to filename.
+#-------------------------------------------------------------------------------
+
+    def superob(self, dx, dz, dt=superob_dt, reducer=superob_reducer, filename=None):
+        
+        if reducer not in ['mean', 'median', 'max', 'min']:
+            print "pyDART.superob:  reducer must be mean, median, max or min, not %s" % reducer
+            return
+        
+        if filename == None:
+            filename = self.hdf5[:-3] + "_superob.h5"
+        
+        h5file, table = self.open()
+        try:
+        
+            columns = ['lat', 'lon', 'height', 'utime', 'kind', 'value', 'platform_lat', 'platform_lon']
+            data    = dict( (name, table.read(field=name)) for name in columns )
+        
+            nobs = data['value'].size
+        
+            if nobs == 0:
+                print "pyDART.superob:  %s has no observations" % self.hdf5
+                return
+
+# Project every observation onto one map, centered on the data
+        
+            lat0 = 0.5*(data['lat'].min() + data['lat'].max())
+            lon0 = 0.5*(data['lon'].min() + data['lon'].max())
+        
+            x, y = dll_2_dxy(lat0, data['lat'], lon0, data['lon'], degrees=True)
+
+# Radial velocity is only combined for the same radar
+        
+            platform = N.zeros(nobs, dtype=N.int64)
+            vr       = data['kind'] == ObType_LookUp("VR")
+            if N.any(vr):
+                radars = N.zeros(N.count_nonzero(vr), dtype=[('lat', N.float64), ('lon', N.float64)])
+                radars['lat'] = data['platform_lat'][vr]
+                radars['lon'] = data['platform_lon'][vr]
+                platform[vr]  = N.unique(radars, return_inverse=True)[1] + 1
+
+# Bin number of every observation
+        
+            keys = N.zeros(nobs, dtype=[('kind', N.int64), ('platform', N.int64), ('t', N.int64), 
+                                        ('z', N.int64), ('y', N.int64), ('x', N.int64)])
+            keys['kind']     = data['kind']
+            keys['platform'] = platform
+            keys['t']        = N.floor(data['utime'] / float(dt))
+            keys['z']        = N.floor(data['height'] / dz)
+            keys['y']        = N.floor(y / dx)
+            keys['x']        = N.floor(x / dx)
+        
+            bins, inv = N.unique(keys, return_inverse=True)
+            nbins     = bins.size
+            count     = N.bincount(inv, minlength=nbins)
+
+# Reduce the values of each bin
+        
+            value = data['value']
+        
+            if reducer == 'mean':
+                superob = N.bincount(inv, weights=value, minlength=nbins) / count
+            else:
+                order = N.lexsort((value, inv))
+                first = N.concatenate(([0], N.cumsum(count)[:-1]))
+                if reducer == 'min':
+                    superob = value[order[first]]
+                elif reducer == 'max':
+                    superob = value[order[first + count - 1]]
+                else:
+                    superob = 0.5*(value[order[first + (count-1)//2]] + value[order[first + count//2]])
+
+# Representative observation of each bin:  the one nearest the centroid
+        
+            xc = N.bincount(inv, weights=x, minlength=nbins) / count
+            yc = N.bincount(inv, weights=y, minlength=nbins) / count
+            zc = N.bincount(inv, weights=data['height'], minlength=nbins) / count
+        
+            dist = (x - xc[inv])**2 + (y - yc[inv])**2 + (data['height'] - zc[inv])**2
+        
+            order   = N.lexsort((dist, inv))
+            nearest = order[N.concatenate(([0], N.cumsum(count)[:-1]))]
+        
+            keep    = N.argsort(nearest)
+            rows    = table.read_coordinates(nearest[keep])
+        
+            rows['value'] = superob[keep]
+        
+            number = N.arange(nbins)
+            rows['number']   = number + 1
+            rows['previous'] = number - 1
+            rows['next']     = number + 1
+            rows['index']    = number
+        
+# Write the thinned table
+        
+            filter_spec = Filters(complevel=5, complib="zlib", shuffle=1, fletcher32=0)
+            h5new = open_file(filename, mode = "w", title = h5file.title, filters=filter_spec)
+        
+            group_obs = h5new.create_group("/", 'obs', 'Obs for DART file')
+            h5new.create_table(group_obs, 'kinds', DART_ob_kinds, 'Observation Descriptions').append(h5file.root.obs.kinds.read())
+        
+            group_header = h5new.create_group("/", 'header', 'Header Information for DART file')
+            header = h5file.root.header.attributes.read()
+            for name in ['num_obs', 'max_num_obs', 'last']:
+                header[name] = nbins
+            h5new.create_table(group_header, 'attributes', DART_header, 'Attributes of the observational file').append(header)
+        
+            table_obs = h5new.create_table(group_obs, 'observations', obs_description(h5file.title), 'Observations from DART file',
+                                           expectedrows=max(nbins,1))
+            table_obs.append(rows)
+            table_obs.flush()
+            table_obs.cols.utime.create_csindex()
+        
+            h5new.close()
+        
+        finally:
+            self.release()
+        
+        print "pyDART.superob:  %d observations combined into %d superobs (%s), written to %s" % (nobs, nbins, reducer, filename)
+        if self.verbose:
+            for k in N.unique(bins['kind']):
+                print "pyDART.superob:    kind %3d:  %8d obs -> %8d superobs" % (k, N.count_nonzero(data['kind'] == k), 
+                                                                                  N.count_nonzero(bins['kind'] == k))
+        
+        return nbins
+
 #-------------------------------------------------------------------------------
 # A quick routine to grid pyDART data
     
@@ -787,7 +2289,7 @@ class pyDART():
 # Later, we might add an error check here to make sure the data are all the same kind
         
         data = self.get_data()
-        time = data['date'][0]
+        time = utime2date(data['utime'][0])
 
 # Need to remove all locations that are identical - do that by creating a complex number to
 #      comprised of (x + j * y) which can then be sorted for multiple identical entries.
@@ -910,7 +2412,7 @@ class pyDART():
 # Later, we might add an error check here to make sure the data are all the same kind
         
         data = self.get_data()
-        time = data['date'][0]
+        time = utime2date(data['utime'][0])
 
 # Need to remove all locations that are identical - do that by creating a complex number to
 #      comprised of (x + j * y) which can then be sorted for multiple identical entries.
@@ -1000,176 +2502,423 @@ class pyDART():
 
 # Open DART PyTables file
         
-        h5file, table = open_pyDart_file(self.hdf5, verbose=self.verbose)
+        h5file, table = self.open()
+        try:
+        
+            if len(self.index) > 0 and all == True:
+                self.index = N.arange(table.nrows)
+                if self.verbose: print "pyDART.get_data, return all rows of table!"
         
-        if len(self.index) > 0 and all == True:
-            self.index = N.arange(table.nrows)
-            if self.verbose: print "pyDART.get_data, return all rows of table!"
+            if self.debug:  start = time.clock()
         
-        if self.debug:  start = time.clock()
+            data = table.read_coordinates(self.index)
+
+            if self.debug:  print "pyDart.get_data  Execution time for read_coordinates method:  ", time.clock() - start
+         
+        finally:
+            self.release()
+        
+        return data
+
+#-------------------------------------------------------------------------------
+# Get_ensemble:  returns the /obs/ensemble rows for the search indices (version 4 files),
+#                or None when the file has no ensemble copies
+#-------------------------------------------------------------------------------
+    
+    def get_ensemble(self):
+        
+        h5file, table = self.open()
+        try:
+        
+            if 'ensemble' not in h5file.root.obs:
+                if self.verbose: print "pyDART.get_ensemble:  %s has no ensemble side table" % self.hdf5
+                return None
+        
+            ensemble = h5file.root.obs.ensemble
+            rows     = ensemble.col('row')
+        
+            if self.index is not None and len(self.index) > 0:
+                keep = N.in1d(rows, self.index)
+                data = ensemble.read_coordinates(N.nonzero(keep)[0])
+            else:
+                data = ensemble.read()
+        
+        finally:
+            self.release()
+        
+        return data
+
+#-------------------------------------------------------------------------------
+    
+    def list(self,variable=None,dumplength=None,chunk=100000):
+        
+        if variable == None:
+            if self.verbose: print "pyDART.list:  No variable supplied, listing all variables in ", self.hdf5,"/obs/observations"
+            variable = "all"
+
+# Open DART PyTables file
+        
+        h5file, table = self.open()
+        try:
         
-        data = table.read_coordinates(self.index)
+            if type(variable) == type("str"):       # Determine the user's request data type
+                if variable == "all":               # Retrieve all the columns from the row
+                    for name in table.colnames:
+                        print name
+                    return
+                else:                                     # User requests specific variables, search for DART variable index
+                    var_index = ObType_LookUp(variable)
+            
+                if var_index == _missing:
+                    print "pyDart.list:  requested variable:  ",variable," does not exist"
+                    print "pyDart.list:  Valid variables are:  ", ObType_LookUp(variable,Print_Table=True)
+                    return
+            
+                if type(variable) == type(1):
+                    var_index = variable
+
+# Only the columns that are printed are read, a block at a time
+            
+                columns = ['number', 'value', 'utime', 'lat', 'lon', 'x', 'y', 'z', 'azimuth', 'elevation', 'satellite']
+            
+                def dump(data):
+                    time = utime2date(data['utime'])
+                    x    = N.where(data['x'] != _missing, data['x']/1000., _missing)
+                    y    = N.where(data['y'] != _missing, data['y']/1000., _missing)
+                    z    = N.where(data['z'] != _missing, data['z']/1000., _missing)
+                    az   = N.where(data['azimuth']   != _missing, data['azimuth'],   _missing)
+                    el   = N.where(data['elevation'] != _missing, data['elevation'], _missing)
+                    sat0 = N.where(data['satellite'][:,0] != _missing, data['z']/1000., _missing)
+                    sat1 = N.where(data['satellite'][:,1] != _missing, data['z']/1000., _missing)
+                    sat2 = N.where(data['satellite'][:,2] != _missing, data['z']/1000., _missing)
+                    for n in range(len(time)):
+                        print("%7d     %s     %9.5f    %s  %9.4f  %9.4f  %9.4f  %9.4f  %9.5f  %5.1f  %5.1f  %5.1f  %5.1f  %5.1f" \
+                          % (data['number'][n], variable.upper(), data['value'][n], time[n], data['lat'][n], data['lon'][n], 
+                             x[n], y[n], z[n], az[n], el[n], sat0[n], sat1[n], sat2[n]))
 
-        if self.debug:  print "pyDart.get_data  Execution time for read_coordinates method:  ", time.clock() - start
-         
-        h5file.close()
+# First pass only reads the kind column, to count the observations and find the rows to print
+            
+                nobs  = 0
+                first = N.zeros((0,), dtype=N.int64)
+                last  = N.zeros((0,), dtype=N.int64)
+            
+                for block in iter_columns(table, self.index, [], chunk=chunk, kind=var_index):
+                    nobs  = nobs + block['row'].size
+                    if first.size < 100:
+                        first = N.concatenate((first, block['row']))[:100]
+                    last  = N.concatenate((last, block['row']))[-100:]
+            
+                if nobs != 0:
+                    if self.verbose: print "Number of observations:  ", nobs
+
+                    if dumplength == True:
+                        dumplength = nobs
+                        print
+                        if self.verbose:
+                            print("Printing ALL the values, hope it does not take too long because the list has %d entries" % 
+                                   dumplength)
+                        print("%s %s %s" % ("\n", "="*100, "\n"))
+                        print "    Index       Variable      Value    Date/Time       Lat    Lon    X(km)  Y(km)  Z(km)      AZ        EL"
+                    
+                        for block in iter_columns(table, self.index, columns, chunk=chunk, kind=var_index):
+                            dump(block)
+                    else:
+                        dumplength = min(100,nobs)
+                        print
+                        if self.verbose:
+                            print("Printing the first and last 100 values of search indices")
+                        print("%s %s %s" % ("\n", "="*100, "\n"))
+                        print("    Index     Variable        Value          Date/Time           Lat        Lon        X(km)      Y(km)      Z(km)     AZ      EL")
+                    
+                        dump(read_columns(table, first[:dumplength-1], columns))
+                        dump(read_columns(table, last[-dumplength:],   columns))
+                else:
+                    print "NO OBSERVATIONS FOUND FOR ", variable.upper()
         
-        return data
-
+        finally:
+            self.release()
+        
+        return
 #-------------------------------------------------------------------------------
     
-    def list(self,variable=None,dumplength=None):
+    def stats(self,variable=None,dumplength=None,chunk=100000):
         
         if variable == None:
-            if self.verbose: print "pyDART.list:  No variable supplied, listing all variables in ", self.hdf5,"/obs/observations"
-            variable = "all"
+            if self.verbose: print "\n pyDART.stats:  No variable supplied, not valid, exiting \n"
 
 # Open DART PyTables file
         
-        h5file, table = open_pyDart_file(self.hdf5, verbose=self.verbose)
+        h5file, table = self.open()
+        try:
         
-        if type(variable) == type("str"):       # Determine the user's request data type
-            if variable == "all":               # Retrieve all the columns from the row
-                for name in table.colnames:
-                    print name
-                h5file.close()
-                return
-            else:                                     # User requests specific variables, search for DART variable index
-                var_index = ObType_LookUp(variable)
+                                        # User requests specific variables, search for DART variable index
+            var_index = ObType_LookUp(variable)
             
             if var_index == _missing:
                 print "pyDart.list:  requested variable:  ",variable," does not exist"
                 print "pyDart.list:  Valid variables are:  ", ObType_LookUp(variable,Print_Table=True)
-                h5file.close()
                 return
+
+# Stream the needed columns in blocks:  extremes and a single pass mean/variance, and the
+# distinct x and y positions (bounded by the grid, not the number of rows), whose spacing
+# is taken once at the end.  The distinct values of the blocks are collected and only
+# merged when they add up to a chunk, so the running set is not re-sorted every block.
+        
+            columns = ['value', 'lat', 'lon', 'x', 'y', 'z', 'azimuth', 'elevation']
+        
+            def extremes(mxmn, values):
+                if values.size == 0:
+                    return mxmn
+                if mxmn == None:
+                    return [values.max(), values.min()]
+                return [max(mxmn[0], values.max()), min(mxmn[1], values.min())]
+        
+            def distinct(values, pending):
+                pending.append(N.unique(values))
+                if sum([v.size for v in pending]) > chunk:
+                    pending[:] = [N.unique(N.concatenate(pending))]
+        
+            nobs, mean, m2 = 0, 0.0, 0.0
+            mxmn = dict( (name, None) for name in columns )
+            xs   = []
+            ys   = []
+        
+            for data in iter_columns(table, self.index, columns, chunk=chunk, kind=var_index):
             
-            if type(variable) == type(1):
-                var_index = variable
+                nobs, mean, m2 = merge_moments(nobs, mean, m2, data['value'])
             
-            if len(self.index) > 0:
-                table.get_where_list("kind == var_index")
-            
-            if len(self.index) != 0:
-                if self.verbose: print "Number of observations:  ",len(self.index)
-                data   = self.get_data()
-                number = data['number']
-                value  = data['value']
-                time   = data['date']
-                utime  = data['utime']
-
-                lat    = data['lat']
-                lon    = data['lon']
-                x      = N.where(data['x'] != _missing, data['x']/1000., _missing)
-                y      = N.where(data['y'] != _missing, data['y']/1000., _missing)
-                z      = N.where(data['z'] != _missing, data['z']/1000., _missing)
-                az     = N.where(data['azimuth']   != _missing, data['azimuth'],   _missing)
-                el     = N.where(data['elevation'] != _missing, data['elevation'], _missing)
-                sat0   = N.where(data['satellite'][:,0] != _missing, data['z']/1000., _missing)
-                sat1   = N.where(data['satellite'][:,1] != _missing, data['z']/1000., _missing)
-                sat2   = N.where(data['satellite'][:,2] != _missing, data['z']/1000., _missing)
-
-                if dumplength == True:
-                    dumplength = len(self.index)
-                    print
-                    if self.verbose:
-                        print("Printing ALL the values, hope it does not take too long because the list has %d entries" % 
-                               dumplength)
-                    print("%s %s %s" % ("\n", "="*100, "\n"))
-                    print "    Index       Variable      Value    Date/Time       Lat    Lon    X(km)  Y(km)  Z(km)      AZ        EL"
-                    
-                    for n in range(0,dumplength-1):
-                        print("%7d     %s     %9.5f    %s  %9.4f  %9.4f  %9.4f  %9.4f  %9.5f  %5.1f  %5.1f  %5.1f  %5.1f  %5.1f" \
-                          % (number[n], variable.upper(), value[n], time[n], lat[n], lon[n], x[n], y[n], z[n], az[n], el[n], sat0[n], sat1[n], sat2[n]))
-                else:
-                    dumplength = min(100,len(self.index))
-                    print
-                    if self.verbose:
-                        print("Printing the first and last 100 values of search indices")
-                    print("%s %s %s" % ("\n", "="*100, "\n"))
-                    print("    Index     Variable        Value          Date/Time           Lat        Lon        X(km)      Y(km)      Z(km)     AZ      EL")
-                    
-                    for n in range(0,dumplength-1):
-                        print("%7d     %s     %9.5f    %s  %9.4f  %9.4f  %9.4f  %9.4f  %9.5f  %5.1f  %5.1f  %5.1f  %5.1f  %5.1f" \
-                          % (number[n], variable.upper(), value[n], time[n], lat[n], lon[n], x[n], y[n], z[n], az[n], el[n], sat0[n], sat1[n], sat2[n]))
-                    
-                    for n in range(len(time)-dumplength,len(time)):
-                        print("%7d     %s     %9.5f    %s  %9.4f  %9.4f  %9.4f  %9.4f  %9.5f  %5.1f  %5.1f  %5.1f  %5.1f  %5.1f" \
-                          % (number[n], variable.upper(), value[n], time[n], lat[n], lon[n], x[n], y[n], z[n], az[n], el[n], sat0[n], sat1[n], sat2[n]))
+                data['x']         = data['x'][data['x'] != 9999.]
+                data['y']         = data['y'][data['y'] != 9999.]
+                data['z']         = data['z'][(data['z'] != _missing) & (data['z'] != 9999.)]
+                data['azimuth']   = data['azimuth'][data['azimuth'] != _missing]
+                data['elevation'] = data['elevation'][data['elevation'] != _missing]
+            
+                for name in columns:
+                    mxmn[name] = extremes(mxmn[name], data[name])
+            
+                distinct(data['x'], xs)
+                distinct(data['y'], ys)
+        
+            if nobs != 0:
+                if self.verbose: print "Number of observations:  ", nobs
+            
+                for name in columns:
+                    if mxmn[name] == None:  mxmn[name] = [_missing, _missing]
+            
+                dx = N.diff(N.unique(N.concatenate(xs)))
+                dy = N.diff(N.unique(N.concatenate(ys)))
+                if dx.size == 0:  dx = N.array([_missing])
+                if dy.size == 0:  dy = N.array([_missing])
+            
+                print
+                print "%s            Max/Min:   %10.4f   %10.4f  " % (variable, mxmn['value'][0], mxmn['value'][1])
+                print "%s         Mean/stdev:   %10.4f   %10.4f  " % (variable, mean, N.sqrt(m2 / nobs))
+                print "%s  Max/Min    X (m):    %10.1f   %10.1f  " % (variable, mxmn['x'][1], mxmn['x'][0])
+                print "%s  Max/Min   DX (m):    %10.1f   %10.1f  STD: %10.4f " % (variable, dx.max(), dx.min(), dx.std())
+                print "%s  Max/Min    Y (m):    %10.1f   %10.1f  " % (variable, mxmn['y'][1], mxmn['y'][0])
+                print "%s  Max/Min   DY (m):    %10.1f   %10.1f  STD: %10.4f " % (variable, dy.max(), dy.min(), dy.std())
+                print "%s  Max/Min    Z (m):    %10.1f   %10.1f" % (variable, mxmn['z'][0], mxmn['z'][1])
+                print "%s  Max/Min   Azimuth:   %10.4f   %10.4f" % (variable, mxmn['azimuth'][0], mxmn['azimuth'][1])
+                print "%s  Max/Min Elevation:   %10.4f   %10.4f" % (variable, mxmn['elevation'][0], mxmn['elevation'][1])
+                print "%s  Max/Min  Latitude:   %10.4f   %10.4f" % (variable, mxmn['lat'][0], mxmn['lat'][1])
+                print "%s  Max/Min Longitude:   %10.4f   %10.4f" % (variable, mxmn['lon'][0], mxmn['lon'][1])
+                print
+
             else:
                 print "NO OBSERVATIONS FOUND FOR ", variable.upper()
         
-        h5file.close()
+        finally:
+            self.release()
         
         return
+
 #-------------------------------------------------------------------------------
-    
-    def stats(self,variable=None,dumplength=None):
+# Innov_stats:  O-B and O-A statistics (bias, rms, ensemble spread, obs error, consistency
+#               ratio and counts) of the searched observations (or all of them) grouped by
+#               kind, utime bin, height band and band of range from the platform.  The
+#               grouped sums are accumulated with bincount in one chunked pass, and the
+#               summary is written to the /innov/stats table of filename.  Only the
+#               observations whose DART QC is in qc are used (all of them when qc is None).
+#-------------------------------------------------------------------------------
+
+    def innov_stats(self, variable=None, bin_seconds=innov_seconds, dz=innov_dz, dr=innov_dr, filename=None, 
+                    qc=innov_qc, chunk=100000):
         
-        if variable == None:
-            if self.verbose: print "\n pyDART.stats:  No variable supplied, not valid, exiting \n"
+        if filename == None:
+            filename = self.hdf5[:-3] + "_innov.h5"
+        
+        if variable != None:
+            var_index = ObType_LookUp(variable)
+            if var_index == _missing:
+                print "pyDart.innov_stats:  requested variable:  ",variable," does not exist"
+                return
+        else:
+            var_index = None
+        
+        h5file, table = self.open()
+        try:
+        
+            columns = ['kind', 'utime', 'height', 'x', 'y', 'value', 'qc', 'error_var', 'Hxb_bar', 'Hxa_bar', 'sdHxb', 'sdHxa']
+        
+            if self.index is None:
+                blocks = (read_columns(table, coords, columns) for coords in iter_where(table, chunk=chunk))
+            else:
+                blocks = iter_columns(table, self.index, columns, chunk=chunk, kind=var_index)
 
-# Open DART PyTables file
+# Group keys are (kind, time bin, height band, range band), missing heights and ranges get their own band
+        
+            key_dtype = [('kind', N.int64), ('time', N.int64), ('height', N.int64), ('range', N.int64)]
+            sum_names = ['count_b', 'count_a', 'omb', 'omb2', 'oma', 'oma2', 'sprd_b2', 'sprd_a2', 'error_var', 
+                         'count_sprd_b', 'count_sprd_a', 'count_error']
+        
+            def reduce_groups(keys, sums):
+                keys, inverse = N.unique(keys, return_inverse=True)
+                return keys, N.column_stack([N.bincount(inverse, weights=sums[:,n], minlength=keys.size) 
+                                             for n in range(sums.shape[1])])
+        
+            def valid(values):
+                return (values != _missing) & (values != innov_missing)
         
-        h5file, table = open_pyDart_file(self.hdf5, verbose=self.verbose)
+            all_keys = []
+            all_sums = []
+            nsums    = 0
         
-                                    # User requests specific variables, search for DART variable index
-        var_index = ObType_LookUp(variable)
+            for data in blocks:
             
-        if var_index == _missing:
-            print "pyDart.list:  requested variable:  ",variable," does not exist"
-            print "pyDart.list:  Valid variables are:  ", ObType_LookUp(variable,Print_Table=True)
-            h5file.close()
-            return
+                if var_index != None and self.index is None:
+                    keep = data['kind'] == var_index
+                    data = dict( (name, data[name][keep]) for name in data.keys() )
             
-        if len(self.index) > 0:
-            table.get_where_list("kind == var_index")
-        
-        if len(self.index) != 0:
-            if self.verbose: print "Number of observations:  ", len(self.index)
-            data   = self.get_data()
-            number = data['number']
-            value  = data['value']
-            time   = data['date']
-            utime  = data['utime']
-            lat    = data['lat']
-            lon    = data['lon']
-            x      = N.ma.masked_equal(data['x'], 9999.)
-            x      = N.ma.masked_equal(data['x'], 9999.)
-            y      = N.ma.masked_equal(data['y'], 9999.)
-            z      = N.ma.masked_equal(data['z'], _missing)
-            z      = N.ma.masked_equal(data['z'], 9999.)
-            az     = N.ma.masked_equal(data['azimuth'], _missing)
-            el     = N.ma.masked_equal(data['elevation'], _missing)
-
-            x      = N.sort(N.unique(x))
-            dx     = N.diff(x)
-            
-            y      = N.sort(N.unique(y))
-            dy     = N.diff(y)
-            
-            z      = N.sort(z)
-            dz     = N.diff(z)
+                ok_b = valid(data['value']) & valid(data['Hxb_bar'])
+                ok_a = valid(data['value']) & valid(data['Hxa_bar'])
             
-            print
-            print "%s            Max/Min:   %10.4f   %10.4f  " % (variable, value.max(), value.min())
-            print "%s         Mean/stdev:   %10.4f   %10.4f  " % (variable, value.mean(), value.std())
-            print "%s  Max/Min    X (m):    %10.1f   %10.1f  " % (variable,x.min(), x.max())
-            print "%s  Max/Min   DX (m):    %10.1f   %10.1f  STD: %10.4f " % (variable,dx.max(), dx.min(), dx.std())
-            print "%s  Max/Min    Y (m):    %10.1f   %10.1f  " % (variable,y.min(), y.max())
-            print "%s  Max/Min   DY (m):    %10.1f   %10.1f  STD: %10.4f " % (variable,dy.max(), dy.min(), dy.std())
-            print "%s  Max/Min    Z (m):    %10.1f   %10.1f" % (variable, z.max(), z.min())
-            print "%s  Max/Min   Azimuth:   %10.4f   %10.4f" % (variable, az.max(), az.min())
-            print "%s  Max/Min Elevation:   %10.4f   %10.4f" % (variable, el.max(), el.min())
-            print "%s  Max/Min  Latitude:   %10.4f   %10.4f" % (variable, lat.max(), lat.min())
-            print "%s  Max/Min Longitude:   %10.4f   %10.4f" % (variable, lon.max(), lon.min())
-            print
+                if qc != None:
+                    ok_qc = N.in1d(data['qc'], qc)
+                    ok_b  = ok_b & ok_qc
+                    ok_a  = ok_a & ok_qc
+            
+                use  = ok_b | ok_a
+            
+                if not N.any(use):
+                    continue
+            
+                data = dict( (name, data[name][use]) for name in data.keys() )
+                ok_b = ok_b[use]
+                ok_a = ok_a[use]
+            
+                keys = N.empty(ok_b.size, dtype=key_dtype)
+                keys['kind'] = data['kind']
+                keys['time'] = data['utime'] // bin_seconds
+                keys['height'] = N.where(data['height'] != _missing, N.floor(data['height'] / dz), long(_missing))
+            
+                has_range = (data['x'] != _missing) & (data['y'] != _missing) & (data['x'] != 9999.) & (data['y'] != 9999.)
+                distance  = N.sqrt(data['x'].astype(N.float64)**2 + data['y'].astype(N.float64)**2)
+                keys['range'] = N.where(has_range, N.floor(distance / dr), long(_missing))
+            
+                omb = N.where(ok_b, data['value'] - data['Hxb_bar'], 0.0)
+                oma = N.where(ok_a, data['value'] - data['Hxa_bar'], 0.0)
+            
+                ok_sb  = ok_b & valid(data['sdHxb'])
+                ok_sa  = ok_a & valid(data['sdHxa'])
+                ok_err = ok_b & valid(data['error_var'])
+            
+                sums = N.column_stack((ok_b, ok_a, omb, omb**2, oma, oma**2, 
+                                       N.where(ok_sb,  data['sdHxb'].astype(N.float64)**2, 0.0), 
+                                       N.where(ok_sa,  data['sdHxa'].astype(N.float64)**2, 0.0), 
+                                       N.where(ok_err, data['error_var'], 0.0), 
+                                       ok_sb, ok_sa, ok_err)).astype(N.float64)
+            
+                keys, sums = reduce_groups(keys, sums)
+            
+                all_keys.append(keys)
+                all_sums.append(sums)
+                nsums = nsums + keys.size
 
-        else:
-            print "NO OBSERVATIONS FOUND FOR ", variable.upper()
+# Keep the partial sums small by merging them once they add up to a chunk
+            
+                if nsums > chunk:
+                    keys, sums = reduce_groups(N.concatenate(all_keys), N.concatenate(all_sums))
+                    all_keys, all_sums, nsums = [keys], [sums], keys.size
         
-        h5file.close()
+        finally:
+            self.release()
         
-        return
+        if len(all_keys) == 0:
+            print "pyDART.innov_stats:  no observations with prior or posterior ensemble means found"
+            return None
+        
+        keys, sums = reduce_groups(N.concatenate(all_keys), N.concatenate(all_sums))
+        sums = dict( (name, sums[:,n]) for n, name in enumerate(sum_names) )
+
+# Statistics of each group, written to a new file
+        
+        filter_spec = Filters(complevel=5, complib="zlib", shuffle=1, fletcher32=0)
+        h5stats     = open_file(filename, mode = "w", title = "pyDART innovation statistics", filters=filter_spec)
+        group       = h5stats.create_group("/", 'innov', 'Innovation statistics of ' + self.hdf5)
+        table_stats = h5stats.create_table(group, 'stats', DART_innov_stats, 'O-B and O-A statistics', 
+                                           expectedrows=keys.size)
+        
+        def ratio(top, bottom):
+            return N.where(bottom > 0, top / N.maximum(bottom, 1.0e-30), _missing)
+        
+        def root_ratio(top, bottom):
+            return N.where(bottom > 0, N.sqrt(top / N.maximum(bottom, 1.0e-30)), _missing)
+
+# The spreads and obs errors are averaged over the observations that have them, which can be
+# fewer than the O-B count, and the consistency ratio is built from those means
+
+        def consistency(s):
+            ok = (s['count_sprd_b'] > 0) & (s['count_error'] > 0) & (s['omb2'] > 0)
+            return N.where(ok, (s['sprd_b2'] / N.maximum(s['count_sprd_b'], 1.0) 
+                                + s['error_var'] / N.maximum(s['count_error'], 1.0))
+                               / N.maximum(s['omb2'] / N.maximum(s['count_b'], 1.0), 1.0e-30), _missing)
+        
+        nb = sums['count_b']
+        na = sums['count_a']
+        
+        stats = N.zeros(keys.size, dtype=table_stats.dtype)
+        
+        stats['kind']        = keys['kind']
+        stats['utime_start'] = keys['time'] * bin_seconds
+        stats['height_bot']  = N.where(keys['height'] != long(_missing), keys['height'] * dz, _missing)
+        stats['range_bot']   = N.where(keys['range']  != long(_missing), keys['range']  * dr, _missing)
+        stats['count_b']     = nb
+        stats['count_a']     = na
+        stats['bias_b']      = ratio(sums['omb'], nb)
+        stats['rms_b']       = root_ratio(sums['omb2'], nb)
+        stats['spread_b']    = root_ratio(sums['sprd_b2'], sums['count_sprd_b'])
+        stats['bias_a']      = ratio(sums['oma'], na)
+        stats['rms_a']       = root_ratio(sums['oma2'], na)
+        stats['spread_a']    = root_ratio(sums['sprd_a2'], sums['count_sprd_a'])
+        stats['obs_error']   = root_ratio(sums['error_var'], sums['count_error'])
+        stats['cr']          = consistency(sums)
+        
+        table_stats.append(stats)
+        table_stats.flush()
+        
+        table_stats.attrs.bin_seconds = bin_seconds
+        table_stats.attrs.dz          = dz
+        table_stats.attrs.dr          = dr
+        
+        h5stats.close()
+
+# Summary of each kind over all the groups
+        
+        if self.verbose:
+            print
+            print "pyDART.innov_stats:  %d groups written to %s" % (keys.size, filename)
+            print
+            print "    KIND        N(O-B)     BIAS(O-B)   RMS(O-B)   SPREAD(B)      N(O-A)     BIAS(O-A)   RMS(O-A)        CR"
+            for kind in N.unique(keys['kind']):
+                k = keys['kind'] == kind
+                t = dict( (name, sums[name][k].sum()) for name in sum_names )
+                print "  %6d  %12d  %10.4f  %10.4f  %10.4f  %12d  %10.4f  %10.4f  %10.4f" % \
+                      (kind, t['count_b'], ratio(t['omb'], t['count_b']), root_ratio(t['omb2'], t['count_b']), 
+                       root_ratio(t['sprd_b2'], t['count_sprd_b']), t['count_a'], ratio(t['oma'], t['count_a']), 
+                       root_ratio(t['oma2'], t['count_a']), consistency(t))
+            print
+        
+        return stats
 
 #-------------------------------------------------------------------------------
     
@@ -1181,7 +2930,9 @@ class pyDART():
         if radar_loc != None:
             print "PyDart.ascii2hdf:  radar location supplied:  lat: %f  lon: %f hgt:  %f" % (radar_loc[0],radar_loc[1], radar_loc[2])
 
-# Create PyTables file
+# Create PyTables file (drop any cached handle, since the file is about to be rewritten)
+        
+        self.close()
         
         filter_spec = Filters(complevel=5, complib="zlib", shuffle=1, fletcher32=0)
         
@@ -1194,6 +2945,84 @@ class pyDART():
         table_ob_kinds = h5file.create_table(group_ob_kinds, 'kinds', DART_ob_kinds, 'Observation Descriptions')
         
         fi = open(self.ascii, 'r')
+        
+        obs_kinds, obtype_dict, header, data_storage = self.read_obs_seq_header(fi)
+        
+        final = is_obs_seq_final(data_storage, header['num_copies'])
+        
+        row = table_ob_kinds.row
+        
+        for index, name in obs_kinds:
+            row['index'] = index
+            row['name']  = name
+            row.append()
+
+# Create group for misc file header information
+        
+        group_header = h5file.create_group("/", 'header', 'Header Information for DART file')
+        table_header = h5file.create_table(group_header, 'attributes', DART_header, 'Attributes of the observational file')
+        
+        row = table_header.row
+        
+        row['origin_file'] = "Original DART observation file is: " + self.ascii + "\n"
+        row['num_copies']  = header['num_copies']
+        row['num_qc']      = header['num_qc']
+
+# An obs_seq.final is stored with only the observation (and truth) copies and one qc copy
+        
+        if final:
+            row['num_copies'], row['num_qc'], nens = stored_copies(data_storage, header['num_copies'], header['num_qc'])
+        row['num_obs']     = header['num_obs']
+        row['max_num_obs'] = header['max_num_obs']
+        row['first']       = header['first']
+        row['last']        = header['last']
+        
+        row.append()
+        table_header.flush()
+
+# Find the obs group to create table in
+        
+        root         = h5file.root
+        group_obs    = root.obs
+        group_header = root.header
+
+# create table that will hold the observation information
+        
+        table_obs = h5file.create_table(group_obs, 'observations', DART_obs, 'Observations from DART file')
+
+# Read in the obs sequentially!  (an obs_seq.final in blocks)
+        
+        if final:
+            n = self.read_obs_seq_final(fi, table_obs, header['num_copies'], header['num_qc'], data_storage, obtype_dict, 
+                                        radar_loc=radar_loc)
+        else:
+            n = self.read_obs_seq_body(fi, table_obs.row, header['num_copies'], header['num_qc'], data_storage, obtype_dict, 
+                                       radar_loc=radar_loc)
+        
+        table_obs.flush()
+        
+        if n != group_header.attributes.cols.num_obs[0]:
+            group_header.attributes.cols.last[0] = n
+            group_header.attributes.cols.max_num_obs[0]= n
+            group_header.attributes.cols.num_obs[0] = n
+            print("Changed number of obs to: %3.3i \n" % (n))
+                        
+        h5file.close()
+        
+        fi.close()
+        
+        print "pyDART.ascii2h5:  Converted ascii DART file to HDF5 DART file"
+        
+        return 1
+
+#-------------------------------------------------------------------------------
+# Read_obs_seq_header:  reads the header of an open DART ascii file and returns the kind
+#                       definitions [(index, name),...], a dictionary of the kind names,
+#                       the header counts, and the description of each data copy
+#-------------------------------------------------------------------------------
+
+    def read_obs_seq_header(self, fi):
+        
         fi.readline()                       # Read(str) "obs_sequence"
         fi.readline()                       # Read(str) "obs_kind_definitions"
         ob_kinds = long(fi.readline())      # Read(int) "number of observation types" 
@@ -1202,25 +3031,18 @@ class pyDART():
         
         n = 0
         
-        row = table_ob_kinds.row
+        obs_kinds   = []
         obtype_dict = {}
         
         while n < ob_kinds:
             stuff = fi.readline()
             stuff = stuff.split()
-            row['index'] = int(stuff[0])
-            row['name']  = stuff[1]
-            print 'Observation kind definitions:  ', row['index'], row['name']
+            print 'Observation kind definitions:  ', int(stuff[0]), stuff[1]
+            obs_kinds.append( (int(stuff[0]), stuff[1]) )
             obtype_dict[int(stuff[0])] = stuff[1]
-            row.append()
             n += 1
         
         if self.debug:  print 'Completed reading obs_kind_definitions'
-
-# Create group for misc file header information
-        
-        group_header = h5file.create_group("/", 'header', 'Header Information for DART file')
-        table_header = h5file.create_table(group_header, 'attributes', DART_header, 'Attributes of the observational file')
         
         stuff      = fi.readline()          # Read(str) "num_copies" line
         stuff      = stuff.split()
@@ -1259,38 +3081,111 @@ class pyDART():
         first       = long(stuff[1])
         last        = long(stuff[3])
         
-        row = table_header.row
-        
-        row['origin_file'] = "Original DART observation file is: " + self.ascii + "\n"
-        row['num_copies']  = num_copies
-        row['num_qc']      = num_qc
-        row['num_obs']     = num_obs
-        row['max_num_obs'] = max_num_obs
-        row['first']       = first
-        row['last']        = last
-        
-        row.append()
-        table_header.flush()
+        header = { 'num_copies':   num_copies,
+                   'num_qc':       num_qc,
+                   'num_obs':      num_obs,
+                   'max_num_obs':  max_num_obs,
+                   'first':        first,
+                   'last':         last }
         
         if self.verbose and self.debug:
             print "Number of observation copies:  ", num_copies
             print "Number of QC'd observations:   ", num_qc
             print "Number of observations:        ", num_obs
             print "Max number of observations:    ", max_num_obs
+        
+        return obs_kinds, obtype_dict, header, data_storage
 
-# Find the obs group to create table in
+#-------------------------------------------------------------------------------
+# Read_obs_seq_final:  reads the observations of an open DART obs_seq.final file (after the
+#                      header) into table, parsing about chunk observations at a time.  The
+#                      ensemble means and spreads go to Hxb_bar/Hxa_bar/sdHxb/sdHxa, the
+#                      departure from the prior mean to dep, and the members (and prior
+#                      perturbations) to the /obs/ensemble side table.  Returns the number
+#                      stored.  index0 is the table row number of the first observation
+#-------------------------------------------------------------------------------
+
+    def read_obs_seq_final(self, fi, table, num_copies, num_qc, data_storage, obtype_dict, radar_loc=None, 
+                           index0=0, chunk=100000):
         
-        root         = h5file.root
-        group_obs    = root.obs
-        group_header = root.header
+        copies = obs_seq_copies(data_storage, num_copies)
+        nens   = max([member+1 for column, member in copies if member != None] + [0])
+        
+        print "pyDART.read_obs_seq_final:  reading %d copies, %d ensemble members" % (num_copies, nens)
 
-# create table that will hold the observation information
+# Ensemble members go to the /obs/ensemble side table (rows of a partitioned file are renumbered, so not there)
         
-        table_obs = h5file.create_table(group_obs, 'observations', DART_obs, 'Observations from DART file')
+        ensemble = None
+        
+        if nens > 0 and isinstance(table, PartitionedTable):
+            print "pyDART.read_obs_seq_final:  the ensemble members are not stored in a partitioned file"
+        elif nens > 0:
+            h5file = table._v_file
+            if 'ensemble' not in h5file.root.obs:
+                ensemble = h5file.create_table(h5file.root.obs, 'ensemble', ensemble_description(nens), 
+                                               'Ensemble copies of observations')
+            elif h5file.root.obs.ensemble.coldescrs['Hxbm'].shape[0] == nens:
+                ensemble = h5file.root.obs.ensemble
+            else:
+                print "pyDART.read_obs_seq_final:  the ensemble table has a different number of members, not stored"
+        
+        if ensemble != None:
+            ens_dtype = ensemble.dtype
+        else:
+            ens_dtype = None
+
+# Read blocks of lines, and parse the complete records in each
+        
+        hint = chunk * (num_copies + num_qc + 12) * 25
         
-        row = table_obs.row
+        n       = 0
+        pending = []
+        
+        while True:
+            
+            block = fi.readlines(hint)
+            pending.extend(block)
+            
+            if len(block) == 0:
+                stop = len(pending)
+            else:
+                starts = [i for i, line in enumerate(pending) if line.lstrip().startswith("OBS")]
+                if len(starts) < 2:
+                    continue
+                stop = starts[-1]
+            
+            rows, ens = parse_obs_seq_records(pending[:stop], table, copies, obtype_dict, 
+                                              radar_loc=radar_loc, ens_dtype=ens_dtype)
+            pending = pending[stop:]
+            
+            if rows.size > 0:
+                
+                rows['index'] = index0 + n + N.arange(rows.size)
+                table.append(rows)
+                
+                if ens is not None:
+                    ens['row'] = rows['index']
+                    ensemble.append(ens)
+                
+                n = n + rows.size
+                
+                print "read_obs_seq_final:  Processed observation # ", n, rows['days'][-1] + rows['seconds'][-1]/86400.
+            
+            if len(block) == 0:
+                break
+        
+        if ensemble != None:
+            ensemble.flush()
+        
+        return n
+
+#-------------------------------------------------------------------------------
+# Read_obs_seq_body:  reads the observations of an open DART ascii file (after the header)
+#                     through row, a table.row or a RowBuffer, and returns the number stored.
+#                     index0 is the table row number of the first observation
+#-------------------------------------------------------------------------------
 
-# Read in the obs sequentially!
+    def read_obs_seq_body(self, fi, row, num_copies, num_qc, data_storage, obtype_dict, radar_loc=None, index0=0):
         
         n = 0
         
@@ -1448,10 +3343,9 @@ class pyDART():
             date = day_utime.num2date(days)
             
             row['utime']     = round(sec_utime.date2num(date)) #  to prevent sometimes truncating down to next integer
-            row['date']      = date.strftime(time_format)
             
             row['error_var'] = read_double_precision_string(fi.readline())
-            row['index']     = n
+            row['index']     = index0 + n
             
             if n % 5000 == 0:
                 print "read_DART_ob:  Processed observation # ", n+1, days #,sec_utime.date2num(date) #,py_datetime(start[0],start[1],start[2],start[3],start[4],start[5])
@@ -1463,25 +3357,131 @@ class pyDART():
             else:
                 n += 1
                 row.append()
+
+        return n
+
+#-------------------------------------------------------------------------------
+# Append_ascii:  adds the observations of DART ascii files to the end of the existing
+#                pyDart file (or to the time partitions of a partitioned file), so only
+#                the new data is processed.  The header counts are updated, and so are
+#                the utime index (PyTables updates it as rows are appended) and the
+#                spatial bucket index when there is one.
+#-------------------------------------------------------------------------------
+
+    def append_ascii(self, ascii_files, radar_loc=None):
+        
+        if type(ascii_files) == type("str"):
+            ascii_files = [ascii_files]
+        
+        h5file, table = self.open(append=True)
+        try:
+        
+            nrows0 = table.nrows
+            kinds  = [k[0] for k in self.kinds]
+
+# Check the copies of every file before appending any, so the table never mixes rows of
+# different layouts (missing truth or ensemble copies would be stored as _missing)
+        
+            if 'ensemble' in h5file.root.obs:
+                nens0 = h5file.root.obs.ensemble.coldescrs['Hxbm'].shape[0]
+            else:
+                nens0 = 0
+        
+            for ascii in ascii_files:
             
-            table_obs.flush
+                fi = open(ascii, 'r')
+                try:
+                    obs_kinds, obtype_dict, header, data_storage = self.read_obs_seq_header(fi)
+                finally:
+                    fi.close()
             
-        if n != group_header.attributes.cols.num_obs[0]:
-            group_header.attributes.cols.last[0] = n
-            group_header.attributes.cols.max_num_obs[0]= n
-            group_header.attributes.cols.num_obs[0] = n
-            print("Changed number of obs to: %3.3i \n" % (n))
-                        
-        h5file.close()
+                num_copies, num_qc, nens = stored_copies(data_storage, header['num_copies'], header['num_qc'])
+            
+                if isinstance(table, PartitionedTable):            # members are not stored in a partitioned file
+                    nens = nens0
+            
+                if num_copies != self.header['num_copies'] or nens != nens0:
+                    raise ValueError("PyDart.append_ascii:  %s stores %d copies and %d ensemble members, the pyDart file has %d and %d"
+                                     % (ascii, num_copies, nens, self.header['num_copies'], nens0))
         
-        fi.close()
+            for ascii in ascii_files:
+            
+                print "\n PyDart.append_ascii:  appending ASCII DART file:  ", ascii
+            
+                fi = open(ascii, 'r')
+            
+                obs_kinds, obtype_dict, header, data_storage = self.read_obs_seq_header(fi)
+            
+                for index, name in obs_kinds:
+                    if index not in kinds:
+                        h5file.root.obs.kinds.append([(index, name)])
+                        kinds.append(index)
+                        self.kinds.append( (index, name) )
+                h5file.root.obs.kinds.flush()
+            
+                if is_obs_seq_final(data_storage, header['num_copies']):
+                    n = self.read_obs_seq_final(fi, table, header['num_copies'], header['num_qc'], data_storage, obtype_dict, 
+                                                radar_loc=radar_loc, index0=table.nrows)
+                else:
+                    if isinstance(table, PartitionedTable):
+                        row = RowBuffer(table)
+                    else:
+                        row = table.row
+                
+                    n = self.read_obs_seq_body(fi, row, header['num_copies'], header['num_qc'], data_storage, obtype_dict, 
+                                               radar_loc=radar_loc, index0=table.nrows)
+                
+                    if isinstance(row, RowBuffer):
+                        row.flush()
+                table.flush()
+            
+                fi.close()
+            
+                print "PyDart.append_ascii:  appended %d observations, the table now has %d" % (n, table.nrows)
+
+# Update the header counts
         
-        print "pyDART.ascii2h5:  Converted ascii DART file to HDF5 DART file"
+            attr = h5file.root.header.attributes
+            attr.cols.num_obs[0]     = table.nrows
+            attr.cols.max_num_obs[0] = table.nrows
+            attr.cols.last[0]        = table.nrows
+            attr.flush()
         
-        return 1
+            for name in ['num_obs', 'max_num_obs', 'last']:
+                self.header[name] = table.nrows
+        
+            create_utime_index(table)
+
+# Add the new rows to the spatial bucket index, if it was current before the append
+        
+            if 'buckets' in h5file.root.obs and table.nrows > nrows0:
+                buckets = h5file.root.obs.buckets
+                if buckets.attrs.nrows == nrows0:
+                    rows = N.zeros(table.nrows-nrows0, dtype=buckets.dtype)
+                    rows['bucket'] = bucket_code(table.read(start=nrows0, stop=table.nrows, field='lat'), 
+                                                 table.read(start=nrows0, stop=table.nrows, field='lon'), 
+                                                 buckets.attrs.resolution)
+                    rows['row']    = N.arange(nrows0, table.nrows)
+                    buckets.append(rows)
+                    buckets.flush()
+                    buckets.attrs.nrows = table.nrows
+        
+            nadded = table.nrows - nrows0
+        
+        finally:
+            self.release()
+        
+        return nadded
+
 #-------------------------------------------------------------------------------
     
-    def dict2hdf(self,obs_dict,filename=None,radar_loc=None):
+    def dict2hdf(self,obs_dict,filename=None,radar_loc=None,chunk=1000000):
+        """Writes observations held in memory to a new pyDart file.  obs_dict is a dictionary
+           of columnar arrays (value, lat, lon, height, kind, sec, day, error_var, plus the
+           platform_* arrays for radial velocity, and optionally azimuth, elevation and the
+           number of obs in "counter"), or a Gridded_Field-like object with those attributes.
+           The rows are built as structured arrays and appended "chunk" rows at a time.
+        """
         
         if filename != None:
             self.file(filename=filename)
@@ -1495,7 +3495,19 @@ class pyDART():
         print "pyDART_version_2:  Version 2 now stores lat and lon correctly - please make sure your analysis does as well..."
         print
 
-# Create PyTables file
+# Accept a Gridded_Field-like object as well as a dictionary
+        
+        if not isinstance(obs_dict, dict):
+            obs_dict = vars(obs_dict)
+        
+        if 'counter' in obs_dict.keys():
+            nobs = int(obs_dict['counter'])
+        else:
+            nobs = len(obs_dict['value'])
+
+# Create PyTables file (drop any cached handle, since the file is about to be rewritten)
+        
+        self.close()
         
         filter_spec = Filters(complevel=5, complib="zlib", shuffle=1, fletcher32=0)
         
@@ -1528,10 +3540,10 @@ class pyDART():
         row['origin_file'] = "Original DART observation file is: " + self.ascii + "\n"
         row['num_copies']  = 1
         row['num_qc']      = 1
-        row['num_obs']     = obs_dict['counter']
-        row['max_num_obs'] = obs_dict['counter']
+        row['num_obs']     = nobs
+        row['max_num_obs'] = nobs
         row['first']       = 1
-        row['last']        = obs_dict['counter']
+        row['last']        = nobs
         
         row.append()
         table_header.flush()
@@ -1539,8 +3551,8 @@ class pyDART():
         if self.debug:
                 print "Number of observation copies:  ", 1
                 print "Number of QC'd observations:   ", 1
-                print "Number of observations:        ", obs_dict['counter']
-                print "Max number of observations:    ", obs_dict['counter']
+                print "Number of observations:        ", nobs
+                print "Max number of observations:    ", nobs
 
 # Find the obs group to create table in
         
@@ -1548,101 +3560,96 @@ class pyDART():
         group_obs    = root.obs
         group_header = root.header
 
-# create table that will hold the observation information
+# create table that will hold the observation information, sized for the number of obs
         
-        table_obs = h5file.create_table(group_obs, 'observations', DART_obs, 'Observations from DART file')
-        
-        row = table_obs.row
+        table_obs = h5file.create_table(group_obs, 'observations', DART_obs, 'Observations from DART file', 
+                                        expectedrows=max(nobs,1), chunkshape=bulk_chunkshape(DART_obs, nobs))
 
-# Read in the obs sequentially!
+# Build the rows a block at a time from the columns
         
-        for n in N.arange( obs_dict['counter'] ):
+        utime_day0 = day_utime.date2num(py_datetime(1970,1,1))
+        
+        for n0 in range(0, nobs, chunk):
             
-            row['number']    = long(n+1)
-            row['value']     = obs_dict['value'][n]
+            n1   = min(n0+chunk, nobs)
+            s    = slice(n0, n1)
+            rows = default_rows(table_obs, n1-n0)
             
-            if n == 0:
-                    row['previous'] = -1
-            else:
-                    row['previous'] = n-1
+            number = N.arange(n0, n1)
             
-            row['next']       = n+1
-            row['cov_group']  = -1
+            rows['number']     = number + 1
+            rows['value']      = obs_dict['value'][s]
+            rows['previous']   = number - 1
+            rows['next']       = number + 1
+            rows['cov_group']  = -1
+            
+            if n0 == 0:
+                rows['previous'][0] = -1
 
 # Here is where you sometimes need to switch lat and lon in the codes....
             
-            row['lon']        = obs_dict['lon'][n]
-            row['lat']        = obs_dict['lat'][n]
-            row['height']     = obs_dict['height'][n]
-            row['vert_coord'] = 3
-            row['kind']       = obs_dict['kind'][n]
+            rows['lon']        = obs_dict['lon'][s]
+            rows['lat']        = obs_dict['lat'][s]
+            rows['height']     = obs_dict['height'][s]
+            rows['vert_coord'] = 3
+            rows['kind']       = obs_dict['kind'][s]
 
-# Check to see if its radial velocity and add platform information...need BETTER CHECK HERE!
+# Radial velocity platform information
             
-            if row['kind'] == 11:
-
-# Need to switch the lat and lon these around to be correct in version 2 of pyDART...
+            vr = rows['kind'] == 11
+            
+            if N.any(vr):
                 
-                row['platform_lon']        = obs_dict['platform_lon'][n]
-                row['platform_lat']        = obs_dict['platform_lat'][n]
-                row['platform_height']     = obs_dict['platform_height'][n]
-                row['platform_vert_coord'] = obs_dict['platform_vert_coord'][n]
+                for name in ['platform_lon', 'platform_lat', 'platform_height', 'platform_vert_coord', 'platform_dir1', 
+                             'platform_dir2', 'platform_dir3', 'platform_nyquist', 'platform_key']:
+                    rows[name][vr] = N.asarray(obs_dict[name][s])[vr]
                 
-                row['platform_dir1']       = obs_dict['platform_dir1'][n]
-                row['platform_dir2']       = obs_dict['platform_dir2'][n]
-                row['platform_dir3']       = obs_dict['platform_dir3'][n]
-                row['platform_nyquist']    = obs_dict['platform_nyquist'][n]
-                row['platform_key']        = obs_dict['platform_key'][n]
+                elevation = N.rad2deg(N.arcsin(rows['platform_dir3'][vr]))
+                coselv    = N.cos(N.deg2rad(elevation))
+                azimuth   = N.rad2deg( N.arctan2( rows['platform_dir1'][vr] / coselv, rows['platform_dir2'][vr] / coselv ) )
+                azimuth   = azimuth.astype(rows['azimuth'].dtype)          # wrap the stored value, like the row by row code
+                azimuth   = N.where(azimuth < 0, azimuth + 360., azimuth)
                 
-                row['elevation']           = N.rad2deg(N.arcsin(obs_dict['platform_dir3'][n]))
+                rows['elevation'][vr] = elevation
+                rows['azimuth'][vr]   = N.where(N.abs(N.cos(elevation)) < 0.001, 0.0, azimuth)   # pointing straight up?
+
+# See if there is information about the reflectivity azimuth and elevation supplied
             
-                if N.abs(N.cos(row['elevation'])) < 0.001:   # pointing straight up?
-                    row['azimuth'] = 0.0
-                else:
-                    row['azimuth'] = N.rad2deg( N.arctan2( row['platform_dir1'] / N.cos(N.deg2rad(row['elevation'])), \
-                                                           row['platform_dir2'] / N.cos(N.deg2rad(row['elevation'])) ) )
-                    if row['azimuth'] < 0: row['azimuth'] = row['azimuth'] + 360.
-                    
-            if row['kind'] == ObType_LookUp("DBZ"):    # See if there is information about the azimuth and elevation supplied
+            dbz = rows['kind'] == ObType_LookUp("DBZ")
             
-                if 'azimuth' in obs_dict.keys():
-                    row['azimuth'] = obs_dict['azimuth'][n]
-                    if row['azimuth'] < 0: row['azimuth'] = row['azimuth'] + 360.
+            if N.any(dbz) and 'azimuth' in obs_dict.keys():
+                azimuth = N.asarray(obs_dict['azimuth'][s])[dbz].astype(rows['azimuth'].dtype)
+                rows['azimuth'][dbz] = N.where(azimuth < 0, azimuth + 360., azimuth)
+            
+            if N.any(dbz) and 'elevation' in obs_dict.keys():
+                rows['elevation'][dbz] = N.asarray(obs_dict['elevation'][s])[dbz]
 
-                if 'elevation' in obs_dict.keys():
-                    row['elevation'] = obs_dict['elevation'][n]
-                
 # Add in information about the observations relative location to radar.  Do this only for radar observation (for now)
             
             if radar_loc != None:
                 
                 radar_lat = radar_loc[0]
                 radar_lon = radar_loc[1]
-                                
-                row['x'], row['y'] = dll_2_dxy(radar_lat, row['lat'], radar_lon, row['lon'])
-                row['z']           = row['height']
+                
+                rows['x'], rows['y'] = dll_2_dxy(radar_lat, rows['lat'], radar_lon, rows['lon'])
+                rows['z']            = rows['height']
 
-# Add in a full date and time string to data set, as well as create a UTIME in seconds for searching
+# Time information, and a UTIME in seconds for searching
             
-            row['seconds']   = obs_dict['sec'][n]
-            row['days']      = obs_dict['day'][n]
+            rows['seconds']   = obs_dict['sec'][s]
+            rows['days']      = obs_dict['day'][s]
             
-            days = float(obs_dict['day'][n]) + float(obs_dict['sec'][n])/86400.
-            date = day_utime.num2date(days)
-            
-            row['date']      = str(date)
-            row['utime']     = round(sec_utime.date2num(date))  # round to prevent sometimes truncating down to next integer
+            rows['utime']     = N.round((N.asarray(obs_dict['day'][s], dtype=N.float64) - utime_day0) * 86400. 
+                                        + N.asarray(obs_dict['sec'][s], dtype=N.float64))
             
-            row['error_var'] = obs_dict['error_var'][n]
-            row['index']     = n
+            rows['error_var'] = obs_dict['error_var'][s]
+            rows['index']     = number
             
-            if n % 5000 == 0:
-                print "PyDart.dict2hdf:  Processed observation # ", n+1, days
-                print " Date,sec_utime,utime = ", date,sec_utime.date2num(date), row['utime']
+            table_obs.append(rows)
             
-            row.append()
+            print "PyDart.dict2hdf:  Processed observation # ", n1
         
-        table_obs.flush
+        table_obs.flush()
         
         h5file.close()
         
@@ -1696,7 +3703,9 @@ class pyDART():
         print "\npyDart/MRMS->  Lat Bounding Box on:  %f to %f" % (lat_bbox[0], lat_bbox[1])
         print "\npyDart/MRMS->  Lon Bounding Box on:  %f to %f" % (lon_bbox[0], lon_bbox[1])
 
-# Create PyTables file
+# Create PyTables file (drop any cached handle, since the file is about to be rewritten)
+        
+        self.close()
         
         filter_spec = Filters(complevel=5, complib="zlib", shuffle=1, fletcher32=0)
         
@@ -1715,14 +3724,15 @@ class pyDART():
 # create table that will hold the observation information
         
         table_obs = h5file.create_table(group_obs, 'observations', DART_obs, 'Observations from DART file')
-    
-        row = table_obs.row
         
 # set counters
 
         count       = 0
         count_dbz   = 0
         count_zeros = 0
+        
+        kind_dbz   = ObType_LookUp("REFLECTIVITY")
+        kind_clear = ObType_LookUp("CLEARAIR_REFLECTIVITY")
                   
 #  Open netcdf files, read data, flatten, and append
 
@@ -1770,7 +3780,7 @@ class pyDART():
             except KeyError:
                 print("\n==>MRMS2HDF:  Cannot find mrefl_mosaic variable in netCDF file!\n")
 
-            if dbz == None:
+            if dbz is None:
                 print("\n==>MRMS2HDF:  Cannot find any of the specified reflectivity variables in netCDF file, exiting....\n")
                 raise SystemExit
                          
@@ -1782,11 +3792,18 @@ class pyDART():
             mindex = N.arange(lons.size)[index]
             index  = (hgts >= hgt_bbox[0] ) & (hgts < hgt_bbox[1])
             kindex = N.arange(hgts.size)[index]
+
+# Time is the same for every observation in the file, so convert it once
+
+            dt = ncdf.num2date(f.Time, units="seconds since 1970-01-01 00:00:00")
+            gc = ncdf.date2num(dt, units = "days since 1601-01-01 00:00:00")
+
+# Clear air thinning pattern for the horizontal grid (uses the thinned grid indices)
+
+            lat2d, lon2d = N.meshgrid(lats[lindex], lons[mindex], indexing='ij')
+            thin_lm      = N.outer(lindex, mindex) % dbz_clear_thin
             
-            # print dbz.shape, lats.shape, lons.shape
-            # print lindex[0], lats[lindex[0]], lats[lindex[-1]], lindex[-1]
-            # print mindex[0], lons[mindex[0]], lons[mindex[-1]], mindex[-1]
-            # print kindex, hgts
+            missing = f.MissingData
 
             for k in kindex:
 
@@ -1798,82 +3815,61 @@ class pyDART():
                 else:
                     hgt_flag = 0
 
-                hgt = hgts[k]       
-                        
-                for l in lindex:
-                    
-                    lat = lats[l]
-                        
-                    for m in mindex:
-                        
-                        lon = lons[m]
-                        
-                        thin_zeros = hgt_flag + (l*m) % dbz_clear_thin
-                        
-                        data = min(dbz[k,l,m], dbz_max)
+                thin_zeros = (hgt_flag + thin_lm) == 0
 
-                        my_mask = False
-                        
-                        if data == f.MissingData and dbz_missing_zeros and thin_zeros == 0: 
-                              data = dbz_clear_air 
-                              data_kind = ObType_LookUp("CLEARAIR_REFLECTIVITY")
-                              my_mask = True
-                              count_zeros += 1
-
-                        if (data > f.MissingData and data < dbz_min) and dbz_zeros and thin_zeros == 0:  
-                              data = dbz_clear_air 
-                              data_kind = ObType_LookUp("CLEARAIR_REFLECTIVITY")
-                              my_mask = True
-                              count_zeros += 1
-                                                    
-                        if data >= dbz_min:  
-                              my_mask = True
-                              data_kind = ObType_LookUp("REFLECTIVITY")
-                              count_dbz += 1
-
-                        if my_mask:   
-                            
-                            row['number'] = long(count+1)
-                            row['value']  = data
-            
-                            if  count == 0:
-                                row['previous'] = -1
-                            else:
-                                row['previous'] = count-1
-            
-                            row['next']       = count+1
-                            row['cov_group']  = -1
+# Same sequence of tests as the original point by point code:  missing -> clear air, weak -> clear air, strong -> dBZ
 
-            # Set lat and lon in the codes....
-            
-                            row['lon']        = lon
-                            row['lat']        = lat
-                            row['height']     = hgt
-                            row['vert_coord'] = 3
-                            row['kind']       = data_kind
-        
-            # Add in a full date and time string to data set, as well as create a UTIME in seconds for searching
+                data      = N.minimum(N.ma.filled(dbz[k][lindex][:,mindex], missing), dbz_max)
+                data_kind = N.zeros(data.shape, dtype=N.int32)
 
-                            dt = ncdf.num2date(f.Time, units="seconds since 1970-01-01 00:00:00")
-                            gc = ncdf.date2num(dt, units = "days since 1601-01-01 00:00:00")
-            
-                            row['days']    = N.int(gc)
-                            row['seconds'] = (gc - N.int(gc)) * 86400
-            
-                            row['date']    = dt.strftime(time_format)
-                            row['utime']   = f.Time           
-            
-                            row['error_var'] = dbz_stdev
-                    
-                            row['index'] = count
+                clear = (data == missing) & dbz_missing_zeros & thin_zeros
+                data[clear]      = dbz_clear_air
+                data_kind[clear] = kind_clear
                 
-                            count = count + 1
-    
-                            if count % 5000 == 0:
-                                print "PyDart.MRMS:  Processed observation # %d" %  (count+1)
-                                print " Date,sec_utime,utime = ", row['date'], row['utime']
+                weak = (data > missing) & (data < dbz_min) & dbz_zeros & thin_zeros
+                data[weak]      = dbz_clear_air
+                data_kind[weak] = kind_clear
+
+                data_kind[data >= dbz_min] = kind_dbz
+
+                my_mask = data_kind > 0
+                nobs    = N.count_nonzero(my_mask)
+                
+                if nobs == 0:
+                    continue
+
+                rows = default_rows(table_obs, nobs)
+                
+                number = N.arange(count, count+nobs)
+                
+                rows['number']     = number + 1
+                rows['value']      = data[my_mask]
+                rows['previous']   = number - 1
+                rows['next']       = number + 1
+                rows['cov_group']  = -1
+                rows['lon']        = lon2d[my_mask]
+                rows['lat']        = lat2d[my_mask]
+                rows['height']     = hgts[k]
+                rows['vert_coord'] = 3
+                rows['kind']       = data_kind[my_mask]
+                rows['days']       = N.int(gc)
+                rows['seconds']    = (gc - N.int(gc)) * 86400
+                rows['utime']      = f.Time
+                rows['error_var']  = dbz_stdev
+                rows['index']      = number
+                
+                if count == 0:
+                    rows['previous'][0] = -1
+
+                table_obs.append(rows)
+                
+                count       = count + nobs
+                count_dbz   = count_dbz   + N.count_nonzero(rows['kind'] == kind_dbz)
+                count_zeros = count_zeros + N.count_nonzero(rows['kind'] == kind_clear)
+
+            print "PyDart.MRMS:  Processed observation # %d" %  count
+            print " Date,sec_utime,utime = ", dt.strftime(time_format), f.Time
             
-                            row.append()
             f.close()
         
         table_obs.flush()
@@ -1941,37 +3937,39 @@ class pyDART():
             
 # Open DART PyTables file
         
-        h5file, table = open_pyDart_file(self.hdf5, verbose=self.verbose)
+        h5file, table = self.open()
+        try:
 
 # Open ASCII file
         
-        if ascii == None:
-            fi = open(self.ascii[:-4]+".tmp.out", "w")
-        else:
-            fi = open(ascii, "w")
+            if ascii == None:
+                fi = open(self.ascii[:-4]+".tmp.out", "w")
+            else:
+                fi = open(ascii, "w")
         
-        if self.index != None:
-            fi.write("%d\n" % (len(self.index)) )
+            if self.index != None:
+                fi.write("%d\n" % (len(self.index)) )
             
-        else:
-            fi.write(" %d\n" % (attr.col('num_obs')[0]))
+            else:
+                fi.write(" %d\n" % (self.header['num_obs']))
                             
-        if self.debug:  print "pyDart/correct_ens_output:  Completed writing out header information for ascii CORRECT_ENS file"
+            if self.debug:  print "pyDart/correct_ens_output:  Completed writing out header information for ascii CORRECT_ENS file"
 
 # If there is no search index defined, then create a temporary one to loop through all rows..
         
-        if len(self.index) > 0:
-            self.index = arange(table.nrows)
+            if len(self.index) > 0:
+                self.index = arange(table.nrows)
         
-        n = 0
-        for row in table.itersequence(self.index):
-            n += 1
+            n = 0
+            for row in table.itersequence(self.index):
+                n += 1
                         
-            fi.write("    %14.7f   %14.7f    %14.7f   %8.3f \n" % (row["lon"], row["lat"], row["height"], row["value"] ))
+                fi.write("    %14.7f   %14.7f    %14.7f   %8.3f \n" % (row["lon"], row["lat"], row["height"], row["value"] ))
             
-            if n % 10000 == 0: print "pyDart/hdf2ascii:  Processed observation # ", n
+                if n % 10000 == 0: print "pyDart/hdf2ascii:  Processed observation # ", n
         
-        h5file.close()
+        finally:
+            self.release()
         
         fi.close()
         
@@ -1986,6 +3984,114 @@ class pyDART():
         if self.hdf5 == None:
             print "pyDart/hdf2ascii:  No HDF5 file name is defined, please add one to the command line..."
             return
+
+# Open DART PyTables file
+        
+        h5file, table = self.open()
+        try:
+
+# Open ASCII file
+        
+            if ascii == None:
+                fi = open(self.ascii[:-4]+".tmp.out", "w")
+            else:
+                fi = open(ascii, "w")
+
+# If there is no search index defined, then create a temporary one to loop through all rows..
+        
+            if len(self.index) == 0:
+                self.index = N.arange(table.nrows)
+        
+            n = self.write_obs_seq(fi, table, self.index, obs_error=obs_error)
+        
+        finally:
+            self.release()
+        
+        fi.close()
+        
+        print "pyDart/hdf2ascii:  Created ascii DART file, N = ", n
+        
+        return 0
+
+#-------------------------------------------------------------------------------
+# hdf2ascii_windows:  writes one DART ascii file per analysis window from a single
+#                     read of the utime column.  Windows are centered every "interval"
+#                     seconds from start to end, and span [center-halfwidth, center+halfwidth)
+#                     just like the --start/--end search.  Output files are named
+#                     prefix_YYYYMMDD_HHMMSS.out
+
+    def hdf2ascii_windows(self, start, end, interval, halfwidth, prefix=None, variable=None, obs_error=None):
+        
+        if self.hdf5 == None:
+            print "pyDart/hdf2ascii_windows:  No HDF5 file name is defined, please add one to the command line..."
+            return
+        
+        if prefix == None:
+            prefix = self.ascii[:-4]
+        
+        if type(start) == tuple:
+            start = py_datetime(*start)
+        if type(end) == tuple:
+            end = py_datetime(*end)
+
+# Open DART PyTables file
+        
+        h5file, table = self.open()
+        try:
+
+# Read the time column once, and if the table is not sorted by time, sort the row numbers
+
+            utime = table.col('utime')
+            index = N.arange(table.nrows)
+        
+            if variable != None:
+                index = index[table.col('kind') == ObType_LookUp(variable)]
+                utime = utime[index]
+        
+            if N.any(N.diff(utime) < 0):
+                if self.verbose:  print "pyDart/hdf2ascii_windows:  Table is not sorted by utime, sorting row numbers"
+                order = N.argsort(utime, kind='mergesort')
+                index = index[order]
+                utime = utime[order]
+        
+            center = start
+            nfiles = 0
+        
+            while center < end:
+            
+                utime_start = sec_utime.date2num(center - py_timedelta(seconds=halfwidth))
+                utime_end   = sec_utime.date2num(center + py_timedelta(seconds=halfwidth))
+            
+                i0 = N.searchsorted(utime, utime_start, side='left')
+                i1 = N.searchsorted(utime, utime_end,   side='left')
+            
+                if i1 > i0:
+                    ascii = "%s_%s.out" % (prefix, center.strftime("%Y%m%d_%H%M%S"))
+                    fi    = open(ascii, "w")
+                    n     = self.write_obs_seq(fi, table, N.sort(index[i0:i1]), obs_error=obs_error)
+                    fi.close()
+                    nfiles += 1
+                    if self.verbose:
+                        print "pyDart/hdf2ascii_windows:  %s  N = %d" % (ascii, n)
+                else:
+                    print "pyDart/hdf2ascii_windows:  No observations found for window centered at %s" % center
+            
+                center = center + py_timedelta(seconds=interval)
+        
+        finally:
+            self.release()
+        
+        print "pyDart/hdf2ascii_windows:  Created %d ascii DART files" % nfiles
+        
+        return 0
+
+#-------------------------------------------------------------------------------
+# write_obs_seq:  writes the header and the observations in index from an open table
+#                 to an open ascii file, returns the number of observations written.
+#                 Rows are read "chunk" at a time and each block is formatted and
+#                 written with a single call
+
+    def write_obs_seq(self, fi, table, index, obs_error=None, chunk=100000):
             
         if obs_error != None:
                 print "HEY!!  Changing standard deviation of fields:  ", obs_error, "\n"
@@ -1995,202 +4101,206 @@ class pyDART():
         else:
             error_dart_fields = None
 
-
-# Open DART PyTables file
-        
-        h5file, table = open_pyDart_file(self.hdf5, verbose=self.verbose)
-
-# Open ASCII file
-        
-        if ascii == None:
-            fi = open(self.ascii[:-4]+".tmp.out", "w")
-        else:
-            fi = open(ascii, "w")
-
 # Write out header information
         
         fi.write(" obs_sequence\n")
         fi.write("obs_kind_definitions\n")
 
-# Observation types are in the h5file.root.obs.kinds directory
-        
-        kinds = h5file.root.obs.kinds
+# Observation types are in the h5file.root.obs.kinds directory, cached by self.open
         
-        fi.write("       %d\n" % N.size(kinds))
+        fi.write("       %d\n" % len(self.kinds))
         
-        for r in kinds.iterrows():
-            fi.write("    %d          %s   \n" % (r['index'], r['name']) )
+        for r in self.kinds:
+            fi.write("    %d          %s   \n" % r )
             if self.debug:  print 'pyDart/hdf2ascii:  Written observational types:  ', r
         
-        attr = h5file.root.header.attributes
+        num_copies = self.header['num_copies']
 
-        nobs = attr.col('num_obs')[0]
-
-        fi.write("  num_copies:            %d  num_qc:            %d\n" % (attr.col('num_copies')[0], 1 ))
+        fi.write("  num_copies:            %d  num_qc:            %d\n" % (num_copies, 1 ))
         
-        if self.index != None:
-            fi.write(" num_obs:       %d  max_num_obs:       %d\n" % (len(self.index), len(self.index)) )
-        else:
-            fi.write(" num_obs:       %d  max_num_obs:       %d\n" % (attr.col('num_obs')[0], attr.col('max_num_obs')[0]))
+        fi.write(" num_obs:       %d  max_num_obs:       %d\n" % (len(index), len(index)) )
             
         fi.write("observations\n")
-        if attr.col('num_copies')[0] == 2:
+        if num_copies == 2:
             fi.write("truth\n")
         fi.write("QC\n")
                 
-        if self.index != None:
-            fi.write("  first:            %d  last:       %d\n" % (1, len(self.index)) )
-            if self.debug:
-                print "pyDart/hdf2ascii:  Max number of observations:    ", len(self.index)
-        else:
-            fi.write("  first:            %d  last:       %d\n" % (attr.col('first')[0], attr.col('last')[0]))
-            if self.debug:
-                print "pyDart/hdf2ascii:  Max number of observations:    ", attr.col('max_num_obs')[0]
+        fi.write("  first:            %d  last:       %d\n" % (1, len(index)) )
+        if self.debug:
+            print "pyDart/hdf2ascii:  Max number of observations:    ", len(index)
         
         if self.debug:
-            print "pyDart/hdf2ascii:  Number of observation copies:  ", attr.col('num_copies')[0]
-            print "pyDart/hdf2ascii:  Number of QC'd observations:   ", attr.col('num_qc')[0]
+            print "pyDart/hdf2ascii:  Number of observation copies:  ", num_copies
+            print "pyDart/hdf2ascii:  Number of QC'd observations:   ", self.header['num_qc']
         
         if self.debug:  print "pyDart/hdf2ascii:  Completed writing out header information for ascii DART file"
 
-# If there is no search index defined, then create a temporary one to loop through all rows..
+# Record templates:  every observation has the same leading and trailing lines, radial velocities
+#                    add the platform block and GOES cloud paths add the satellite lines
         
-        if len(self.index) == 0:
-            self.index = N.arange(table.nrows)
-            
-#select_table = table.copy(self.index)
+        if num_copies == 2:
+            head = " OBS            %d\n   %20.14f\n   %20.14f\n   %20.14f\n"
+        else:
+            head = " OBS            %d\n   %20.14f\n   %20.14f\n"
         
-        n = 0
-        for row in table.itersequence(self.index):
-            n += 1
-            
-            fi.write(" OBS            %d\n" % n )
-            fi.write("   %20.14f\n" % row["value"]  )
+        head = head + " %d %d %d\nobdef\nloc3d\n    %20.14f          %20.14f          %20.14f     %d\nkind\n     %d     \n"
+        
+        goes = "    %20.14f          %20.14f  \n    %20.14f  \n"
+        
+        vr   = "platform\nloc3d\n    %20.14f          %20.14f        %20.14f    %d\ndir3d\n" \
+             + "    %20.14f          %20.14f        %20.14f\n     %20.14f     \n     %d     \n"
+        
+        tail = "    %d          %d     \n    %20.14f  \n"
+        
+        kind_vr   = ObType_LookUp("VR")
+        kind_goes = [ObType_LookUp("GOES_CWP_PATH"), ObType_LookUp("GOES_IWP_PATH"), 
+                     ObType_LookUp("GOES_LWP_PATH"), ObType_LookUp("GOES_CWP_ZERO")]
+
+# Command line override of observational error variances, the first entry for a kind wins
+
+        variance = {}
+        if error_dart_fields != None:
+            for k, field in enumerate(obs_error):
+                kind = ObType_LookUp(field[0])
+                if not variance.has_key(kind):
+                    try:
+                        std_dev = float(field[1])
+                        variance[kind] = std_dev*std_dev
+                    except ValueError:
+                        variance[kind] = None
+        
+        columns = ["value", "qc", "cov_group", "lon", "lat", "height", "vert_coord", "kind", "seconds", "days", "error_var",
+                   "satellite", "platform_lat", "platform_lon", "platform_height", "platform_vert_coord", 
+                   "platform_dir1", "platform_dir2", "platform_dir3", "platform_nyquist", "platform_key"]
+        if num_copies == 2:
+            columns.append("truth")
+        
+        nobs = len(index)
+        n    = 0
+        
+        for b0 in range(0, nobs, chunk):
             
-            if attr.col('num_copies')[0] == 2:
-                fi.write("   %20.14f\n" % row["truth"]  )
+            rows = read_columns(table, index[b0:b0+chunk], columns)
+            nrec = len(rows["kind"])
 
-            fi.write("   %20.14f\n" % row["qc"] )    # QC flag
+# Observation numbers and the linked list (previous, next) for the block
+            
+            number   = N.arange(n+1, n+nrec+1)
+            previous = number - 1
+            next     = number + 1
+            previous[number == 1]    = -1
+            next[number == nobs]     = -1
             
-# Code (from RLT) to output correct index number for each ob in the output DART file
+            kind = rows["kind"]
+            
+            lon = N.where(rows["lon"] < 0., rows["lon"] + 360., rows["lon"])
+            
+            error_var = rows["error_var"].copy()
+            for k in variance.keys():
+                if variance[k] != None:
+                    error_var[kind == k] = variance[k]
 
-            if n == 1: 
-                fi.write(" %d %d %d\n" % (-1, n+1, row["cov_group"]) ) # First obs.
-            elif n == len(self.index):
-                fi.write(" %d %d %d\n" % (n-1, -1, row["cov_group"]) ) # Last obs.
+            if num_copies == 2:
+                columns_head = [number, rows["value"], rows["truth"], rows["qc"]]
             else:
-                fi.write(" %d %d %d\n" % (n-1, n+1, row["cov_group"]) ) 
+                columns_head = [number, rows["value"], rows["qc"]]
             
-            fi.write("obdef\n")
-            fi.write("loc3d\n")
- 
-            if row["lon"] < 0.:
-                ob_lon = row["lon"] + 360.
-            else:
-                ob_lon = row["lon"] 
+            columns_head = columns_head + [previous, next, rows["cov_group"], N.radians(lon), N.radians(rows["lat"]), 
+                                           rows["height"], rows["vert_coord"], kind]
             
-            fi.write("    %20.14f          %20.14f          %20.14f     %d\n" % 
-                    (N.radians(ob_lon), N.radians(row["lat"]), row["height"], row["vert_coord"]) )
+            records = map(lambda v: head % v, zip(*[c.tolist() for c in columns_head]))
             
-            fi.write("kind\n")
+            for i in N.nonzero(N.in1d(kind, kind_goes))[0]:
+                records[i] = records[i] + goes % tuple(rows["satellite"][i].tolist())
             
-            fi.write("     %d     \n" % row["kind"] )
-
-# If this GEOS cloud pressure observation, write out extra information (NOTE - NOT TESTED FOR HDF2ASCII LJW 04/13/15)
-
-            if (row["kind"] == ObType_LookUp("GOES_CWP_PATH") or 
-                row["kind"] == ObType_LookUp("GOES_IWP_PATH") or 
-                row["kind"] == ObType_LookUp("GOES_LWP_PATH") or 
-                row["kind"] == ObType_LookUp("GOES_CWP_ZERO")):
-
-                fi.write("    %20.14f          %20.14f  \n" % (row["satellite"][0], row["satellite"][1]) )
-                fi.write("    %20.14f  \n" % (row["satellite"][2]) )
-
-# Check to see if its radial velocity and add platform information...need BETTER CHECK HERE!
+            is_vr = N.nonzero(kind == kind_vr)[0]
+            if len(is_vr) > 0:
+                plat_lon = N.where(rows["platform_lon"][is_vr] < 0., rows["platform_lon"][is_vr] + 360., 
+                                   rows["platform_lon"][is_vr])
+                columns_vr = [N.radians(plat_lon), N.radians(rows["platform_lat"][is_vr]), rows["platform_height"][is_vr], 
+                              rows["platform_vert_coord"][is_vr], rows["platform_dir1"][is_vr], rows["platform_dir2"][is_vr],
+                              rows["platform_dir3"][is_vr], rows["platform_nyquist"][is_vr], rows["platform_key"][is_vr]]
+                for i, v in zip(is_vr.tolist(), zip(*[c.tolist() for c in columns_vr])):
+                    records[i] = records[i] + vr % v
             
-            if row["kind"] == ObType_LookUp("VR"):
-                
-                fi.write("platform\n")
-                fi.write("loc3d\n")
-
-                if row["platform_lon"] < 0.:
-                    plat_lon = row["platform_lon"] + 360.
-                else:
-                    plat_lon = row["platform_lon"] 
-
-                platform_lat, platform_lon = N.radians(row["platform_lat"]), N.radians(plat_lon)
-                
-                fi.write("    %20.14f          %20.14f        %20.14f    %d\n" %
-                        (platform_lon, platform_lat, row["platform_height"], row["platform_vert_coord"]) )
-                
-                fi.write("dir3d\n")
-                
-                dir1, dir2, dir3 = (row["platform_dir1"], row["platform_dir2"], row["platform_dir3"])
-                fi.write("    %20.14f          %20.14f        %20.14f\n" % (dir1, dir2, dir3) )
-                fi.write("     %20.14f     \n" % row["platform_nyquist"] )
-                fi.write("     %d     \n" % row["platform_key"] )
-
-# Done with special radial velocity obs back to dumping out time, day, error variance info
+            columns_tail = [rows["seconds"], rows["days"], error_var]
             
-            fi.write("    %d          %d     \n" % (row["seconds"], row["days"]) )
-
-# Logic for command line override of observational error variances
-
-            if error_dart_fields != None:
+            fi.write("".join(map(lambda r, v: r + tail % v, records, zip(*[c.tolist() for c in columns_tail]))))
             
-                try:
-                    std_dev = float(obs_error[error_dart_fields.index(row['kind'])][1])
-                    variance = std_dev*std_dev
-                    fi.write("    %20.14f  \n" % variance )
-                except ValueError:
-                    fi.write("    %20.14f  \n" % row['error_var'] )
-                
-            else:
-                fi.write("    %20.14f  \n" % row['error_var'] )
-
-            if n % 10000 == 0: print "pyDart/hdf2ascii:  Processed observation # ", n
-        
-        h5file.close()
-        
-        fi.close()
-        
-        print "pyDart/hdf2ascii:  Created ascii DART file, N = ", n
+            n = n + nrec
+            
+            print "pyDart/hdf2ascii:  Processed observation # ", n
         
-        return 0
+        return n
 
 #-------------------------------------------------------------------------------
     
-    def getDartTimes(self, output_file_name=None):
+    def getDartTimes(self, output_file_name=None, counts=False, chunk=1000000):
+        """Lists the distinct observation times in the table.  The utime column (and the kind
+           column when counts=True) is read "chunk" rows at a time, and the unique times
+           are merged with their observation counts, so the table can be in any order.
+           When counts=True, each time also lists the total and per-kind number of obs.
+        """
 
 # Open DART PyTables file
         
-        h5file, table = open_pyDart_file(self.hdf5, verbose = self.verbose)
+        h5file, table = self.open()
+        try:
         
-        n = 0
-        date = []
-        nobs = []
-        for row in table.iterrows():
-            if n == 0:
-                date.append(row['date'])
-                n = 1
-            else:
-                if date[n-1] != row['date']:
-                    date.append(row['date'])
-                    n += 1
+            kinds = [k[0] for k in self.kinds]
+            names = [k[1] for k in self.kinds]
+        
+            times  = N.zeros((0,), dtype=N.int64)
+            ntimes = N.zeros((0, len(kinds)+1), dtype=N.int64)
+        
+            for n0 in range(0, table.nrows, chunk):
+            
+                utime = table.read(start=n0, stop=min(n0+chunk, table.nrows), field='utime')
+            
+                u, inv = N.unique(utime, return_inverse=True)
+            
+                nobs = N.zeros((u.size, len(kinds)+1), dtype=N.int64)
+                nobs[:,0] = N.bincount(inv, minlength=u.size)
+            
+                if counts:
+                    kind = table.read(start=n0, stop=min(n0+chunk, table.nrows), field='kind')
+                    for k, kind_index in enumerate(kinds):
+                        nobs[:,k+1] = N.bincount(inv[kind == kind_index], minlength=u.size)
+
+# Merge this chunk with the times found so far
+            
+                times, inv = N.unique(N.concatenate((times, u)), return_inverse=True)
+                merged     = N.zeros((times.size, len(kinds)+1), dtype=N.int64)
+                N.add.at(merged, inv, N.concatenate((ntimes, nobs)))
+                ntimes     = merged
+        
+        finally:
+            self.release()
+        
+        n    = times.size
+        date = utime2date(times)
+        
+        lines = []
+        if counts:
+            lines.append("#   YYYY MM  DD  HH  MM  SS    NOBS  %s" % "  ".join(names))
+        
+        for d, nobs in zip(date, ntimes):
+            line = "%s  %s  %s  %s  %s  %s" % (d[0:4],d[5:7],d[8:10],d[11:13],d[14:16],d[17:19])
+            if counts:
+                line = line + "  %6d  %s" % (nobs[0], "  ".join(["%d" % c for c in nobs[1:]]))
+            lines.append(line)
         
         if output_file_name == None:
             print n
-            for d in date:
-                print "%s  %s  %s  %s  %s  %s" % (d[0:4],d[5:7],d[8:10],d[11:13],d[14:16],d[17:19])
+            for line in lines:
+                print line
         else:
             fi = open(output_file_name, "w")
             fi.write("   %d\n" % n )
-            for d in date:
-                fi.write("%s  %s  %s  %s  %s  %s\n" % (d[0:4],d[5:7],d[8:10],d[11:13],d[14:16],d[17:19]) )
+            for line in lines:
+                fi.write("%s\n" % line)
             fi.close()
         
-        h5file.close()
-        
         return 0
 
 #-------------------------------------------------------------------------------
@@ -2252,6 +4362,32 @@ class DART_ob_kinds(IsDescription):
         index               = Int64Col(dflt=long(_missing))
         name                = StringCol(255)
 
+class DART_bucket(IsDescription):
+        bucket              = Int64Col(pos=0)
+        row                 = Int64Col(pos=1)
+
+class DART_partition(IsDescription):
+        name                = StringCol(32)
+        utime_start         = Int64Col()
+        utime_end           = Int64Col()
+        nrows               = Int64Col()
+
+class DART_innov_stats(IsDescription):
+        kind                = Int32Col  (pos=0)
+        utime_start         = Int64Col  (pos=1)
+        height_bot          = Float32Col(dflt=_missing, pos=2)
+        range_bot           = Float32Col(dflt=_missing, pos=3)
+        count_b             = Int64Col  (pos=4)
+        count_a             = Int64Col  (pos=5)
+        bias_b              = Float32Col(dflt=_missing, pos=6)
+        rms_b               = Float32Col(dflt=_missing, pos=7)
+        spread_b            = Float32Col(dflt=_missing, pos=8)
+        bias_a              = Float32Col(dflt=_missing, pos=9)
+        rms_a               = Float32Col(dflt=_missing, pos=10)
+        spread_a            = Float32Col(dflt=_missing, pos=11)
+        obs_error           = Float32Col(dflt=_missing, pos=12)
+        cr                  = Float32Col(dflt=_missing, pos=13)
+
 class DART_header(IsDescription):
         origin_file         = StringCol(255)
         num_copies          = Int64Col(dflt=long(_missing))
@@ -2261,7 +4397,55 @@ class DART_header(IsDescription):
         first               = Int64Col(dflt=long(_missing))
         last                = Int64Col(dflt=long(_missing))
 
+# Version 4 observation table:  compact integer and float32 columns for everything that is not
+#         written back out to DART ascii files at full precision, no stored date string (use
+#         utime2date), and the ensemble copies moved into the optional /obs/ensemble side table
+
 class DART_obs(IsDescription):
+        number              = Int32Col  (dflt=int(_missing))
+        value               = Float64Col(dflt=_missing)
+        truth               = Float64Col(dflt=_missing)
+        previous            = Int32Col  (dflt=int(_missing))
+        qc                  = Float32Col(dflt=_missing)
+        next                = Int32Col  (dflt=int(_missing))
+        cov_group           = Int32Col  (dflt=int(_missing))
+        lat                 = Float64Col(dflt=_missing)
+        lon                 = Float64Col(dflt=_missing)
+        height              = Float64Col(dflt=_missing)
+        vert_coord          = Int16Col  (dflt=int(_missing))
+        kind                = Int32Col  (dflt=int(_missing))
+        elevation           = Float32Col(dflt=_missing)
+        azimuth             = Float32Col(dflt=_missing)
+        error_var           = Float64Col(dflt=_missing)
+        seconds             = Int32Col  (dflt=int(_missing))
+        days                = Int32Col  (dflt=int(_missing))
+        utime               = Int64Col  (dflt=long(_missing))
+        index               = Int32Col  (dflt=int(_missing))
+        x                   = Float32Col(dflt=_missing)
+        x_m                 = Float32Col(dflt=_missing)
+        y                   = Float32Col(dflt=_missing)
+        y_m                 = Float32Col(dflt=_missing)
+        z                   = Float32Col(dflt=_missing)
+        d                   = Float32Col(dflt=_missing)
+        platform_lat        = Float64Col(dflt=_missing)
+        platform_lon        = Float64Col(dflt=_missing)
+        platform_height     = Float64Col(dflt=_missing)
+        platform_vert_coord = Int16Col  (dflt=int(_missing))
+        platform_dir1       = Float64Col(dflt=_missing)
+        platform_dir2       = Float64Col(dflt=_missing)
+        platform_dir3       = Float64Col(dflt=_missing)
+        platform_nyquist    = Float64Col(dflt=_missing)
+        platform_key        = Int32Col  (dflt=int(_missing))
+        Hxb_bar             = Float32Col(dflt=_missing)
+        sdHxb               = Float32Col(dflt=_missing)
+        Hxa_bar             = Float32Col(dflt=_missing)
+        sdHxa               = Float32Col(dflt=_missing)
+        dep                 = Float32Col(dflt=_missing)
+        satellite           = Float64Col(shape=(3,), dflt=_missing)
+
+# Version 3 observation table:  still read by pyDart, and converted by migrate_pyDart_file
+
+class DART_obs_v3(IsDescription):
         number              = Float64Col(dflt=_missing)
         value               = Float64Col(dflt=_missing)
         truth               = Float64Col(dflt=_missing)
@@ -2338,6 +4522,8 @@ def main(argv=None):
     parser.add_option(      "--start",       dest="start",     type="string", help = "Start time of search in YYYY,MM,DD,HH,MM,SS")
     parser.add_option(      "--end",         dest="end",       type="string", help = "End time of search in YYYY,MM,DD,HH,MM,SS")
     parser.add_option(      "--getDartTimes",dest="DartTimes", default=False, help = "Boolean flag to dump out observations times as in getDARTtimes", action="store_true")
+    parser.add_option(      "--counts",      dest="counts",    default=False, help = "Boolean flag to add total and per-kind observation counts to --getDartTimes", action="store_true")
+    parser.add_option(      "--windows",     dest="windows",   default=None,  type = "string", nargs=4, help = "Write one ascii DART file per analysis window. Usage: --windows YYYY,MM,DD,HH,MM,SS YYYY,MM,DD,HH,MM,SS interval(sec) halfwidth(sec), files are named OUTPUT_YYYYMMDD_HHMMSS.out")
     parser.add_option(      "--condition",   dest="condition", default=None,  type = "string", help = "string having following syntax for searches:  '( z1 < height < z2 )'" )
     parser.add_option(      "--variable",    dest="variable",  default=None,  type = "string", help = "String containing the type of observation to list information:  VR, DBZ")
     parser.add_option(      "--plot",        dest="plot",      default=False, help = "Boolean flag to plot observations data", action="store_true")
@@ -2349,13 +4535,21 @@ def main(argv=None):
     parser.add_option(      "--xloc",        dest="xloc",      default=None,  type = "float",  nargs=2, help = "Search for obs within these x limits. Usage:  --xloc Xmin Xmax (in km)")
     parser.add_option(      "--yloc",        dest="yloc",      default=None,  type = "float",  nargs=2, help = "Search for obs within these y limits. Usage:  --yloc Ymin Ymax (in km)")
     parser.add_option(      "--zloc",        dest="zloc",      default=None,  type = "float",  nargs=2, help = "search for obs within these z limits. Usage:  --zloc Zmin Zmax (in km)")
-    parser.add_option(      "--lat_box",     dest="lat_box",   default=None,  type = "float",  nargs=2, help = "Search for MRMS within these lat limits. Usage:  --lat_box lat_south lat_north")
-    parser.add_option(      "--lon_box",     dest="lon_box",   default=None,  type = "float",  nargs=2, help = "Search for MRMS within these lon limits. Usage:  --lon_box lon_west lon_east")
+    parser.add_option(      "--lat_box",     dest="lat_box",   default=None,  type = "float",  nargs=2, help = "Search for obs (or convert MRMS) within these lat limits. Usage:  --lat_box lat_south lat_north")
+    parser.add_option(      "--lon_box",     dest="lon_box",   default=None,  type = "float",  nargs=2, help = "Search for obs (or convert MRMS) within these lon limits. Usage:  --lon_box lon_west lon_east")
     parser.add_option(      "--obserror",    dest="obserror",  default=None,  type = "string", nargs=2, action="append", help = "Change the stored standard deviation of a observational type. Usage: --obserror DBZ 3.0")   
     parser.add_option(      "--merge",       dest="merge",     default=False, help = "Boolean flag to merge several HDF5 obs_seq files", action="store_true")
+    parser.add_option(      "--migrate",     dest="migrate",   default=False, help = "Boolean flag to convert an old pyDART file to the current version, output is -o or FILE_v4.h5", action="store_true")
+    parser.add_option(      "--partition",   dest="partition", default=None,  type="int", help = "Copy the observations into a time-partitioned file (-o, default FILE_part.h5) with this many seconds per partition, adds to -o when it is already partitioned. Usage: --partition 3600")
+    parser.add_option(      "--append",      dest="append",    default=None,  type="string", help = "Append the observations of the ascii DART files (arguments, or -f/-d) to this existing HDF5 pyDART file. Usage: --append day.h5 new1.out new2.out")
+    parser.add_option(      "--superob",     dest="superob",   default=None,  type="float", nargs=2, help = "Combine obs of the same kind (VR: same radar) in dx by dx by dz bins into a thinned table (-o, default FILE_superob.h5). Usage: --superob dx dz (in km)")
+    parser.add_option(      "--reducer",     dest="reducer",   default=superob_reducer, type="string", help = "How --superob combines the values in a bin:  mean, median, max or min")
+    parser.add_option(      "--innov-stats", dest="innov_stats", default=False, help = "Boolean flag to write O-B/O-A statistics grouped by kind, time, height and range (-o, default FILE_innov.h5)", action="store_true")
+    parser.add_option(      "--innov_bins",  dest="innov_bins",  default=None, type="float", nargs=3, help = "Bins of --innov-stats. Usage: --innov_bins seconds dz dr (dz, dr in km)")
+    parser.add_option(      "--innov_qc",    dest="innov_qc",    default=None, type="string", help = "DART QC values of the obs used by --innov-stats, default %s, or all. Usage: --innov_qc 0,1" % ",".join([str(q) for q in innov_qc]))
     parser.add_option(      "--sort",       dest="sort",     default=False, help = "Boolean flag to sort pyDart table in ascending order", action="store_true")
     parser.add_option(      "--correctens",  dest="correctens",default=False, help = "Boolean flag to dump out observed reflectivity to be ingested into correct_ensemble", action="store_true")   
-    parser.add_option(      "--addindex",    dest="addindex",  default=False, help = "Boolean flag to create indices for faster search", action="store_true")   
+    parser.add_option(      "--addindex",    dest="addindex",  default=False, help = "Boolean flag to create the time and spatial bucket indices for faster (--lat_box/--lon_box) search", action="store_true")   
     parser.add_option(      "--scatter",     dest="scatter",   default=False, help = "Boolean flag to scatterplot observations data", action="store_true")
     parser.add_option(      "--rad2deg",     dest="rad2deg",   default=False, help = "Boolean flag to convert old format lat/lon in radians to degrees for plotting", action="store_true")
     
@@ -2387,7 +4581,10 @@ def main(argv=None):
 
     if options.dir == None:
 
-        if options.file == None:
+        if options.file == None and options.append and len(args) > 0:
+            in_filenames = [os.path.abspath(file) for file in args]
+
+        elif options.file == None:
             print "\n                NO INPUT FILE or DIRECTORY IS SUPPLIED, EXITING.... \n "
             parser.print_help()
             print
@@ -2395,6 +4592,8 @@ def main(argv=None):
 
         else:
             in_filenames.append(os.path.abspath(options.file))
+            if options.append:
+                in_filenames = in_filenames + [os.path.abspath(file) for file in args]
 
     else:
 
@@ -2474,6 +4673,16 @@ def main(argv=None):
         loc.append( "( z <= " + str(zloc[1]) + ")" )
         options.search = True
         
+    lat_box = None
+    lon_box = None
+    if not options.mrms:                 # for --mrms the boxes set the area that is converted
+        if options.lat_box != None:
+            lat_box = options.lat_box
+            options.search = True
+        if options.lon_box != None:
+            lon_box = options.lon_box
+            options.search = True
+        
     if options.sort and not options.merge:   # Do a search and return the index of that search
         if options.file[-2:] == "h5":
             sortTable(options.file)
@@ -2486,7 +4695,8 @@ def main(argv=None):
     if options.search:   # Do a search and return the index of that search
         if options.file[-2:] == "h5":
             myDART.file(filename = options.file)
-            myDART.search(variable=options.variable, start = start, end = end, condition=options.condition, loc=loc)
+            myDART.search(variable=options.variable, start = start, end = end, condition=options.condition, loc=loc, 
+                          lat_box=lat_box, lon_box=lon_box)
             if options.verbose:
                 if len(myDART.index) > 0:
                     print("\n pyDart: %d Observations found between %s and %s in file %s " % \
@@ -2513,6 +4723,22 @@ def main(argv=None):
         myDART.file(filename = options.file)
         myDART.stats(variable = options.variable)
 
+    if options.innov_stats:
+        if myDART.verbose:  print("\n PyDart:  Creating innovation statistics")
+        myDART.file(filename = options.file)
+        if options.innov_qc == None:
+            qc = innov_qc
+        elif options.innov_qc == "all":
+            qc = None
+        else:
+            qc = [int(q) for q in options.innov_qc.split(",")]
+        if options.innov_bins != None:
+            myDART.innov_stats(variable = options.variable, bin_seconds = int(options.innov_bins[0]), 
+                               dz = 1000.*options.innov_bins[1], dr = 1000.*options.innov_bins[2], filename = options.output, 
+                               qc = qc)
+        else:
+            myDART.innov_stats(variable = options.variable, filename = options.output, qc = qc)
+
     if options.plot:
         if myDART.verbose: print("\n PyDart:  plotting data")
         myDART.file(filename = options.file)
@@ -2536,6 +4762,34 @@ def main(argv=None):
                 myDART.file(filename = file)
                 myDART.hdf2ascii(obs_error=options.obserror)
 
+    if options.windows:
+        if options.file[-2:] == "h5":
+            win_times = []
+            for string in options.windows[0:2]:
+                char = string.split(",")
+                if len(char) < 5:
+                    print "pyDart:  Incorrect date/time format for windows (need YYYY,MM,DD,HH,MM,SS)"
+                    print "pyDart:  submitted arg = ", char, " Exiting program"
+                    sys.exit(1)
+                elif len(char) == 5:
+                    win_times.append( (int(char[0]), int(char[1]), int(char[2]), int(char[3]), int(char[4]), 00) )
+                else:
+                    win_times.append( (int(char[0]), int(char[1]), int(char[2]), int(char[3]), int(char[4]), int(char[5])) )
+            myDART.file(filename = options.file)
+            myDART.hdf2ascii_windows(win_times[0], win_times[1], int(options.windows[2]), int(options.windows[3]), \
+                                     prefix=options.output, variable=options.variable, obs_error=options.obserror)
+        else:
+            print("\n  pyDart:  ERROR!!  Can only write windows from HDF5 pyDART file, exiting...")
+            sys.exit(1)
+
+    if options.DartTimes:
+        if options.file[-2:] == "h5":
+            myDART.file(filename = options.file)
+            myDART.getDartTimes(output_file_name = options.output, counts = options.counts)
+        else:
+            print("\n pyDart:  ERROR!!  Can only list the times of an HDF5 pyDART file, exiting...")
+            sys.exit(-1)
+
     if options.nc2hdf:
         myDART.file(filename = options.file)
         myDART.nc2hdf(options.nc2hdf)
@@ -2559,9 +4813,50 @@ def main(argv=None):
  
     if options.addindex:
         myDART.file(filename = options.file)
-        myDART.indexrows
+        myDART.addindex()
         if myDART.verbose:  print("\n PyDart:  Completed convertion, PyDART file:  %s" % options.file)
        
+    if options.append:
+        ascii_files = [file for file in in_filenames if file[-3:] == "out"]
+        if options.append[-2:] == "h5" and os.path.exists(options.append) and len(ascii_files) > 0:
+            myDART.file(filename = options.append)
+            myDART.append_ascii(ascii_files, radar_loc = radar_loc)
+            if options.verbose:
+                print("\n pyDart:  Appended %d ascii DART files to %s" % (len(ascii_files), options.append))
+        else:
+            print("\n pyDart:  ERROR!!  --append needs an existing HDF5 pyDART file and ascii DART files to add, exiting...")
+            sys.exit(-1)
+
+    if options.superob:
+        if options.file[-2:] == "h5":
+            myDART.file(filename = options.file)
+            myDART.superob(1000.*options.superob[0], 1000.*options.superob[1], reducer = options.reducer, filename = options.output)
+        else:
+            print("\n pyDart:  ERROR!!  Can only superob an HDF5 pyDART file, exiting...")
+            sys.exit(-1)
+
+    if options.partition:
+        if options.output:
+            new_file = options.output
+        else:
+            new_file = in_filenames[0][:-3] + "_part.h5"
+        for file in in_filenames:
+            if file[-2:] == "h5":
+                partition_pyDart_file(file, new_file, bin_seconds = options.partition)
+            else:
+                print("\n pyDart:  ERROR!!  Can only partition HDF5 pyDART files, skipping %s" % file)
+
+    if options.migrate:
+        if options.file[-2:] == "h5":
+            if options.output:
+                new_file = options.output
+            else:
+                new_file = options.file[:-3] + "_v4.h5"
+            migrate_pyDart_file(options.file, new_file)
+        else:
+            print("\n pyDart:  ERROR!!  Can only migrate an HDF5 pyDART file, exiting...")
+            sys.exit(-1)
+
     if options.merge and options.file:
         if len(in_filenames) > 2:
             mergeTables(options.file, in_filenames)